@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmarks for pennywise, run against synthetic datasets in SQLite. Run the
+suite and save results with::
+
+    python -m benchmarks --size small --output results.json
+
+and compare a later run against saved results with::
+
+    python -m benchmarks --size small --compare results.json --threshold 0.2
+
+The comparison exits with status 1 if any benchmark is slower by more than
+the threshold, or issues more SQL statements than before. Check that the
+main queries use indexes rather than full table scans with::
+
+    python -m benchmarks --plans
+"""
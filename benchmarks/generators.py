@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+
+"""
+Generators for synthetic datasets: users with default ledger trees, deep
+custom hierarchies and multi-split, multi-currency transactions. All
+generators take a seed, so datasets are the same from run to run.
+"""
+
+import random
+from collections import deque
+from datetime import datetime, timedelta
+from decimal import Decimal
+from flask import Flask
+from pennywise.models import db, Commodity, COMMODITY_TYPE, Ledger, LEDGER_TYPE
+from pennywise.ledgers import make_default_ledgers
+from pennywise.transactions import post_transactions
+from pennywise.prices import PriceIndex
+
+#: Currencies used in generated datasets, with a fixed rate to the first
+CURRENCIES = [(u'INR', Decimal('1')), (u'USD', Decimal('0.016')), (u'EUR', Decimal('0.015')),
+    (u'GBP', Decimal('0.013'))]
+
+#: Titles of the default ledgers that generated transactions post to
+LEAF_TITLES = [u'Cash', u'Bank', u'Credit Card', u'Salary', u'Hobbies', u'Gifts', u'Rent', u'EMI', u'Food',
+    u'Shopping']
+
+
+def create_app(database='sqlite://'):
+    """
+    Return a Flask app with a fresh pennywise database. The app context is
+    pushed and stays active.
+    """
+    app = Flask('pennywise.benchmarks')
+    app.config['SQLALCHEMY_DATABASE_URI'] = database
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+
+    @app.route('/ledger/<uuid>')
+    def ledger(uuid):
+        return u''
+
+    app.test_request_context().push()
+    db.drop_all()
+    db.create_all()
+    return app
+
+
+def make_currencies():
+    """
+    Return a dictionary of symbol to :class:`Commodity` for :data:`CURRENCIES`.
+    """
+    currencies = Commodity.get_or_create_many(COMMODITY_TYPE.CURRENCY, [symbol for symbol, rate in CURRENCIES])
+    db.session.add_all(currencies.values())
+    db.session.commit()
+    return currencies
+
+
+def make_users(count, currencies, seed=0):
+    """
+    Make users with the default ledger tree, each in one of the currencies.
+    Returns a list of user root ledgers.
+    """
+    rnd = random.Random(seed)
+    symbols = sorted(currencies.keys())
+    users = []
+    for number in range(count):
+        userledger = Ledger(title=u'User %d' % number, ledger_type=LEDGER_TYPE.USER,
+            commodity=currencies[rnd.choice(symbols)])
+        db.session.add(userledger)
+        make_default_ledgers(userledger)
+        users.append(userledger)
+    db.session.commit()
+    return users
+
+
+def make_hierarchy(parent, count, breadth=10, ledger_type=LEDGER_TYPE.EXPENSE):
+    """
+    Add a hierarchy of ``count`` ledgers below the parent, filled breadth first
+    with ``breadth`` children per ledger. A breadth of 2 makes a deep tree.
+    Ledgers with children are placeholders. Returns the ledgers without children.
+    """
+    queue = deque([parent])
+    added = 0
+    while added < count:
+        ledger = queue.popleft()
+        for number in range(min(breadth, count - added)):
+            child = Ledger(parent=ledger, title=u'%s %d' % (ledger.title, number), ledger_type=ledger_type,
+                commodity=parent.commodity)
+            db.session.add(child)
+            queue.append(child)
+            added += 1
+        ledger.placeholder = True
+    db.session.commit()
+    return list(queue)
+
+
+def leaf_ledgers(userledger):
+    """
+    Return the user's default ledgers that transactions post to.
+    """
+    return Ledger.query.filter(Ledger.parent_id.in_(
+        [ledger.id for ledger in Ledger.query.filter_by(parent_id=userledger.id)]),
+        Ledger.title.in_(LEAF_TITLES)).order_by(Ledger.id).all()
+
+
+def transaction_batches(ledgers, currencies, count, batchsize=1000, splits=4,
+        start=datetime(2010, 1, 1), days=3 * 365, seed=0):
+    """
+    Generate ``count`` transactions as batches for
+    :func:`pennywise.transactions.post_transactions`. Each transaction has two
+    to ``splits`` splits between randomly chosen ledgers and is in a randomly
+    chosen currency. Splits in ledgers of another currency get a converted
+    quantity.
+
+    :param ledgers: List of ledgers to post to, or a list of such lists. Each
+        transaction stays within one list
+    :param currencies: Dictionary of symbol to :class:`Commodity`
+    """
+    rnd = random.Random(seed)
+    if ledgers and not isinstance(ledgers[0], (list, tuple)):
+        ledgers = [ledgers]
+    rates = dict(CURRENCIES)
+    symbols = sorted(currencies.keys())
+    ledger_symbols = dict([(ledger, ledger.commodity.symbol) for group in ledgers for ledger in group])
+    batch = []
+    for number in range(count):
+        group = rnd.choice(ledgers)
+        symbol = rnd.choice(symbols)
+        values = [Decimal(rnd.randint(1, 1000000)) / 100 for split in range(rnd.randint(1, splits - 1))]
+        values.append(-sum(values))
+        items = []
+        for value, ledger in zip(values, rnd.sample(group, len(values))):
+            quantity = value
+            if ledger_symbols[ledger] != symbol:
+                quantity = (value * rates[ledger_symbols[ledger]] / rates[symbol]).quantize(Decimal('0.01'))
+            items.append((ledger, value, quantity))
+        batch.append({
+            'commodity': currencies[symbol],
+            'splits': items,
+            'datetime': start + timedelta(seconds=rnd.randint(0, days * 86400)),
+            'description': u'Transaction %d' % number,
+            })
+        if len(batch) >= batchsize:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def price_rows(currencies, count, start=datetime(2000, 1, 1), seed=0):
+    """
+    Generate ``count`` prices of the other currencies in the first, as
+    (commodity, currency, datetime, rate) tuples. Each pair has a price every
+    minute, varying around the rate in :data:`CURRENCIES`.
+    """
+    rnd = random.Random(seed)
+    base = currencies[CURRENCIES[0][0]]
+    pairs = [(currencies[symbol], Decimal(1) / rate) for symbol, rate in CURRENCIES[1:]]
+    for number in range(count):
+        commodity, rate = pairs[number % len(pairs)]
+        yield (commodity, base, start + timedelta(minutes=number // len(pairs)),
+            (rate * Decimal(rnd.randint(9000, 11000)) / 10000).quantize(Decimal('0.0001')))
+
+
+def price_batches(currencies, count, batchsize=10000, start=datetime(2000, 1, 1), seed=0):
+    """
+    Generate ``count`` prices as batches of CSV lines for
+    :func:`pennywise.prices.load_prices`.
+    """
+    batch = []
+    for commodity, currency, when, rate in price_rows(currencies, count, start, seed):
+        batch.append('%s,%s,%s,%s' % (when.strftime('%Y-%m-%d %H:%M:%S'), commodity.symbol, currency.symbol,
+            rate))
+        if len(batch) >= batchsize:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def make_price_index(currencies, count, seed=0):
+    """
+    Return a :class:`~pennywise.prices.PriceIndex` of ``count`` generated prices.
+    """
+    index = PriceIndex()
+    for commodity, currency, when, rate in price_rows(currencies, count, seed=seed):
+        index.add(commodity.id, currency.id, when, rate)
+    return index
+
+
+def make_dataset(users=10, ledgers=100, transactions=10000, breadth=10, deep=1000, prices=0, seed=0):
+    """
+    Make a dataset of users with default ledger trees, a custom hierarchy of
+    ``ledgers`` expense ledgers below the first user's Expenses ledger, and
+    ``transactions`` transactions spread between the users. The last user also
+    gets a deep hierarchy of ``deep`` ledgers with two children each, without
+    transactions. ``prices`` prices are generated into an in-memory index.
+
+    :returns: Dictionary with ``currencies``, ``users``, ``ledgers`` (each
+        user's leaf ledgers), ``hierarchy`` (the first user's custom ledgers
+        without children) and ``prices`` (a price index)
+    """
+    currencies = make_currencies()
+    userledgers = make_users(users, currencies, seed)
+    leaves = [leaf_ledgers(userledger) for userledger in userledgers]
+    expenses = Ledger.query.filter_by(parent_id=userledgers[0].id, title=u'Expenses').one()
+    hierarchy = make_hierarchy(expenses, ledgers, breadth)
+    leaves[0] = leaves[0] + hierarchy
+    for batch in transaction_batches(leaves, currencies, transactions, seed=seed):
+        post_transactions(batch)
+    db.session.commit()
+    if deep:
+        make_hierarchy(Ledger.query.filter_by(parent_id=userledgers[-1].id, title=u'Expenses').one(), deep, 2)
+    return {'currencies': currencies, 'users': userledgers, 'ledgers': leaves, 'hierarchy': hierarchy,
+        'prices': make_price_index(currencies, prices, seed)}
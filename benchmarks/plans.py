@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+
+"""
+Query plan checks. The statements issued by the main register, balance and
+report operations are captured and explained, and any full scan of the
+transaction, split or snapshot tables is a failure. Supports SQLite and
+PostgreSQL. PostgreSQL prefers sequential scans on small tables, so they
+are disabled while explaining.
+"""
+
+import re
+from datetime import datetime
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from pennywise.models import db, Transaction, TransactionSplit
+from pennywise.ledgers import balance_at, get_register
+from pennywise import reports
+
+#: Plan lines that show a full scan of a table, by dialect
+FULL_SCANS = {
+    'sqlite': re.compile(r'\bSCAN (TABLE )?"?(transaction|transaction_split|ledger_snapshot)\b'),
+    'postgresql': re.compile(r'\bSeq Scan on "?(transaction|transaction_split|ledger_snapshot)\b'),
+    }
+
+
+def capture(func):
+    """
+    Return the (statement, parameters) of every SQL statement the function issues.
+    """
+    statements = []
+
+    def listener(conn, cursor, statement, parameters, context, executemany):
+        statements.append((statement, parameters))
+    event.listen(Engine, 'before_cursor_execute', listener)
+    try:
+        func()
+    finally:
+        event.remove(Engine, 'before_cursor_execute', listener)
+    return statements
+
+
+def explain(statement, parameters):
+    """
+    Return the query plan of a statement as a list of lines.
+    """
+    connection = db.session.connection()
+    cursor = connection.connection.cursor()
+    try:
+        if connection.dialect.name == 'sqlite':
+            cursor.execute('EXPLAIN QUERY PLAN ' + statement, parameters)
+            return [row[-1] for row in cursor.fetchall()]
+        if connection.dialect.name == 'postgresql':
+            cursor.execute('SET LOCAL enable_seqscan = off')
+        cursor.execute('EXPLAIN ' + statement, parameters)
+        return [row[0] for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+
+def checks(dataset):
+    """
+    Return a list of (name, function) operations to check over the dataset.
+    """
+    userledger = dataset['users'][0]
+    bank = [ledger for ledger in dataset['ledgers'][0] if ledger.title == u'Bank'][0]
+    transaction_id = db.session.query(TransactionSplit.transaction_id).filter_by(ledger_id=bank.id).first()[0]
+    buid = db.session.query(Transaction.buid).filter_by(id=transaction_id).scalar()
+    middle = get_register(bank, limit=10)[-1]['key']
+    boundaries = reports.month_boundaries(datetime(2010, 1, 1), 36)
+
+    def lazyload(instance, attr):
+        db.session.expire(instance, [attr])
+        return list(getattr(instance, attr))
+
+    result = [
+        ('ledger_splits', lambda: lazyload(bank, 'splits')),
+        ('transaction_splits', lambda: lazyload(Transaction.query.get(transaction_id), 'splits')),
+        ('transaction_buid', lambda: Transaction.query.filter_by(buid=buid).one()),
+        ('transaction_date_range', lambda: Transaction.query.filter(
+            Transaction.datetime >= datetime(2011, 1, 1), Transaction.datetime < datetime(2011, 2, 1)).order_by(
+            Transaction.datetime, Transaction.id).all()),
+        ('register_first_page', lambda: get_register(bank)),
+        ('register_middle_page', lambda: get_register(bank, after=middle)),
+        ('balance_at', lambda: balance_at(bank, datetime(2011, 6, 15))),
+        ]
+    if reports.numpy is not None:
+        result.append(('period_movements', lambda: reports.period_movements(reports.LedgerTree(userledger),
+            boundaries)))
+    return result
+
+
+def check_plans(dataset, log=None):
+    """
+    Explain the statements of every check and look for full table scans.
+
+    :returns: List of (name, statement, plan) for statements with full scans
+    """
+    dialect = db.session.connection().dialect.name
+    if dialect not in FULL_SCANS:
+        raise ValueError("Query plans can't be checked on %s" % dialect)
+    failures = []
+    for name, func in checks(dataset):
+        statements = capture(func)
+        failed = False
+        for statement, parameters in statements:
+            plan = explain(statement, parameters)
+            if [line for line in plan if FULL_SCANS[dialect].search(line)]:
+                failures.append((name, statement, plan))
+                failed = True
+        if log is not None:
+            log.write('%-24s %s\n' % (name, 'FULL SCAN' if failed else 'ok'))
+    return failures
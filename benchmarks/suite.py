@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+
+"""
+Benchmark suite. Each benchmark is run once to warm up, once with
+:mod:`pennywise.instrument` enabled to count SQL statements, and then timed
+over several runs.
+"""
+
+import argparse
+import json
+import platform
+import random
+import sys
+import warnings
+from datetime import datetime, timedelta
+from time import time
+import sqlalchemy
+from sqlalchemy.exc import SAWarning
+from pennywise import instrument
+from pennywise.models import db, Transaction, TransactionSplit
+from pennywise.ledgers import get_ledgers, get_balances, balance_at, get_register
+from pennywise.transactions import post_transactions
+from pennywise.prices import load_prices
+from pennywise import reports
+from benchmarks.generators import CURRENCIES, create_app, make_dataset, transaction_batches, price_batches
+from benchmarks.plans import check_plans
+
+#: Dataset sizes: number of users, ledgers in the custom hierarchy, transactions and prices
+SIZES = {
+    'small': {'users': 10, 'ledgers': 100, 'transactions': 10000, 'prices': 100000},
+    'medium': {'users': 100, 'ledgers': 1000, 'transactions': 200000, 'prices': 1000000},
+    'large': {'users': 1000, 'ledgers': 10000, 'transactions': 2000000, 'prices': 1000000},
+    }
+
+#: Relative slowdown above which a benchmark is a regression
+THRESHOLD = 0.2
+
+
+def measure(func, repeat=5):
+    """
+    Run a function once to warm up, once with instrumentation to count its SQL
+    statements, then ``repeat`` times to time it.
+
+    :returns: Dictionary with ``seconds`` (median), ``min`` and ``statements``
+    """
+    func()
+    instrument.reset()
+    instrument.enable()
+    try:
+        with instrument.span('benchmark'):
+            func()
+    finally:
+        instrument.disable()
+    statements = instrument.get_stats().get('benchmark', {}).get('statements', 0)
+    times = []
+    for run in range(repeat):
+        started = time()
+        func()
+        times.append(time() - started)
+    times.sort()
+    return {'seconds': times[len(times) // 2], 'min': times[0], 'statements': statements}
+
+
+def post_bulk(batch):
+    """
+    Post transactions with :func:`pennywise.transactions.post_transactions`.
+    """
+    post_transactions(batch)
+    db.session.commit()
+
+
+def post_deferred(batch):
+    """
+    Post transactions to the journal, leaving balances for the materializer.
+    """
+    post_transactions(batch, deferred=True)
+    db.session.commit()
+
+
+def post_orm(batch):
+    """
+    Post transactions one object at a time, as before bulk posting.
+    """
+    for item in batch:
+        transaction = Transaction(commodity=item['commodity'], datetime=item['datetime'],
+            description=item['description'])
+        for ledger, value, quantity in item['splits']:
+            split = TransactionSplit(transaction=transaction, ledger=ledger, value=value, quantity=quantity)
+            ledger.addSplitValue(split)
+        transaction.validate()
+        db.session.add(transaction)
+    db.session.commit()
+
+
+def benchmarks(dataset, repeat=5):
+    """
+    Return a list of (name, function) benchmarks over the dataset. Posting
+    benchmarks have enough new transactions for every run in :func:`measure`.
+    """
+    userledger = dataset['users'][0]
+    ledgers = dataset['ledgers'][0]
+    bank = [ledger for ledger in ledgers if ledger.title == u'Bank'][0]
+    when = datetime(2011, 6, 15)
+    count = TransactionSplit.query.filter_by(ledger_id=bank.id).count()
+    middle = get_register(bank, limit=count // 2)[-1]['key'] if count > 1 else None
+    bulk = transaction_batches(ledgers, dataset['currencies'], 1000 * (repeat + 2), batchsize=1000, seed=1)
+    deferred = transaction_batches(ledgers, dataset['currencies'], 1000 * (repeat + 2), batchsize=1000, seed=3)
+    orm = transaction_batches(ledgers, dataset['currencies'], 100 * (repeat + 2), batchsize=100, seed=2)
+    # New prices for every run, dated after the generated ones
+    loads = price_batches(dataset['currencies'], 10000 * (repeat + 2), batchsize=10000,
+        start=datetime(2020, 1, 1), seed=4)
+    index = dataset['prices']
+    base = dataset['currencies'][CURRENCIES[0][0]].id
+    rnd = random.Random(5)
+    others = [dataset['currencies'][symbol].id for symbol, rate in CURRENCIES[1:]]
+    lookups = [(rnd.choice(others), datetime(2000, 1, 1) + timedelta(minutes=rnd.randint(0,
+        len(index) // len(others)))) for number in range(10000)]
+
+    result = [
+        ('get_ledgers', lambda: get_ledgers(userledger)),
+        ('get_ledgers_default', lambda: get_ledgers(dataset['users'][1])),
+        ('get_ledgers_deep', lambda: get_ledgers(dataset['users'][-1])),
+        ('get_balances', lambda: get_balances(userledger)),
+        ('balance_at', lambda: balance_at(bank, when)),
+        ('register_first_page', lambda: get_register(bank, limit=100)),
+        ('register_middle_page', lambda: get_register(bank, after=middle, limit=100)),
+        ('post_bulk_1000', lambda: post_bulk(next(bulk))),
+        ('post_deferred_1000', lambda: post_deferred(next(deferred))),
+        ('post_orm_100', lambda: post_orm(next(orm))),
+        ('price_lookup_10000', lambda: [index.rate(commodity_id, base, when) for commodity_id, when in lookups]),
+        ('load_prices_10000', lambda: (load_prices(next(loads)), db.session.commit())),
+        ('get_balances_valued', lambda: get_balances(dataset['users'][1], index.valuation(base, when),
+            when=when)),
+        ]
+    if reports.numpy is not None:
+        boundaries = reports.month_boundaries(datetime(2010, 1, 1), 36)
+        result.extend([
+            ('balance_sheet_36', lambda: reports.balance_sheet(userledger, boundaries)),
+            ('income_statement_36', lambda: reports.income_statement(userledger, boundaries)),
+            ])
+    return result
+
+
+def run(size='small', database='sqlite://', repeat=5, only=None, log=None):
+    """
+    Generate a dataset of the given size and run the benchmarks.
+
+    :returns: Dictionary with ``meta`` (size and versions) and ``results``
+        (benchmark name to measurements)
+    """
+    create_app(database)
+    started = time()
+    dataset = make_dataset(**SIZES[size])
+    meta = {
+        'size': size,
+        'generated': time() - started,
+        'date': datetime.utcnow().isoformat(),
+        'python': platform.python_version(),
+        'sqlalchemy': sqlalchemy.__version__,
+        }
+    results = {}
+    for name, func in benchmarks(dataset, repeat):
+        if only and name not in only:
+            continue
+        results[name] = measure(func, repeat)
+        if log is not None:
+            log.write('%-24s %10.6fs %6d statements\n' % (name, results[name]['seconds'],
+                results[name]['statements']))
+    return {'meta': meta, 'results': results}
+
+
+def compare(baseline, current, threshold=THRESHOLD):
+    """
+    Compare results against a baseline. A benchmark regresses if its median
+    time grows by more than the threshold, or it issues more statements.
+
+    :returns: List of (name, baseline, current, reason) tuples for regressions
+    """
+    regressions = []
+    for name, result in sorted(current['results'].items()):
+        before = baseline['results'].get(name)
+        if before is None:
+            continue
+        if before['seconds'] and result['seconds'] > before['seconds'] * (1 + threshold):
+            regressions.append((name, before, result, 'slower by %.0f%%' % (
+                (result['seconds'] / before['seconds'] - 1) * 100)))
+        elif result['statements'] > before['statements']:
+            regressions.append((name, before, result, '%d statements, was %d' % (
+                result['statements'], before['statements'])))
+    return regressions
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(prog='python -m benchmarks', description="Run pennywise benchmarks.")
+    parser.add_argument('--size', choices=sorted(SIZES.keys()), default='small', help="Dataset size")
+    parser.add_argument('--database', default='sqlite://', help="Database URI. Its tables will be recreated")
+    parser.add_argument('--repeat', type=int, default=5, help="Timed runs per benchmark")
+    parser.add_argument('--only', action='append', help="Only run the named benchmark (repeatable)")
+    parser.add_argument('--output', help="Save results to this JSON file")
+    parser.add_argument('--compare', help="Compare with results saved in this JSON file")
+    parser.add_argument('--threshold', type=float, default=THRESHOLD,
+        help="Relative slowdown that counts as a regression")
+    parser.add_argument('--plans', action='store_true',
+        help="Check query plans for full table scans instead of timing")
+    options = parser.parse_args(args)
+    # SQLite stores Decimals as floats, which is fine for timing
+    warnings.filterwarnings('ignore', "Dialect sqlite", SAWarning)
+
+    if options.plans:
+        create_app(options.database)
+        failures = check_plans(make_dataset(**SIZES[options.size]), log=sys.stdout)
+        for name, statement, plan in failures:
+            sys.stdout.write('\nFULL SCAN in %s:\n%s\n  %s\n' % (name, statement, '\n  '.join(plan)))
+        return 1 if failures else 0
+
+    current = run(options.size, options.database, options.repeat, options.only, log=sys.stdout)
+    if options.output:
+        with open(options.output, 'w') as output:
+            json.dump(current, output, indent=2, sort_keys=True)
+    if options.compare:
+        with open(options.compare) as baseline:
+            regressions = compare(json.load(baseline), current, options.threshold)
+        for name, before, result, reason in regressions:
+            sys.stdout.write('REGRESSION %-24s %s\n' % (name, reason))
+        if regressions:
+            return 1
+    return 0
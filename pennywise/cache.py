@@ -0,0 +1,331 @@
+# -*- coding: utf-8 -*-
+
+"""
+Read-through cache for ledger trees and balances. Entries are kept per user
+root ledger in a process-local LRU cache, optionally backed by a cache
+shared between processes, and are invalidated when the session changes a
+ledger or split in that tree. Trees that this process hasn't read are
+found with a query, so writers invalidate entries that other processes
+have cached.
+
+Ledger ids are only unique within a database, so with
+:class:`~pennywise.shards.ShardRouter` the cache needs to know each
+session's shard, and keys its entries by shard::
+
+    cache = LedgerCache(shared=backend, shard=router.shard_of)
+"""
+
+import pickle
+from collections import namedtuple
+from threading import Lock
+from uuid import uuid4
+from sqlalchemy import event, literal
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import get_history
+from pennywise.models import db, Ledger, TransactionSplit
+from pennywise.ledgers import get_ledgers, get_balances, _flask_url
+from pennywise import transactions
+from pennywise.transactions import IN_CHUNK_SIZE, _chunks
+
+#: Ledger attributes that affect the tree returned by :func:`get_ledgers`
+TREE_ATTRIBUTES = ['title', 'hidden', 'placeholder', 'parent_id']
+
+
+class LRUCache(object):
+    """
+    Thread-safe in-process cache that discards the least recently used
+    entries beyond a maximum size.
+    """
+    def __init__(self, maxsize=1000):
+        self.maxsize = maxsize
+        #: Key to its link in a circular list of [previous, next, key, value],
+        #: least recently used first. OrderedDict needs Python 2.7
+        self._entries = {}
+        self._root = []
+        self._root[:] = [self._root, self._root, None, None]
+        self._lock = Lock()
+
+    def _unlink(self, link):
+        link[0][1] = link[1]
+        link[1][0] = link[0]
+
+    def _append(self, link):
+        last = self._root[0]
+        link[0] = last
+        link[1] = self._root
+        last[1] = self._root[0] = link
+
+    def get(self, key):
+        with self._lock:
+            link = self._entries.get(key)
+            if link is None:
+                return None
+            self._unlink(link)
+            self._append(link)
+            return link[3]
+
+    def set(self, key, value):
+        with self._lock:
+            link = self._entries.pop(key, None)
+            if link is not None:
+                self._unlink(link)
+            link = [None, None, key, value]
+            self._append(link)
+            self._entries[key] = link
+            while len(self._entries) > self.maxsize:
+                oldest = self._root[1]
+                self._unlink(oldest)
+                del self._entries[oldest[2]]
+
+    def delete(self, key):
+        with self._lock:
+            link = self._entries.pop(key, None)
+            if link is not None:
+                self._unlink(link)
+
+
+class DictBackend(object):
+    """
+    Local stand-in for a shared cache backend such as Redis or Memcached, for
+    tests and single-process use. Values are pickled like a real backend would.
+    Any object with the same ``get``, ``set`` and ``delete`` methods can be
+    used as a shared backend.
+    """
+    def __init__(self):
+        self._entries = {}
+
+    def get(self, key):
+        value = self._entries.get(key)
+        if value is not None:
+            return pickle.loads(value)
+
+    def set(self, key, value):
+        self._entries[key] = pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+
+class LedgerCache(object):
+    """
+    Cache of ledger trees and rolled-up balances per user root ledger.
+
+    With a shared backend, each tree has a version in the shared cache that
+    changes when the tree is invalidated, so entries in the local caches of
+    other processes are never served once stale.
+
+    :param local: Local cache, defaulting to an :class:`LRUCache`
+    :param shared: Optional shared backend with ``get``, ``set`` and ``delete``
+    :param str prefix: Prefix for cache keys
+    :param shard: Function that returns the shard name for a session, such as
+        :meth:`ShardRouter.shard_of <pennywise.shards.ShardRouter.shard_of>`,
+        for databases that are sharded. Required if ledgers in different
+        shards can have the same id, which they usually do
+    :param int maxroots: Number of ledgers to remember the root of. Roots of
+        others are looked up when they change
+    """
+    def __init__(self, local=None, shared=None, prefix='pennywise', shard=None, maxroots=100000):
+        self.local = local if local is not None else LRUCache()
+        self.shared = shared
+        self.prefix = prefix
+        self.shard = shard
+        #: Root ledger id by (shard, ledger id), for ledgers in cached trees
+        self._roots = LRUCache(maxroots)
+        #: Roots changed in the current database transaction, per session
+        self._pending = {}
+        self._lock = Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    def stats(self):
+        """
+        Return a dictionary of hit, miss and invalidation counts.
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'invalidations': self.invalidations}
+
+    def _shard(self, session):
+        return self.shard(session) if self.shard is not None else None
+
+    def _key(self, kind, root_id, shard=None):
+        if shard is None:
+            return '%s/%s/%s' % (self.prefix, kind, root_id)
+        return '%s/%s/%s/%s' % (self.prefix, shard, kind, root_id)
+
+    def _version(self, root_id, shard=None):
+        if self.shared is None:
+            return None
+        key = self._key('version', root_id, shard)
+        version = self.shared.get(key)
+        if version is None:
+            version = uuid4().hex
+            self.shared.set(key, version)
+        return version
+
+    def _get(self, kind, userledger, compute, ledger_ids):
+        session = object_session(userledger)
+        shard = self._shard(session if session is not None else db.session)
+        version = self._version(userledger.id, shard)
+        key = self._key(kind, userledger.id, shard)
+        entry = self.local.get(key)
+        if entry is None or entry[0] != version:
+            entry = self.shared.get(key) if self.shared is not None else None
+            if entry is None or entry[0] != version:
+                with self._lock:
+                    self.misses += 1
+                value = compute(userledger)
+                entry = (version, value)
+                if self.shared is not None:
+                    self.shared.set(key, entry)
+            else:
+                with self._lock:
+                    self.hits += 1
+            for ledger_id in ledger_ids(entry[1]):
+                self._roots.set((shard, ledger_id), userledger.id)
+            self.local.set(key, entry)
+        else:
+            with self._lock:
+                self.hits += 1
+        return entry[1]
+
+    def get_ledgers(self, userledger, url=None):
+        """
+        Return the user's ledger tree as from :func:`pennywise.ledgers.get_ledgers`,
+        with ``ledger_id``, ``uuid`` and ``title`` in place of ledger objects.
+        URLs depend on the request, so they are not cached.
+
+        :param url: Optional function that returns the URL for a ledger, given
+            an object with its ``id``, ``uuid`` and ``title``. Defaults to the
+            Flask app's ``ledger`` view, as in :func:`~pennywise.ledgers.get_ledgers`
+        """
+        rows = self._get('tree', userledger, _serialize_tree, lambda rows: [row['ledger_id'] for row in rows])
+        if url is None:
+            url = _flask_url()
+        result = []
+        for row in rows:
+            row = dict(row)
+            row['url'] = url(_CachedLedger(row['ledger_id'], row['uuid'], row['title'])) if url is not None else None
+            result.append(row)
+        return result
+
+    def get_balances(self, userledger):
+        """
+        Return the user's rolled-up balances as from :func:`pennywise.ledgers.get_balances`.
+        """
+        return self._get('balances', userledger, get_balances, lambda balances: balances.keys())
+
+    def invalidate(self, root_id, tree=True, shard=None):
+        """
+        Discard cached balances for a user root ledger, and the tree too unless
+        ``tree`` is False.
+
+        :param shard: Name of the root ledger's shard, if sharded
+        """
+        with self._lock:
+            self.invalidations += 1
+        kinds = ['balances', 'tree'] if tree else ['balances']
+        for kind in kinds:
+            self.local.delete(self._key(kind, root_id, shard))
+            if self.shared is not None:
+                self.shared.delete(self._key(kind, root_id, shard))
+        if self.shared is not None:
+            self.shared.set(self._key('version', root_id, shard), uuid4().hex)
+
+    def _resolve(self, session, ledger_ids):
+        """
+        Find the root ledgers of ledgers this process hasn't cached a tree for,
+        which other processes may have, with one query per chunk. Returns the
+        session's shard.
+        """
+        shard = self._shard(session)
+        unknown = sorted(set([ledger_id for ledger_id in ledger_ids
+            if ledger_id is not None and self._roots.get((shard, ledger_id)) is None]))
+        for chunk in _chunks(unknown, IN_CHUNK_SIZE):
+            ancestors = session.query(Ledger.id.label('id'), Ledger.parent_id.label('parent_id'),
+                Ledger.id.label('start'), literal(0).label('depth')).filter(Ledger.id.in_(chunk)).cte(
+                name='ancestors', recursive=True)
+            ancestors = ancestors.union_all(session.query(Ledger.id, Ledger.parent_id, ancestors.c.start,
+                ancestors.c.depth + 1).filter(Ledger.id == ancestors.c.parent_id))
+            depths = {}
+            for ledger_id, start, depth in session.query(ancestors.c.id, ancestors.c.start, ancestors.c.depth):
+                if depth >= depths.get(start, -1):
+                    depths[start] = depth
+                    self._roots.set((shard, start), ledger_id)
+        return shard
+
+    def invalidate_ledgers(self, ledger_ids, tree=False, session=None):
+        """
+        Discard cached entries for the trees containing any of the given
+        ledgers, in the session's shard.
+        """
+        shard = self._resolve(session if session is not None else db.session, ledger_ids)
+        roots = set([self._roots.get((shard, ledger_id)) for ledger_id in ledger_ids])
+        roots.discard(None)
+        for root_id in roots:
+            self.invalidate(root_id, tree, shard)
+
+    def listen(self, session):
+        """
+        Invalidate entries when the session flushes changes to ledgers or splits,
+        and again when it commits. Also invalidates on bulk balance updates by
+        :mod:`pennywise.transactions`.
+
+        :param session: Session, session class or scoped session to listen to
+        """
+        event.listen(session, 'after_flush', self._after_flush)
+        event.listen(session, 'after_commit', self._after_commit)
+        event.listen(session, 'after_soft_rollback', self._after_commit)
+        transactions.balance_listeners.append(self._bulk_update)
+
+    def _bulk_update(self, ledger_ids):
+        shard = self._resolve(db.session, ledger_ids)
+        changed = self._pending.setdefault(None, {})
+        for ledger_id in ledger_ids:
+            root_id = self._roots.get((shard, ledger_id))
+            if root_id is not None:
+                changed.setdefault((shard, root_id), False)
+        self.invalidate_ledgers(ledger_ids)
+
+    def _after_flush(self, session, context):
+        changed = self._pending.setdefault(id(session), {})
+        ledger_ids = []
+        for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(instance, Ledger):
+                ledger_ids.extend([instance.id, instance.parent_id])
+            elif isinstance(instance, TransactionSplit):
+                ledger_ids.append(instance.ledger_id)
+        shard = self._resolve(session, ledger_ids)
+        for instance in list(session.new) + list(session.dirty) + list(session.deleted):
+            if isinstance(instance, Ledger):
+                tree = instance in session.new or instance in session.deleted or any(
+                    [get_history(instance, attr).has_changes() for attr in TREE_ATTRIBUTES])
+                for ledger_id in (instance.id, instance.parent_id):
+                    root_id = self._roots.get((shard, ledger_id))
+                    if root_id is not None:
+                        changed[(shard, root_id)] = changed.get((shard, root_id), False) or tree
+            elif isinstance(instance, TransactionSplit):
+                root_id = self._roots.get((shard, instance.ledger_id))
+                if root_id is not None:
+                    changed.setdefault((shard, root_id), False)
+        for (shard, root_id), tree in changed.items():
+            self.invalidate(root_id, tree, shard)
+
+    def _after_commit(self, session, *args):
+        # Entries may have been refilled from before the commit. Bulk updates
+        # don't say which session they were in
+        changed = self._pending.pop(None, {})
+        for key, tree in self._pending.pop(id(session), {}).items():
+            changed[key] = changed.get(key, False) or tree
+        for (shard, root_id), tree in changed.items():
+            self.invalidate(root_id, tree, shard)
+
+
+#: Ledger in a cached tree, as passed to URL functions
+_CachedLedger = namedtuple('_CachedLedger', ['id', 'uuid', 'title'])
+
+
+def _serialize_tree(userledger):
+    return [{'level': row['level'], 'hidden': row['hidden'], 'ledger_id': row['ledger'].id,
+        'uuid': row['ledger'].uuid, 'title': row['ledger'].title}
+        for row in get_ledgers(userledger, url=lambda ledger: None)]
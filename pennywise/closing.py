@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+
+"""
+Closing periods. Transactions before the close are moved to archive tables
+and replaced by a single opening balance transaction per ledger, so the live
+tables only hold the open period.
+"""
+
+from sqlalchemy import func, select
+from pennywise.models import (db, Ledger, Transaction, TransactionSplit, LedgerSnapshot,
+    ArchivedTransaction, ArchivedTransactionSplit)
+from pennywise.ledgers import _subtree
+from pennywise.instrument import instrumented
+from pennywise.transactions import IN_CHUNK_SIZE, update_balances, post_transactions
+
+TRANSACTION_COLUMNS = ['id', 'buid', 'datetime', 'num', 'description', 'commodity_id', 'disabled',
+    'fingerprint']
+SPLIT_COLUMNS = ['id', 'ledger_id', 'transaction_id', 'reconciled', 'reconciled_date', 'value', 'quantity']
+
+
+@instrumented('close_period')
+def close_period(userledger, cutoff, openingledger=None):
+    """
+    Close all of a user's transactions dated before the cutoff. Each ledger's
+    balance as of the cutoff is posted as a single opening balance transaction
+    against the Opening Balances ledger, dated at the cutoff, and the original
+    transactions and splits are moved to :class:`ArchivedTransaction` and
+    :class:`ArchivedTransactionSplit`. Ledger balances are unchanged.
+
+    Snapshots before the cutoff are discarded, so :func:`pennywise.ledgers.balance_at`
+    only answers for dates in the open period. Transactions are assumed not to
+    cross between users.
+
+    :param userledger: The user's root ledger
+    :param cutoff: Start of the open period. Must be the start of a snapshot period
+    :param openingledger: Ledger to post opening balances against. Defaults
+        to the user's Opening Balances ledger
+    :returns: Number of transactions archived
+    :raises ValueError: If the cutoff is not the start of a period, or there is
+        no opening balances ledger
+    """
+    if LedgerSnapshot.period_start(cutoff) != cutoff:
+        raise ValueError("Periods can only be closed at the start of a snapshot period")
+    db.session.flush()
+    tree = _subtree(userledger)
+    if openingledger is None:
+        openingledger = db.session.query(Ledger).join(tree, Ledger.id == tree.c.id).filter(
+            Ledger.title == u'Opening Balances').first()
+        if openingledger is None:
+            raise ValueError("There is no Opening Balances ledger")
+
+    transactions = Transaction.__table__
+    splits = TransactionSplit.__table__
+    archived_transactions = ArchivedTransaction.__table__
+    archived_splits = ArchivedTransactionSplit.__table__
+
+    closing = select([transactions.c[column] for column in TRANSACTION_COLUMNS]).where(db.and_(
+        transactions.c.datetime < cutoff,
+        transactions.c.id.in_(select([splits.c.transaction_id]).where(
+            splits.c.ledger_id.in_(select([tree.c.id])))))).order_by(transactions.c.id)
+    # Not all drivers report a row count for INSERT ... SELECT
+    count = db.session.query(func.count()).select_from(closing.alias()).scalar()
+    db.session.execute(archived_transactions.insert().from_select(TRANSACTION_COLUMNS, closing))
+    # Everything archived before the cutoff. Transactions archived by an
+    # earlier close are no longer in the live tables, so this is safe
+    archived = select([archived_transactions.c.id]).where(archived_transactions.c.datetime < cutoff)
+
+    totals = dict(db.session.query(TransactionSplit.ledger_id, func.sum(TransactionSplit.value)).join(
+        Transaction, TransactionSplit.transaction_id == Transaction.id).filter(
+        TransactionSplit.transaction_id.in_(archived), Transaction.disabled == False).group_by(
+        TransactionSplit.ledger_id))
+
+    db.session.execute(archived_splits.insert().from_select(SPLIT_COLUMNS,
+        select([splits.c[column] for column in SPLIT_COLUMNS]).where(
+            splits.c.transaction_id.in_(archived)).order_by(splits.c.id)))
+    db.session.execute(splits.delete().where(splits.c.transaction_id.in_(archived)))
+    db.session.execute(transactions.delete().where(transactions.c.id.in_(archived)))
+    update_balances(dict([(ledger_id, -total) for ledger_id, total in totals.items()]))
+    db.session.execute(LedgerSnapshot.__table__.delete().where(db.and_(
+        LedgerSnapshot.__table__.c.ledger_id.in_(select([tree.c.id])),
+        LedgerSnapshot.__table__.c.start < cutoff)))
+    db.session.expire_all()
+
+    # Opening balances bring ledger balances back to where they were
+    ledger_ids = sorted([ledger_id for ledger_id, total in totals.items()
+        if total != 0 and ledger_id != openingledger.id])
+    ledgers = []
+    for start in range(0, len(ledger_ids), IN_CHUNK_SIZE):
+        ledgers.extend(Ledger.query.filter(Ledger.id.in_(ledger_ids[start:start + IN_CHUNK_SIZE])))
+    post_transactions([{
+        'commodity': ledger.commodity,
+        'datetime': cutoff,
+        'description': u'Opening balance',
+        'splits': [(ledger, totals[ledger.id]), (openingledger, -totals[ledger.id])],
+        } for ledger in sorted(ledgers, key=lambda ledger: ledger.id)])
+    return count
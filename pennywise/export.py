@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+
+"""
+Columnar export of transaction splits for analytics. Rows are streamed from
+the database cursor straight into column arrays without building ORM
+objects. Requires NumPy, and PyArrow for Arrow record batches.
+"""
+
+from sqlalchemy import select
+from pennywise.models import db, Ledger, Transaction, TransactionSplit
+from pennywise.ledgers import _subtree
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+#: Exported columns and their NumPy types. ``commodity_id`` is the commodity
+#: of the transaction, which ``value`` is in. ``quantity`` is in the commodity
+#: of the ledger
+COLUMNS = [
+    ('split_id', 'int64'),
+    ('transaction_id', 'int64'),
+    ('datetime', 'datetime64[us]'),
+    ('ledger_id', 'int64'),
+    ('ledger_type', 'int16'),
+    ('ledger_subtype', 'int16'),
+    ('commodity_id', 'int64'),
+    ('value', 'float64'),
+    ('quantity', 'float64'),
+    ('disabled', 'bool'),
+    ('reconciled', 'bool'),
+    ]
+
+
+def _splits_query(userledger=None, start=None, end=None):
+    splits = TransactionSplit.__table__
+    transactions = Transaction.__table__
+    ledgers = Ledger.__table__
+    query = select([
+        splits.c.id, splits.c.transaction_id, transactions.c.datetime, splits.c.ledger_id,
+        ledgers.c.ledger_type, ledgers.c.ledger_subtype, transactions.c.commodity_id,
+        splits.c.value, splits.c.quantity, transactions.c.disabled, splits.c.reconciled,
+        ]).select_from(splits.join(transactions, splits.c.transaction_id == transactions.c.id).join(
+        ledgers, splits.c.ledger_id == ledgers.c.id))
+    if userledger is not None:
+        tree = _subtree(userledger)
+        query = query.where(splits.c.ledger_id.in_(select([tree.c.id])))
+    if start is not None:
+        query = query.where(transactions.c.datetime >= start)
+    if end is not None:
+        query = query.where(transactions.c.datetime < end)
+    return query.order_by(transactions.c.datetime, splits.c.id)
+
+
+def iter_split_columns(userledger=None, start=None, end=None, batchsize=100000, arrow=False):
+    """
+    Stream splits with their transaction date, ledger type and commodity as
+    column arrays, in batches of up to ``batchsize`` rows ordered by date.
+
+    :param userledger: Only export splits in this user's ledgers
+    :param start: Only export transactions on or after this date
+    :param end: Only export transactions before this date
+    :param int batchsize: Number of rows per batch
+    :param bool arrow: Yield :class:`pyarrow.RecordBatch` objects instead of
+        dictionaries of column name to NumPy array
+    :raises ImportError: If NumPy (or PyArrow, if requested) is not installed
+    """
+    if numpy is None:
+        raise ImportError("NumPy is required for columnar export")
+    if arrow and pyarrow is None:
+        raise ImportError("PyArrow is required for Arrow export")
+    result = db.session.connection().execution_options(stream_results=True).execute(
+        _splits_query(userledger, start, end))
+    try:
+        while True:
+            rows = result.fetchmany(batchsize)
+            if not rows:
+                break
+            columns = list(zip(*rows))
+            arrays = [numpy.array(column, dtype=dtype) for column, (name, dtype) in zip(columns, COLUMNS)]
+            if arrow:
+                yield pyarrow.RecordBatch.from_arrays([pyarrow.array(array) for array in arrays],
+                    [name for name, dtype in COLUMNS])
+            else:
+                yield dict([(name, array) for (name, dtype), array in zip(COLUMNS, arrays)])
+    finally:
+        result.close()
+
+
+def export_splits(userledger=None, start=None, end=None, arrow=False):
+    """
+    Export all matching splits at once, as a dictionary of column name to
+    NumPy array or as a :class:`pyarrow.Table`. Takes the same parameters as
+    :func:`iter_split_columns`.
+    """
+    batches = list(iter_split_columns(userledger, start, end, arrow=arrow))
+    if arrow:
+        if not batches:
+            return pyarrow.Table.from_arrays([pyarrow.array(numpy.array([], dtype=dtype)) for name, dtype in COLUMNS],
+                [name for name, dtype in COLUMNS])
+        return pyarrow.Table.from_batches(batches)
+    if not batches:
+        return dict([(name, numpy.array([], dtype=dtype)) for name, dtype in COLUMNS])
+    return dict([(name, numpy.concatenate([batch[name] for batch in batches])) for name, dtype in COLUMNS])
@@ -0,0 +1,302 @@
+# -*- coding: utf-8 -*-
+
+"""
+Import bank statements. Statements are parsed and posted as a stream, in
+fixed-size chunks. Beyond the current chunk, only a counter for each distinct
+statement line is kept in memory.
+"""
+
+import csv
+import hashlib
+import math
+from datetime import datetime, timedelta
+from decimal import Decimal
+from itertools import islice
+from pennywise.models import (db, Transaction, TransactionSplit, ArchivedTransaction,
+    ArchivedTransactionSplit)
+from pennywise.transactions import IN_CHUNK_SIZE, post_transactions
+
+#: Default CSV column headers for each statement field
+CSV_COLUMNS = {
+    'date': u'Date',
+    'description': u'Description',
+    'amount': u'Amount',
+    'num': u'Num',
+    }
+
+
+def _text(value, encoding='utf-8'):
+    # The Python 2 csv module returns bytes
+    if isinstance(value, bytes):
+        value = value.decode(encoding)
+    return (value or u'').strip()
+
+
+def _amount(value):
+    value = value.replace(u',', u'')
+    if not value:
+        return Decimal(0)
+    return Decimal(value)
+
+
+def read_csv(fileobj, columns=None, dateformat='%Y-%m-%d', encoding='utf-8'):
+    """
+    Parse a CSV bank statement with a header row. Yields statement lines as
+    {datetime, amount, description, num} dictionaries. Positive amounts are
+    deposits into the account.
+
+    :param fileobj: Open CSV file
+    :param columns: Dictionary of field name to column header, overriding
+        :data:`CSV_COLUMNS`. Statements with separate withdrawal and deposit
+        columns can map ``debit`` and ``credit`` instead of ``amount``
+    :param dateformat: :func:`~datetime.datetime.strptime` format of dates
+    :param encoding: Encoding of the file (for Python 2)
+    """
+    mapping = dict(CSV_COLUMNS)
+    if columns:
+        mapping.update(columns)
+        if 'debit' in columns or 'credit' in columns:
+            mapping.pop('amount', None)
+    header = None
+    for row in csv.reader(fileobj):
+        row = [_text(cell, encoding) for cell in row]
+        if header is None:
+            header = dict([(name, index) for index, name in enumerate(row)])
+            continue
+        if not any(row):
+            continue
+        values = dict([(field, row[header[name]]) for field, name in mapping.items() if name in header])
+        if 'amount' in mapping:
+            amount = _amount(values.get('amount', u''))
+        else:
+            amount = _amount(values.get('credit', u'')) - _amount(values.get('debit', u''))
+        yield {
+            'datetime': datetime.strptime(values['date'], dateformat),
+            'amount': amount,
+            'description': values.get('description', u''),
+            'num': values.get('num', u''),
+            }
+
+
+def read_qif(fileobj, dateformat='%m/%d/%Y', encoding='utf-8'):
+    """
+    Parse a QIF bank statement. Yields statement lines in the same format as
+    :func:`read_csv`.
+
+    :param fileobj: Open QIF file
+    :param dateformat: :func:`~datetime.datetime.strptime` format of dates.
+        Apostrophes in dates (as in ``12/31'12``) are read as slashes
+    :param encoding: Encoding of the file (for Python 2)
+    """
+    record = {}
+    for line in fileobj:
+        line = _text(line, encoding)
+        if not line or line.startswith(u'!'):
+            continue
+        code, value = line[0], line[1:].strip()
+        if code == u'^':
+            if 'datetime' in record:
+                record.setdefault('amount', Decimal(0))
+                record.setdefault('description', u'')
+                record.setdefault('num', u'')
+                yield record
+            record = {}
+        elif code == u'D':
+            record['datetime'] = datetime.strptime(value.replace(u"'", u'/'), dateformat)
+        elif code in (u'T', u'U'):
+            record['amount'] = _amount(value)
+        elif code == u'P':
+            record['description'] = value
+        elif code == u'M' and not record.get('description'):
+            record['description'] = value
+        elif code == u'N':
+            record['num'] = value
+
+
+def _identity(when, amount, description, num):
+    """
+    Return what identifies a statement line in its fingerprint: the date, the
+    amount, and the bank's reference number if there is one, otherwise the
+    description, ignoring case and spacing.
+    """
+    if num:
+        identity = num
+    else:
+        identity = u' '.join(description.lower().split())
+    return u'%s|%s|%s' % (when.strftime('%Y-%m-%d'), Decimal(amount).quantize(Decimal('0.001')), identity)
+
+
+def fingerprint(ledger_id, when, amount, description, num, occurrence=0):
+    """
+    Return a fingerprint for a statement line, for detecting lines that have
+    been imported before. The bank's reference number is used if there is one,
+    otherwise the description, ignoring case and spacing. Identical lines within
+    one statement are told apart by their occurrence.
+    """
+    key = u'%s|%s|%d' % (ledger_id, _identity(when, amount, description, num), occurrence)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+
+class BloomFilter(object):
+    """
+    Set membership test that may report false positives but never false
+    negatives, in a fraction of the memory of a set.
+
+    :param int capacity: Number of items expected to be added
+    :param float error_rate: Acceptable rate of false positives
+    """
+    def __init__(self, capacity, error_rate=0.01):
+        capacity = max(capacity, 1)
+        self.size = int(math.ceil(-capacity * math.log(error_rate) / (math.log(2) ** 2)))
+        self.hashes = max(int(round(self.size / float(capacity) * math.log(2))), 1)
+        self.bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, key):
+        # Double hashing: derive all positions from two halves of one digest
+        digest = hashlib.md5(key.encode('utf-8')).hexdigest()
+        first, second = int(digest[:16], 16), int(digest[16:], 16)
+        return [(first + i * second) % self.size for i in range(self.hashes)]
+
+    def add(self, key):
+        for position in self._positions(key):
+            self.bits[position // 8] |= 1 << (position % 8)
+
+    def __contains__(self, key):
+        for position in self._positions(key):
+            if not self.bits[position // 8] & (1 << (position % 8)):
+                return False
+        return True
+
+
+class Deduplicator(object):
+    """
+    Filter out transactions that have been imported into a ledger before,
+    by fingerprint. Fingerprints already in the ledger are loaded into a
+    :class:`BloomFilter`, for the dates of the transactions being filtered
+    only, since the fingerprint includes the date. Only transactions that may
+    be duplicates are then checked against the database, with one query per
+    batch. Transactions archived by closing a period are included.
+
+    :param ledger: Ledger being imported into
+    :param int capacity: Number of fingerprints to size the filter for. More
+        fingerprints may be added, at the cost of more false positives
+    """
+    def __init__(self, ledger, capacity=1000000):
+        self.ledger_id = ledger.id
+        self.bloom = BloomFilter(capacity)
+        # Range of dates loaded so far, as [start, end)
+        self.start = self.end = None
+
+    def load(self, start, end):
+        """
+        Load fingerprints of transactions dated from ``start`` up to (not
+        including) ``end`` into the filter
+        """
+        # Include transactions archived when closing a period
+        query = db.session.query(Transaction.fingerprint).join(
+            TransactionSplit, TransactionSplit.transaction_id == Transaction.id).filter(
+            TransactionSplit.ledger_id == self.ledger_id, Transaction.fingerprint != None,
+            Transaction.datetime >= start, Transaction.datetime < end).union_all(
+            db.session.query(ArchivedTransaction.fingerprint).join(
+                ArchivedTransactionSplit, ArchivedTransactionSplit.transaction_id == ArchivedTransaction.id).filter(
+                ArchivedTransactionSplit.ledger_id == self.ledger_id, ArchivedTransaction.fingerprint != None,
+                ArchivedTransaction.datetime >= start, ArchivedTransaction.datetime < end))
+        for (existing,) in query.yield_per(10000):
+            self.bloom.add(existing)
+
+    def _cover(self, transactions):
+        # Extend the loaded range to the days of these transactions
+        days = [item['datetime'].date() for item in transactions]
+        start = datetime.combine(min(days), datetime.min.time())
+        end = datetime.combine(max(days), datetime.min.time()) + timedelta(days=1)
+        if self.start is None:
+            self.load(start, end)
+            self.start, self.end = start, end
+            return
+        if start < self.start:
+            self.load(start, self.start)
+            self.start = start
+        if end > self.end:
+            self.load(self.end, end)
+            self.end = end
+
+    def filter(self, transactions):
+        """
+        Return the transactions that aren't duplicates, and remember them
+        """
+        if not transactions:
+            return []
+        self._cover(transactions)
+        candidates = sorted(set([item['fingerprint'] for item in transactions
+            if item['fingerprint'] in self.bloom]))
+        duplicates = set()
+        for start in range(0, len(candidates), IN_CHUNK_SIZE):
+            chunk = candidates[start:start + IN_CHUNK_SIZE]
+            duplicates.update([existing for (existing,) in db.session.query(Transaction.fingerprint).filter(
+                Transaction.fingerprint.in_(chunk)).union_all(db.session.query(
+                ArchivedTransaction.fingerprint).filter(ArchivedTransaction.fingerprint.in_(chunk)))])
+        result = [item for item in transactions if item['fingerprint'] not in duplicates]
+        for item in result:
+            self.bloom.add(item['fingerprint'])
+        return result
+
+
+def statement_transactions(lines, ledger, counterledger):
+    """
+    Convert statement lines into two-split transactions between the ledger the
+    statement is for (such as a bank account) and a counter ledger, in the
+    format accepted by :func:`~pennywise.transactions.post_transactions`.
+    Each transaction is given a :func:`fingerprint`.
+
+    Identical lines are told apart by counting them over the whole statement,
+    so they need not be in date order.
+    """
+    # Identity: occurrences so far
+    occurrences = {}
+    for line in lines:
+        key = _identity(line['datetime'], line['amount'], line['description'], line['num'])
+        occurrence = occurrences[key] = occurrences.get(key, -1) + 1
+        yield {
+            'commodity': ledger.commodity,
+            'datetime': line['datetime'],
+            'description': line['description'],
+            'num': line['num'],
+            'fingerprint': fingerprint(ledger.id, line['datetime'], line['amount'],
+                line['description'], line['num'], occurrence),
+            'splits': [(ledger, line['amount']), (counterledger, -line['amount'])],
+            }
+
+
+def import_statement(lines, ledger, counterledger, chunksize=1000, progress=None, deduplicate=True):
+    """
+    Post statement lines as transactions in fixed-size chunks. Lines with a
+    zero amount are skipped, as are lines that were imported into this ledger
+    before, unless ``deduplicate`` is False. The database transaction is not
+    committed; a progress callback may commit after each chunk.
+
+    :param lines: Iterable of statement lines, from :func:`read_csv` or :func:`read_qif`
+    :param ledger: Ledger the statement is for
+    :param counterledger: Ledger for the other side of each transaction
+    :param int chunksize: Number of transactions to post at a time
+    :param progress: Optional function called with the number of transactions
+        posted so far after each chunk
+    :param bool deduplicate: Skip lines that have been imported before
+    :returns: Number of transactions posted
+    """
+    db.session.flush()
+    transactions = statement_transactions((line for line in lines if line['amount'] != 0),
+        ledger, counterledger)
+    deduplicator = Deduplicator(ledger) if deduplicate else None
+    count = 0
+    while True:
+        chunk = list(islice(transactions, chunksize))
+        if not chunk:
+            break
+        if deduplicator is not None:
+            chunk = deduplicator.filter(chunk)
+        if chunk:
+            post_transactions(chunk)
+            count += len(chunk)
+        if progress is not None:
+            progress(count)
+    return count
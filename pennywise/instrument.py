@@ -0,0 +1,234 @@
+# -*- coding: utf-8 -*-
+
+"""
+Opt-in instrumentation of pennywise operations. When enabled, every
+instrumented operation records its calls and time, and the SQL statements
+(with their time) issued while it runs, including those of nested
+operations. Flushes are recorded as the ``flush`` operation.
+
+Instrumentation is off by default. When off, instrumented functions only
+check a flag and no SQLAlchemy event listeners are installed.
+"""
+
+import logging
+import threading
+from contextlib import contextmanager
+from functools import wraps
+from time import time
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+__all__ = ['enable', 'disable', 'span', 'instrumented', 'get_stats', 'reset', 'LogExporter',
+    'PrometheusExporter']
+
+#: Whether instrumentation is enabled
+enabled = False
+
+try:
+    from contextvars import ContextVar
+except ImportError:  # Python < 3.7
+    ContextVar = None
+
+_local = threading.local()
+_lock = threading.Lock()
+#: Operation name: [calls, seconds, statements, statement seconds]
+_stats = {}
+
+# Operations running, as a tuple of (name, started) tokens. Coroutines on one
+# thread each get their own context, and so their own stack
+_context = ContextVar('pennywise.instrument', default=()) if ContextVar is not None else None
+
+
+def _stack():
+    if _context is not None:
+        return _context.get()
+    return getattr(_local, 'stack', ())
+
+
+def _set_stack(stack):
+    if _context is not None:
+        _context.set(stack)
+    else:
+        _local.stack = stack
+
+
+def _record(name, calls=0, seconds=0.0, statements=0, statement_seconds=0.0):
+    with _lock:
+        stats = _stats.setdefault(name, [0, 0.0, 0, 0.0])
+        stats[0] += calls
+        stats[1] += seconds
+        stats[2] += statements
+        stats[3] += statement_seconds
+
+
+def _start(name):
+    token = (name, time())
+    _set_stack(_stack() + (token,))
+    return token
+
+
+def _stop(token):
+    name, started = token
+    # Operations don't always end in the order they started, as with
+    # interleaved flushes, so remove this exact token wherever it is
+    stack = _stack()
+    for index in range(len(stack) - 1, -1, -1):
+        if stack[index] is token:
+            _set_stack(stack[:index] + stack[index + 1:])
+            break
+    _record(name, calls=1, seconds=time() - started)
+
+
+@contextmanager
+def span(name):
+    """
+    Context manager that records a call to the named operation.
+    """
+    if not enabled:
+        yield
+        return
+    token = _start(name)
+    try:
+        yield
+    finally:
+        _stop(token)
+
+
+def instrumented(name):
+    """
+    Decorator that records calls to the decorated function as the named operation.
+    """
+    def decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            if not enabled:
+                return f(*args, **kwargs)
+            token = _start(name)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                _stop(token)
+        return wrapper
+    return decorator
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    # On the connection, which runs one statement at a time, as coroutines
+    # on one thread run statements on their own connections at once
+    conn.info['pennywise.statement'] = time()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = conn.info.pop('pennywise.statement', None)
+    if started is None:
+        return
+    elapsed = time() - started
+    # Statements count towards every operation they were issued within
+    for name in set([name for name, started in _stack()]):
+        _record(name, statements=1, statement_seconds=elapsed)
+
+
+def _before_flush(session, context, instances):
+    _after_flush_postexec(session, context)
+    session.info['pennywise.flush'] = _start('flush')
+
+
+def _after_flush_postexec(session, context):
+    token = session.info.pop('pennywise.flush', None)
+    if token is not None:
+        _stop(token)
+
+
+def _after_soft_rollback(session, previous_transaction):
+    # A flush that fails rolls back without reaching after_flush_postexec
+    _after_flush_postexec(session, None)
+
+
+_listeners = [
+    (Engine, 'before_cursor_execute', _before_cursor_execute),
+    (Engine, 'after_cursor_execute', _after_cursor_execute),
+    (Session, 'before_flush', _before_flush),
+    (Session, 'after_flush_postexec', _after_flush_postexec),
+    (Session, 'after_soft_rollback', _after_soft_rollback),
+    ]
+
+
+def enable():
+    """
+    Enable instrumentation and install SQLAlchemy event listeners for all
+    engines and sessions.
+    """
+    global enabled
+    if not enabled:
+        for target, name, listener in _listeners:
+            event.listen(target, name, listener)
+        enabled = True
+
+
+def disable():
+    """
+    Disable instrumentation and remove the event listeners. Recorded stats are kept.
+    """
+    global enabled
+    if enabled:
+        for target, name, listener in _listeners:
+            event.remove(target, name, listener)
+        enabled = False
+
+
+def get_stats():
+    """
+    Return a dictionary of operation name to a dictionary of ``calls``,
+    ``seconds``, ``statements`` and ``statement_seconds``.
+    """
+    with _lock:
+        return dict([(name, {'calls': stats[0], 'seconds': stats[1], 'statements': stats[2],
+            'statement_seconds': stats[3]}) for name, stats in _stats.items()])
+
+
+def reset():
+    """
+    Discard recorded stats.
+    """
+    with _lock:
+        _stats.clear()
+
+
+class LogExporter(object):
+    """
+    Export stats to a logger, one line per operation.
+    """
+    def __init__(self, logger=None, level=logging.INFO):
+        self.logger = logger or logging.getLogger('pennywise.instrument')
+        self.level = level
+
+    def export(self, stats=None):
+        if stats is None:
+            stats = get_stats()
+        for name, values in sorted(stats.items()):
+            self.logger.log(self.level, "%s: %d calls in %.3fs, %d statements in %.3fs",
+                name, values['calls'], values['seconds'], values['statements'], values['statement_seconds'])
+
+
+class PrometheusExporter(object):
+    """
+    Export stats in the Prometheus text exposition format.
+    """
+    METRICS = [
+        ('calls', 'pennywise_operation_calls_total', 'Calls to each operation'),
+        ('seconds', 'pennywise_operation_seconds_total', 'Time spent in each operation'),
+        ('statements', 'pennywise_sql_statements_total', 'SQL statements issued within each operation'),
+        ('statement_seconds', 'pennywise_sql_seconds_total', 'Time spent in SQL within each operation'),
+        ]
+
+    def export(self, stats=None):
+        if stats is None:
+            stats = get_stats()
+        lines = []
+        for key, metric, description in self.METRICS:
+            lines.append('# HELP %s %s' % (metric, description))
+            lines.append('# TYPE %s counter' % metric)
+            for name, values in sorted(stats.items()):
+                lines.append('%s{operation="%s"} %s' % (metric, name, values[key]))
+        return '\n'.join(lines) + '\n'
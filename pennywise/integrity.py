@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+
+"""
+Integrity checks for transactions and ledger balances. All checks run as
+aggregate queries in the database and only mismatches are returned.
+"""
+
+from decimal import Decimal
+from sqlalchemy import func
+from pennywise.models import db, Ledger, Transaction, TransactionSplit, JournalEntry, JournalWatermark
+from pennywise.transactions import update_balances
+from pennywise.journal import WATERMARK
+
+#: Smallest difference that counts as a mismatch. Balances have three
+#: decimal places, so anything smaller is rounding in the database
+TOLERANCE = Decimal('0.0005')
+
+
+def _touched(since):
+    return db.session.query(TransactionSplit.transaction_id).filter(TransactionSplit.id > since)
+
+
+def unbalanced_transactions(since=None):
+    """
+    Yield (transaction id, split total, split count) for every transaction
+    whose splits don't sum to zero or that has fewer than two splits,
+    including transactions without any splits.
+
+    :param since: Only check transactions with splits added after this split
+        id. Transactions without splits are only found by a full check
+    """
+    total = func.coalesce(func.sum(TransactionSplit.value), 0)
+    count = func.count(TransactionSplit.id)
+    query = db.session.query(Transaction.id, total, count).outerjoin(
+        TransactionSplit, TransactionSplit.transaction_id == Transaction.id).group_by(
+        Transaction.id).having(db.or_(func.abs(total) > TOLERANCE, count < 2))
+    if since is not None:
+        query = query.filter(Transaction.id.in_(_touched(since)))
+    for transaction_id, total, count in query.yield_per(1000):
+        yield transaction_id, Decimal(total), count
+
+
+def drifted_balances(since=None):
+    """
+    Yield (ledger id, stored balance, actual balance) for every ledger whose
+    stored balance doesn't match the sum of its enabled splits. Changes in the
+    posting journal that haven't been materialized yet are not drift, and
+    are left out of the actual balance.
+
+    :param since: Only check ledgers with splits added after this split id
+    """
+    totals = db.session.query(TransactionSplit.ledger_id.label('ledger_id'),
+        func.sum(TransactionSplit.value).label('total')).join(
+        Transaction, TransactionSplit.transaction_id == Transaction.id).filter(
+        Transaction.disabled == False)
+    if since is not None:
+        # Only add up the splits of touched ledgers, not every split
+        touched = db.session.query(TransactionSplit.ledger_id).filter(TransactionSplit.id > since)
+        totals = totals.filter(TransactionSplit.ledger_id.in_(touched))
+    totals = totals.group_by(TransactionSplit.ledger_id).subquery()
+    position = db.session.query(JournalWatermark.position).filter(
+        JournalWatermark.name == WATERMARK).as_scalar()
+    pending = db.session.query(JournalEntry.ledger_id.label('ledger_id'),
+        func.sum(JournalEntry.value).label('total')).filter(
+        JournalEntry.id > func.coalesce(position, 0)).group_by(JournalEntry.ledger_id).subquery()
+    actual = func.coalesce(totals.c.total, 0) - func.coalesce(pending.c.total, 0)
+    query = db.session.query(Ledger.id, Ledger.balance, actual).outerjoin(
+        totals, totals.c.ledger_id == Ledger.id).outerjoin(pending, pending.c.ledger_id == Ledger.id).filter(
+        func.abs(Ledger.balance - actual) > TOLERANCE)
+    if since is not None:
+        query = query.filter(Ledger.id.in_(touched))
+    for ledger_id, balance, total in query.yield_per(1000):
+        yield ledger_id, Decimal(balance), Decimal(total)
+
+
+def repair_balances(drifts):
+    """
+    Correct drifted ledger balances in bulk. Corrections are applied as
+    increments, so postings made since the drift was found are preserved.
+
+    :param drifts: Iterable of (ledger id, stored balance, actual balance), as
+        from :func:`drifted_balances`
+    :returns: Number of ledgers repaired
+    """
+    deltas = dict([(ledger_id, actual - balance) for ledger_id, balance, actual in drifts])
+    update_balances(deltas)
+    db.session.expire_all()
+    return len(deltas)
+
+
+def verify(since=None, repair=False):
+    """
+    Check all transactions and ledger balances, or only those touched since a
+    previous run.
+
+    Checks are incremental by split id: pass the watermark returned by the
+    previous run as ``since`` to only re-check transactions and ledgers that
+    have had splits added since. Removed splits are only noticed by a full
+    check.
+
+    :param since: Watermark from a previous run
+    :param bool repair: Repair drifted balances
+    :returns: Tuple of (list of unbalanced transactions, list of drifted
+        balances, watermark for the next run)
+    """
+    watermark = db.session.query(func.max(TransactionSplit.id)).scalar() or 0
+    unbalanced = list(unbalanced_transactions(since))
+    drifted = list(drifted_balances(since))
+    if repair and drifted:
+        repair_balances(drifted)
+    return unbalanced, drifted, watermark
@@ -0,0 +1,430 @@
+# -*- coding: utf-8 -*-
+
+"""
+Append-only posting journal. Transactions posted with
+``post_transactions(batch, deferred=True)``, edited or deleted here append
+balance changes to the journal in bulk inserts, without updating (or
+waiting on locks for) ledger rows. :func:`materialize` applies the journal
+to balances and snapshots, and records how far it got as a watermark::
+
+    post_transactions(batch, deferred=True)
+    position = journal.position()
+    db.session.commit()
+    journal.wait(position)  # Balances now include the batch
+
+:func:`rebuild` recomputes balances and snapshots from transaction splits.
+
+On PostgreSQL, a posting that rolls back leaves a gap in journal ids, which
+stops :func:`materialize` (and makes :func:`wait` wait) until it is skipped.
+Deferred posting there needs ``max_posting_age`` set when materializing, or
+gaps skipped by hand with :func:`skip_gap`.
+"""
+
+import logging
+import sys
+import threading
+import time
+from datetime import datetime, timedelta
+from sqlalchemy import bindparam, func, select, union_all
+from sqlalchemy.orm import sessionmaker
+from pennywise.models import (db, Ledger, Transaction, TransactionSplit, LedgerSnapshot,
+    JOURNAL_EVENT, JournalEntry, JournalWatermark)
+from pennywise.instrument import instrumented
+from pennywise.transactions import (IN_CHUNK_SIZE, _chunks, _split, validate_transactions,
+    update_balances, update_snapshots, expire_balances, lock_ledgers)
+
+#: Name of the watermark of balances and snapshots
+WATERMARK = u'balances'
+
+logger = logging.getLogger('pennywise.journal')
+
+
+def append(entries, session=None):
+    """
+    Append entries to the journal with one bulk insert.
+
+    :param entries: List of dictionaries with the columns of :class:`JournalEntry`
+    :param session: Session to write in, defaulting to ``db.session``
+    """
+    if session is None:
+        session = db.session
+    if entries:
+        now = datetime.utcnow()
+        for entry in entries:
+            entry.setdefault('created', now)
+        session.execute(JournalEntry.__table__.insert(), entries)
+
+
+def position(session=None):
+    """
+    Return the id of the latest journal entry visible in the session. After
+    writing, this includes the session's own entries, and is the position to
+    :func:`wait` for after committing.
+    """
+    if session is None:
+        session = db.session
+    return session.query(func.max(JournalEntry.id)).scalar() or 0
+
+
+def watermark(session=None):
+    """
+    Return the id of the last journal entry applied to balances.
+    """
+    if session is None:
+        session = db.session
+    return session.query(JournalWatermark.position).filter_by(name=WATERMARK).scalar() or 0
+
+
+def wait(target, timeout=None, interval=0.05, session=None):
+    """
+    Wait until the journal has been applied up to a position, for
+    read-your-writes consistency after posting with ``deferred``. The
+    watermark is read on a new connection each time, so the session's own
+    transaction doesn't hide progress.
+
+    :param target: Position from :func:`position`
+    :param timeout: Seconds to wait, or None to wait indefinitely
+    :param interval: Seconds between checks
+    :returns: True if the position was reached, False on timeout
+    """
+    if session is None:
+        session = db.session
+    bind = session.connection().engine
+    table = JournalWatermark.__table__
+    query = select([table.c.position]).where(table.c.name == WATERMARK)
+    deadline = None if timeout is None else time.time() + timeout
+    while True:
+        with bind.connect() as connection:
+            if (connection.execute(query).scalar() or 0) >= target:
+                return True
+        if deadline is not None and time.time() >= deadline:
+            return False
+        time.sleep(interval)
+
+
+def _watermark(session):
+    """
+    Return the watermark row, locked against concurrent materializers.
+    """
+    state = session.query(JournalWatermark).filter_by(name=WATERMARK).with_for_update().first()
+    if state is None:
+        state = JournalWatermark(name=WATERMARK, position=0)
+        session.add(state)
+        session.flush()
+    return state
+
+
+def _accumulate(entries, balances, snapshots):
+    """
+    Add (ledger id, datetime, value) entries to balance and snapshot deltas.
+    """
+    for ledger_id, when, value in entries:
+        start = LedgerSnapshot.period_start(when)
+        balances[ledger_id] = balances.get(ledger_id, 0) + value
+        snapshots[(ledger_id, start)] = snapshots.get((ledger_id, start), 0) + value
+
+
+@instrumented('materialize_journal')
+def materialize(chunksize=10000, commit=False, session=None, max_posting_age=None):
+    """
+    Apply journal entries after the watermark to balances and snapshots, in
+    chunks of entries with one set-based update each, advancing the watermark
+    in the same database transaction. Concurrent runs wait for each other.
+
+    Entries are applied strictly in id order, and stop at the first missing
+    id, which may belong to a posting that hasn't committed yet. Ids left by
+    postings that rolled back (as on PostgreSQL, whose sequences don't roll
+    back) are only skipped with ``max_posting_age``, or by :func:`skip_gap`.
+
+    :param int chunksize: Number of entries per chunk
+    :param bool commit: Commit after every chunk
+    :param max_posting_age: Seconds that no posting transaction may run for.
+        Missing ids are skipped once the entry after them is older than
+        this, as their postings must have rolled back. Postings that run
+        longer lose their balance changes, so leave a wide margin. Required
+        for deferred posting on PostgreSQL
+    :param session: Session to update in, defaulting to ``db.session``
+    :returns: The new watermark
+    """
+    if session is None:
+        session = db.session
+    state = _watermark(session)
+    table = JournalEntry.__table__
+    while True:
+        rows = session.query(table.c.id, table.c.created, table.c.ledger_id, table.c.datetime,
+            table.c.value).filter(table.c.id > state.position).order_by(table.c.id).limit(chunksize).all()
+        settled = None if max_posting_age is None else datetime.utcnow() - timedelta(seconds=max_posting_age)
+        applied = state.position
+        entries = []
+        for row in rows:
+            if row.id != applied + 1:
+                if settled is None or row.created > settled:
+                    break
+                logger.warning("Skipping missing journal ids %d to %d", applied + 1, row.id - 1)
+            applied = row.id
+            entries.append((row.ledger_id, row.datetime, row.value))
+        if applied == state.position:
+            break
+        balances = {}
+        snapshots = {}
+        _accumulate(entries, balances, snapshots)
+        update_balances(balances, session)
+        update_snapshots(snapshots, session)
+        expire_balances(balances, session)
+        state.position = applied
+        session.flush()
+        if commit:
+            session.commit()
+            state = _watermark(session)
+        if len(entries) < len(rows) or len(rows) < chunksize:
+            break
+    return state.position
+
+
+def gap(session=None):
+    """
+    Return the gap that :func:`materialize` is stopped at, as the ids
+    missing after the watermark and the creation time of the next entry
+    (``first``, ``last``, ``created``), or None if there is no gap.
+    """
+    if session is None:
+        session = db.session
+    position = watermark(session)
+    row = session.query(JournalEntry.id, JournalEntry.created).filter(JournalEntry.id > position).order_by(
+        JournalEntry.id).first()
+    if row is None or row.id == position + 1:
+        return None
+    return position + 1, row.id - 1, row.created
+
+
+def skip_gap(last, session=None):
+    """
+    Advance the watermark past missing ids, up to and including ``last``,
+    once they are known to be from postings that rolled back. Skipping ids of
+    a posting that later commits loses its balance changes, so only skip ids
+    older than the longest posting transaction, such as by checking the
+    ``created`` time from :func:`gap`.
+
+    :param last: Last missing id to skip
+    :param session: Session to update in, defaulting to ``db.session``
+    :raises ValueError: If there are entries up to ``last`` that haven't
+        been applied
+    :returns: The new watermark
+    """
+    if session is None:
+        session = db.session
+    state = _watermark(session)
+    if last <= state.position:
+        return state.position
+    if session.query(JournalEntry.id).filter(JournalEntry.id > state.position,
+            JournalEntry.id <= last).first() is not None:
+        raise ValueError("Journal entries up to %d have not been applied" % last)
+    state.position = last
+    session.flush()
+    return state.position
+
+
+def delete_transactions(transaction_ids, session=None):
+    """
+    Delete transactions and their splits, journaling the reversal of their
+    balance changes. Transaction objects loaded in the session are not updated.
+
+    :param transaction_ids: Ids of the transactions to delete
+    :param session: Session to delete in, defaulting to ``db.session``
+    :returns: Number of transactions deleted
+    """
+    if session is None:
+        session = db.session
+    entries = []
+    count = 0
+    for chunk in _chunks(sorted(set(transaction_ids)), IN_CHUNK_SIZE):
+        for transaction_id, ledger_id, value, when, disabled in session.query(TransactionSplit.transaction_id,
+                TransactionSplit.ledger_id, TransactionSplit.value, Transaction.datetime,
+                Transaction.disabled).join(Transaction, TransactionSplit.transaction_id == Transaction.id).filter(
+                TransactionSplit.transaction_id.in_(chunk)).order_by(TransactionSplit.id):
+            if not disabled:
+                entries.append({'event': JOURNAL_EVENT.DELETE, 'transaction_id': transaction_id,
+                    'ledger_id': ledger_id, 'datetime': when, 'value': -value})
+        session.execute(TransactionSplit.__table__.delete().where(TransactionSplit.transaction_id.in_(chunk)))
+        count += session.execute(Transaction.__table__.delete().where(Transaction.id.in_(chunk))).rowcount
+    append(entries, session)
+    return count
+
+
+def edit_transactions(batch, session=None):
+    """
+    Change transactions, journaling the difference in their balance changes.
+    Each change is a dictionary with the transaction ``id`` and any of
+    ``datetime``, ``num``, ``description``, ``disabled`` and ``splits``, as
+    accepted by :func:`pennywise.transactions.post_transactions`. New splits
+    replace all existing splits, which lose their reconciliation.
+
+    :param batch: List of changes
+    :param session: Session to edit in, defaulting to ``db.session``
+    :raises ValueError: If a transaction doesn't exist or its new splits fail
+        validation, before anything is changed
+    """
+    if session is None:
+        session = db.session
+    validate_transactions([change for change in batch if 'splits' in change])
+    ids = sorted(set([change['id'] for change in batch]))
+    transactions = {}
+    splits = {}
+    for chunk in _chunks(ids, IN_CHUNK_SIZE):
+        for row in session.query(Transaction.id, Transaction.datetime, Transaction.num,
+                Transaction.description, Transaction.disabled).filter(Transaction.id.in_(chunk)):
+            transactions[row.id] = row
+        for transaction_id, ledger_id, value in session.query(TransactionSplit.transaction_id,
+                TransactionSplit.ledger_id, TransactionSplit.value).filter(
+                TransactionSplit.transaction_id.in_(chunk)).order_by(TransactionSplit.id):
+            splits.setdefault(transaction_id, []).append((ledger_id, value))
+    for change in batch:
+        if change['id'] not in transactions:
+            raise ValueError("Transaction %s does not exist" % change['id'])
+
+    entries = []
+    updates = []
+    replaced = []
+    inserts = []
+    for change in batch:
+        transaction_id = change['id']
+        old = transactions[transaction_id]
+        new = {
+            'transaction_id': transaction_id,
+            'transaction_datetime': change.get('datetime', old.datetime),
+            'transaction_num': change.get('num', old.num),
+            'transaction_description': change.get('description', old.description),
+            'transaction_disabled': change.get('disabled', old.disabled),
+            }
+        updates.append(new)
+        if 'splits' in change:
+            replaced.append(transaction_id)
+            new_splits = []
+            for ledger, value, quantity in [_split(split) for split in change['splits']]:
+                ledger_id = getattr(ledger, 'id', ledger)
+                new_splits.append((ledger_id, value))
+                inserts.append({'transaction_id': transaction_id, 'ledger_id': ledger_id,
+                    'value': value, 'quantity': quantity, 'reconciled': False})
+        elif new['transaction_datetime'] != old.datetime or new['transaction_disabled'] != old.disabled:
+            new_splits = splits.get(transaction_id, [])
+        else:
+            continue
+        if not old.disabled:
+            entries.extend([{'event': JOURNAL_EVENT.EDIT, 'transaction_id': transaction_id,
+                'ledger_id': ledger_id, 'datetime': old.datetime, 'value': -value}
+                for ledger_id, value in splits.get(transaction_id, [])])
+        if not new['transaction_disabled']:
+            entries.extend([{'event': JOURNAL_EVENT.EDIT, 'transaction_id': transaction_id,
+                'ledger_id': ledger_id, 'datetime': new['transaction_datetime'], 'value': value}
+                for ledger_id, value in new_splits])
+
+    table = Transaction.__table__
+    if updates:
+        session.execute(table.update().where(table.c.id == bindparam('transaction_id')).values(
+            datetime=bindparam('transaction_datetime'), num=bindparam('transaction_num'),
+            description=bindparam('transaction_description'), disabled=bindparam('transaction_disabled')),
+            updates)
+    for chunk in _chunks(replaced, IN_CHUNK_SIZE):
+        session.execute(TransactionSplit.__table__.delete().where(TransactionSplit.transaction_id.in_(chunk)))
+    if inserts:
+        session.execute(TransactionSplit.__table__.insert(), inserts)
+    append(entries, session)
+
+    mapper = Transaction.__mapper__
+    for transaction_id in ids:
+        transaction = session.identity_map.get(mapper.identity_key_from_primary_key([transaction_id]))
+        if transaction is not None:
+            session.expire(transaction)
+
+
+def _recompute(session, start, end, position):
+    """
+    Return the (balance, snapshot) corrections of ledgers with ids in
+    ``[start, end)``, from their enabled splits less journal entries that
+    haven't been applied yet.
+    """
+    splits = select([TransactionSplit.ledger_id, Transaction.datetime, TransactionSplit.value]).select_from(
+        TransactionSplit.__table__.join(Transaction.__table__, TransactionSplit.transaction_id == Transaction.id)
+        ).where(db.and_(Transaction.disabled == False, TransactionSplit.ledger_id >= start,
+            TransactionSplit.ledger_id < end))
+    pending = select([JournalEntry.ledger_id, JournalEntry.datetime, -JournalEntry.value]).where(
+        db.and_(JournalEntry.id > position, JournalEntry.ledger_id >= start, JournalEntry.ledger_id < end))
+    balances = {}
+    snapshots = {}
+    # One statement, so postings committed meanwhile are either in both or in neither
+    _accumulate(session.execute(union_all(splits, pending)), balances, snapshots)
+    for ledger_id, balance in session.query(Ledger.id, Ledger.balance).filter(
+            Ledger.id >= start, Ledger.id < end):
+        balances[ledger_id] = balances.get(ledger_id, 0) - balance
+    for ledger_id, period, value in session.query(LedgerSnapshot.ledger_id, LedgerSnapshot.start,
+            LedgerSnapshot.value).filter(LedgerSnapshot.ledger_id >= start, LedgerSnapshot.ledger_id < end):
+        snapshots[(ledger_id, period)] = snapshots.get((ledger_id, period), 0) - value
+    return (dict([(key, value) for key, value in balances.items() if value != 0]),
+        dict([(key, value) for key, value in snapshots.items() if value != 0]))
+
+
+@instrumented('rebuild_journal')
+def rebuild(workers=4, session=None):
+    """
+    Recompute ledger balances and snapshots from transaction splits, for
+    recovery after bad writes, and correct the ones that differ. Journal
+    entries that haven't been applied yet are left for :func:`materialize`.
+    Ledgers are split into id ranges recomputed in parallel, each in its own
+    thread and connection, and the corrections are written in the session's
+    transaction.
+
+    All ledgers are locked for the duration, so postings that update
+    balances directly wait, and ones in progress finish first. Pending
+    postings in the session must be committed first, as other connections
+    can't see them.
+
+    :param int workers: Number of ledger ranges to recompute in parallel. With
+        one, the ranges are recomputed in the session
+    :param session: Session to update in, defaulting to ``db.session``
+    :returns: Number of ledgers whose balance or snapshots were corrected
+    """
+    if session is None:
+        session = db.session
+    position = _watermark(session).position
+    ledger_ids = [ledger_id for ledger_id, in session.query(Ledger.id).order_by(Ledger.id)]
+    if not ledger_ids:
+        return 0
+    lock_ledgers(ledger_ids, session)
+    low, high = ledger_ids[0], ledger_ids[-1]
+    step = (high - low) // max(workers, 1) + 1
+    ranges = [(start, start + step) for start in range(low, high + 1, step)]
+
+    results = []
+    errors = []
+    if workers > 1:
+        factory = sessionmaker(bind=session.connection().engine)
+
+        def replay(start, end):
+            reader = factory()
+            try:
+                results.append(_recompute(reader, start, end, position))
+            except Exception:
+                errors.append(sys.exc_info()[1])
+            finally:
+                reader.close()
+
+        threads = [threading.Thread(target=replay, args=(start, end)) for start, end in ranges]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        if errors:
+            raise errors[0]
+    else:
+        results = [_recompute(session, start, end, position) for start, end in ranges]
+
+    corrected = set()
+    for balances, snapshots in results:
+        # Ranges don't overlap, so each correction is applied once
+        update_balances(balances, session)
+        update_snapshots(snapshots, session)
+        corrected.update(balances)
+        corrected.update([ledger_id for ledger_id, period in snapshots])
+    session.flush()
+    session.expire_all()
+    return len(corrected)
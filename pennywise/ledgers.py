@@ -4,53 +4,271 @@
 Operations on ledgers.
 """
 
-from flask import url_for
-from pennywise.models import db, Ledger, LEDGER_TYPE, LEDGER_SUBTYPE
-
-
-def get_ledgers(baseledger):
-    """
-    Return ledgers as an array of {level, ledger} dictionaries. Uses recursion.
-    """
-    def loop(base, level):
-        if base.title == 'Equity':
-            debug = True
-        else:
-            debug = False
-        hidden = base.hidden
-        if debug: print "hidden", base, base.hidden
-        result = [{'level': level, 'url': url_for('ledger', uuid=base.uuid), 'hidden': hidden, 'ledger': base}]
-        allsubhidden = True
-        for ledger in base.subledgers:
-            subledgers, subhidden = loop(ledger, level+1)
-            result.extend(subledgers)
-            # If current ledger is hidden, hide all subledgers (unless they are already hidden)
-            if hidden and not subhidden:
-                for r in result[1:]:
-                    r['hidden'] = True
-                subhidden = True
-            if not subhidden:
-                allsubhidden = False
-        # If this is a placeholder and everything below is hidden, hide this too
-        if base.placeholder and allsubhidden:
-            hidden = True
-            result[0]['hidden'] = True
-        return result, hidden
-    result, hidden = loop(baseledger, 0)
+from collections import namedtuple
+from decimal import Decimal
+from sqlalchemy import func, literal
+from pennywise.models import (db, Node, Ledger, LEDGER_TYPE, LEDGER_SUBTYPE, LedgerSnapshot,
+    Transaction, TransactionSplit)
+from pennywise.instrument import instrumented
+
+_Row = namedtuple('_Row', ['id', 'parent_id', 'commodity_id', 'balance', 'level'])
+
+
+def _subtree(baseledger, session=None):
+    """
+    Return a recursive CTE with the ids and levels of the given ledger and
+    all nodes below it.
+    """
+    if session is None:
+        session = db.session
+    tree = session.query(Node.id.label('id'), literal(0).label('level')).filter(
+        Node.id == baseledger.id).cte(name='subtree', recursive=True)
+    return tree.union_all(session.query(Node.id, tree.c.level + 1).filter(
+        Node.parent_id == tree.c.id))
+
+
+def get_ledger_tree(baseledger, session=None):
+    """
+    Load the given ledger and all ledgers below it in a single query. Returns
+    a dictionary of parent ledger id to the list of child ledgers.
+
+    :param session: Session to query in, defaulting to ``db.session``
+    """
+    if session is None:
+        session = db.session
+    tree = _subtree(baseledger, session)
+    children = {}
+    for ledger in session.query(Ledger).join(tree, Ledger.id == tree.c.id).filter(
+            Ledger.id != baseledger.id).order_by(Ledger.id):
+        children.setdefault(ledger.parent_id, []).append(ledger)
+    return children
+
+
+def _flask_url():
+    """
+    Return a function for ledger URLs from the Flask app's ``ledger`` view,
+    or ``None`` outside of a request or if the app has no such view. Flask is
+    only imported when needed.
+    """
+    try:
+        from flask import has_request_context, url_for
+        from werkzeug.routing import BuildError
+    except ImportError:
+        return None
+    if not has_request_context():
+        return None
+    try:
+        urltemplate = url_for('ledger', uuid='__uuid__')
+    except (BuildError, RuntimeError):
+        return None
+    return lambda ledger: urltemplate.replace('__uuid__', ledger.uuid)
+
+
+@instrumented('get_ledgers')
+def get_ledgers(baseledger, url=None, session=None):
+    """
+    Return ledgers as an array of {level, url, hidden, ledger} dictionaries.
+    The entire tree is loaded in a single query.
+
+    :param url: Optional function that returns the URL for a ledger. Defaults
+        to the Flask app's ``ledger`` view when there is an app context, and
+        otherwise URLs are ``None``
+    :param session: Session to query in, defaulting to ``db.session``
+    """
+    children = get_ledger_tree(baseledger, session)
+    if url is None:
+        url = _flask_url()
+
+    # Flatten the tree depth-first. Trees can be deep, so avoid recursion
+    ordered = []
+    stack = [(baseledger, 0)]
+    while stack:
+        base, level = stack.pop()
+        ordered.append((base, level))
+        stack.extend([(ledger, level + 1) for ledger in reversed(children.get(base.id, []))])
+
+    # Subledgers always follow their parent, so walking backwards visits them first.
+    # If this is a placeholder and everything below is hidden, hide this too
+    hidden = {}
+    for base, level in reversed(ordered):
+        hidden[base.id] = base.hidden or (base.placeholder and
+            all([hidden[ledger.id] for ledger in children.get(base.id, [])]))
+
+    # If a ledger is hidden, hide all subledgers (unless they are already hidden)
+    result = []
+    parents = []
+    for base, level in ordered:
+        del parents[level:]
+        rowhidden = hidden[base.id] or (level > 0 and parents[-1])
+        parents.append(rowhidden)
+        result.append({'level': level, 'url': url(base) if url is not None else None,
+            'hidden': rowhidden, 'ledger': base})
     return result
 
 
+@instrumented('get_balances')
+def get_balances(baseledger, valuation=None, session=None, when=None):
+    """
+    Return a dictionary of ledger id to the total balance of that ledger and
+    all ledgers below it, for the given ledger's entire tree. Uses a single
+    query.
+
+    :param valuation: Optional function that converts (commodity id, balance)
+        into a common currency before balances are added up, such as
+        :meth:`pennywise.prices.PriceIndex.valuation`
+    :param session: Session to query in, defaulting to ``db.session``
+    :param when: Optional date and time to return balances as of, from
+        snapshots and splits as in :func:`balance_at`, instead of current balances
+    """
+    if session is None:
+        session = db.session
+    tree = _subtree(baseledger, session)
+    if when is None:
+        rows = session.query(Ledger.id, Ledger.parent_id, Ledger.commodity_id, Ledger.balance,
+            tree.c.level).join(tree, Ledger.id == tree.c.id).all()
+    else:
+        start = LedgerSnapshot.period_start(when)
+        before = session.query(func.sum(LedgerSnapshot.value)).filter(
+            LedgerSnapshot.ledger_id == Ledger.id, LedgerSnapshot.start < start).correlate(Ledger).as_scalar()
+        during = session.query(func.sum(TransactionSplit.value)).join(
+            Transaction, TransactionSplit.transaction_id == Transaction.id).filter(
+            TransactionSplit.ledger_id == Ledger.id, Transaction.disabled == False,
+            Transaction.datetime >= start, Transaction.datetime <= when).correlate(Ledger).as_scalar()
+        rows = [_Row(row.id, row.parent_id, row.commodity_id, Decimal(row.before or 0) + Decimal(row.during or 0),
+            row.level) for row in session.query(Ledger.id, Ledger.parent_id, Ledger.commodity_id,
+            before.label('before'), during.label('during'), tree.c.level).join(tree, Ledger.id == tree.c.id)]
+    if valuation is None:
+        balances = dict([(row.id, row.balance) for row in rows])
+    else:
+        balances = dict([(row.id, valuation(row.commodity_id, row.balance)) for row in rows])
+    # Roll up from the deepest level, so subledgers are complete before they're added
+    for row in sorted(rows, key=lambda row: row.level, reverse=True):
+        if row.level > 0:
+            balances[row.parent_id] += balances[row.id]
+    return balances
+
+
+def _balance(ledger, when, condition, session):
+    """
+    Return the sum of the ledger's snapshots for periods before the one
+    containing the given date and its enabled splits in that period that match
+    the condition, in a single query.
+    """
+    start = LedgerSnapshot.period_start(when)
+    before = session.query(func.sum(LedgerSnapshot.value)).filter(
+        LedgerSnapshot.ledger_id == ledger.id, LedgerSnapshot.start < start).as_scalar()
+    during = session.query(func.sum(TransactionSplit.value)).join(
+        Transaction, TransactionSplit.transaction_id == Transaction.id).filter(
+        TransactionSplit.ledger_id == ledger.id, Transaction.disabled == False,
+        Transaction.datetime >= start, condition).as_scalar()
+    before, during = session.query(before, during).one()
+    return Decimal(before or 0) + Decimal(during or 0)
+
+
+@instrumented('balance_at')
+def balance_at(ledger, when, session=None):
+    """
+    Return the balance of a ledger as it was at the given date and time. Adds
+    up the ledger's snapshots for earlier periods and the splits within the
+    current period, in a single query.
+
+    :param session: Session to query in, defaulting to ``db.session``
+    """
+    if session is None:
+        session = db.session
+    return _balance(ledger, when, Transaction.datetime <= when, session)
+
+
+@instrumented('get_register')
+def get_register(ledger, after=None, limit=100, session=None):
+    """
+    Return a page of the ledger's register as an array of {key, split,
+    transaction, balance} dictionaries, ordered by transaction date and split
+    id, where balance is the running balance after the split. Disabled
+    transactions are listed but don't add to the balance.
+
+    Pages are fetched by key rather than offset, and the opening balance of
+    each page is computed from snapshots, so every page costs the same
+    regardless of how deep into history it is.
+
+    :param after: ``key`` of the last row of the previous page, or ``None``
+        for the first page
+    :param int limit: Number of rows in the page
+    :param session: Session to query in, defaulting to ``db.session``
+    """
+    if session is None:
+        session = db.session
+    query = session.query(TransactionSplit, Transaction).join(
+        Transaction, TransactionSplit.transaction_id == Transaction.id).filter(
+        TransactionSplit.ledger_id == ledger.id)
+    if after is None:
+        balance = Decimal(0)
+    else:
+        after_datetime, after_id = after
+        keyset = db.or_(Transaction.datetime > after_datetime, db.and_(
+            Transaction.datetime == after_datetime, TransactionSplit.id > after_id))
+        query = query.filter(keyset)
+        balance = _balance(ledger, after_datetime, db.not_(keyset), session)
+    result = []
+    for split, transaction in query.order_by(Transaction.datetime, TransactionSplit.id).limit(limit):
+        if not transaction.disabled:
+            balance += split.value
+        result.append({'key': (transaction.datetime, split.id), 'split': split,
+            'transaction': transaction, 'balance': balance})
+    return result
+
+
+def iter_register(ledger, after=None, pagesize=1000, session=None):
+    """
+    Iterate over the entire register of a ledger, one page at a time. Yields
+    the same rows as :func:`get_register`.
+
+    :param session: Session to query in, defaulting to ``db.session``
+    """
+    while True:
+        page = get_register(ledger, after, pagesize, session)
+        for row in page:
+            yield row
+        if len(page) < pagesize:
+            break
+        after = page[-1]['key']
+
+
+def rebuild_snapshots(session=None):
+    """
+    Discard all ledger snapshots and rebuild them from transaction splits. This
+    is required after changing :attr:`LedgerSnapshot.period`.
+
+    :param session: Session to rebuild in, defaulting to ``db.session``
+    """
+    if session is None:
+        session = db.session
+    snapshots = {}
+    for ledger_id, when, value in session.query(
+            TransactionSplit.ledger_id, Transaction.datetime, TransactionSplit.value).join(
+            Transaction, TransactionSplit.transaction_id == Transaction.id).filter(
+            Transaction.disabled == False).yield_per(10000):
+        key = (ledger_id, LedgerSnapshot.period_start(when))
+        snapshots[key] = snapshots.get(key, 0) + value
+    session.query(LedgerSnapshot).delete(synchronize_session=False)
+    session.expire_all()
+    rows = [{'ledger_id': ledger_id, 'start': start, 'value': value}
+        for (ledger_id, start), value in sorted(snapshots.items())]
+    if rows:
+        session.execute(LedgerSnapshot.__table__.insert(), rows)
+
+
 def make_default_ledgers(userledger):
     """
     Make some default ledgers to help the user get started
     """
     commodity = userledger.commodity
 
-    assets = Ledger(parent=userledger, title=u'Assets', description=u'All current assets', placeholder=True, ltype=LEDGER_TYPE.ASSET, lsubtype=LEDGER_SUBTYPE.NA, commodity=commodity)
-    liabilities = Ledger(parent=userledger, title=u'Liabilities', description=u'All current liabilities', placeholder=True, ltype=LEDGER_TYPE.LIABILITY, lsubtype=LEDGER_SUBTYPE.NA, commodity=commodity)
-    income = Ledger(parent=userledger, title=u'Income', description=u'All sources of income', placeholder=True, ltype=LEDGER_TYPE.INCOME, lsubtype=LEDGER_SUBTYPE.NA, commodity=commodity)
-    expenses = Ledger(parent=userledger, title=u'Expenses', description=u'All expenses', placeholder=True, ltype=LEDGER_TYPE.EXPENSE, lsubtype=LEDGER_SUBTYPE.NA, commodity=commodity)
-    equity = Ledger(parent=userledger, title=u'Equity', description=u'Financial infusions', placeholder=True, ltype=LEDGER_TYPE.EQUITY, lsubtype=LEDGER_SUBTYPE.NA, commodity=commodity)
+    assets = Ledger(parent=userledger, title=u'Assets', description=u'All current assets', placeholder=True, ledger_type=LEDGER_TYPE.ASSET, ledger_subtype=LEDGER_SUBTYPE.NA, commodity=commodity)
+    liabilities = Ledger(parent=userledger, title=u'Liabilities', description=u'All current liabilities', placeholder=True, ledger_type=LEDGER_TYPE.LIABILITY, ledger_subtype=LEDGER_SUBTYPE.NA, commodity=commodity)
+    income = Ledger(parent=userledger, title=u'Income', description=u'All sources of income', placeholder=True, ledger_type=LEDGER_TYPE.INCOME, ledger_subtype=LEDGER_SUBTYPE.NA, commodity=commodity)
+    expenses = Ledger(parent=userledger, title=u'Expenses', description=u'All expenses', placeholder=True, ledger_type=LEDGER_TYPE.EXPENSE, ledger_subtype=LEDGER_SUBTYPE.NA, commodity=commodity)
+    equity = Ledger(parent=userledger, title=u'Equity', description=u'Financial infusions', placeholder=True, ledger_type=LEDGER_TYPE.EQUITY, ledger_subtype=LEDGER_SUBTYPE.NA, commodity=commodity)
 
     db.session.add(assets)
     db.session.add(liabilities)
@@ -58,34 +276,34 @@ def make_default_ledgers(userledger):
     db.session.add(expenses)
     db.session.add(equity)
 
-    cash = Ledger(parent=assets, title=u'Cash', description=u'Cash in my wallet', ltype=LEDGER_TYPE.ASSET, lsubtype=LEDGER_SUBTYPE.CASH, commodity=commodity)
-    bank = Ledger(parent=assets, title=u'Bank', description=u'My bank account', ltype=LEDGER_TYPE.ASSET, lsubtype=LEDGER_SUBTYPE.BANK, commodity=commodity)
+    cash = Ledger(parent=assets, title=u'Cash', description=u'Cash in my wallet', ledger_type=LEDGER_TYPE.ASSET, ledger_subtype=LEDGER_SUBTYPE.CASH, commodity=commodity)
+    bank = Ledger(parent=assets, title=u'Bank', description=u'My bank account', ledger_type=LEDGER_TYPE.ASSET, ledger_subtype=LEDGER_SUBTYPE.BANK, commodity=commodity)
 
     db.session.add(cash)
     db.session.add(bank)
 
-    creditcard = Ledger(parent=liabilities, title=u'Credit Card', description=u'My credit cards', ltype=LEDGER_TYPE.LIABILITY, lsubtype=LEDGER_SUBTYPE.CREDITCARD, commodity=commodity)
+    creditcard = Ledger(parent=liabilities, title=u'Credit Card', description=u'My credit cards', ledger_type=LEDGER_TYPE.LIABILITY, ledger_subtype=LEDGER_SUBTYPE.CREDITCARD, commodity=commodity)
 
     db.session.add(creditcard)
 
-    salary = Ledger(parent=income, title=u'Salary', description=u'Income from current and previous employers', ltype=LEDGER_TYPE.INCOME, lsubtype=LEDGER_SUBTYPE.NA, commodity=commodity)
-    hobbies = Ledger(parent=income, title=u'Hobbies', description=u'Income from hobbies', ltype=LEDGER_TYPE.INCOME, lsubtype=LEDGER_SUBTYPE.NA, commodity=commodity)
-    gifts = Ledger(parent=income, title=u'Gifts', description=u'Cash gifts', ltype=LEDGER_TYPE.INCOME, lsubtype=LEDGER_SUBTYPE.NA, commodity=commodity)
+    salary = Ledger(parent=income, title=u'Salary', description=u'Income from current and previous employers', ledger_type=LEDGER_TYPE.INCOME, ledger_subtype=LEDGER_SUBTYPE.NA, commodity=commodity)
+    hobbies = Ledger(parent=income, title=u'Hobbies', description=u'Income from hobbies', ledger_type=LEDGER_TYPE.INCOME, ledger_subtype=LEDGER_SUBTYPE.NA, commodity=commodity)
+    gifts = Ledger(parent=income, title=u'Gifts', description=u'Cash gifts', ledger_type=LEDGER_TYPE.INCOME, ledger_subtype=LEDGER_SUBTYPE.NA, commodity=commodity)
 
     db.session.add(salary)
     db.session.add(hobbies)
     db.session.add(gifts)
 
-    rent = Ledger(parent=expenses, title=u'Rent', description=u'Monthly house rent', ltype=LEDGER_TYPE.EXPENSE, lsubtype=LEDGER_SUBTYPE.NA, commodity=commodity)
-    emi = Ledger(parent=expenses, title=u'EMI', description=u'Monthly payments for the house and car', ltype=LEDGER_TYPE.EXPENSE, lsubtype=LEDGER_SUBTYPE.NA, commodity=commodity)
-    food = Ledger(parent=expenses, title=u'Food', description=u'Breakfast, lunch and dinner', ltype=LEDGER_TYPE.EXPENSE, lsubtype=LEDGER_SUBTYPE.NA, commodity=commodity)
-    shopping = Ledger(parent=expenses, title=u'Shopping', description=u'All purchases', ltype=LEDGER_TYPE.EXPENSE, lsubtype=LEDGER_SUBTYPE.NA, commodity=commodity)
+    rent = Ledger(parent=expenses, title=u'Rent', description=u'Monthly house rent', ledger_type=LEDGER_TYPE.EXPENSE, ledger_subtype=LEDGER_SUBTYPE.NA, commodity=commodity)
+    emi = Ledger(parent=expenses, title=u'EMI', description=u'Monthly payments for the house and car', ledger_type=LEDGER_TYPE.EXPENSE, ledger_subtype=LEDGER_SUBTYPE.NA, commodity=commodity)
+    food = Ledger(parent=expenses, title=u'Food', description=u'Breakfast, lunch and dinner', ledger_type=LEDGER_TYPE.EXPENSE, ledger_subtype=LEDGER_SUBTYPE.NA, commodity=commodity)
+    shopping = Ledger(parent=expenses, title=u'Shopping', description=u'All purchases', ledger_type=LEDGER_TYPE.EXPENSE, ledger_subtype=LEDGER_SUBTYPE.NA, commodity=commodity)
 
     db.session.add(rent)
     db.session.add(emi)
     db.session.add(food)
     db.session.add(shopping)
 
-    opening = Ledger(parent=equity, title=u'Opening Balances', ltype=LEDGER_TYPE.EXPENSE, lsubtype=LEDGER_SUBTYPE.NA, commodity=commodity, hidden=True)
+    opening = Ledger(parent=equity, title=u'Opening Balances', ledger_type=LEDGER_TYPE.EQUITY, ledger_subtype=LEDGER_SUBTYPE.NA, commodity=commodity, hidden=True)
 
     db.session.add(opening)
@@ -2,9 +2,14 @@
 
 from nodular import db, NodeMixin, Node
 
-from . import ledger, commodity, transaction
+from . import ledger, commodity, transaction, snapshot, archive, recurring, journal
 from .commodity import *
 from .ledger import *
 from .transaction import *
+from .snapshot import *
+from .archive import *
+from .recurring import *
+from .journal import *
 
-__all__ = ledger.__all__ + commodity.__all__ + transaction.__all__
+__all__ = ledger.__all__ + commodity.__all__ + transaction.__all__ + snapshot.__all__ + archive.__all__ + \
+    recurring.__all__ + journal.__all__
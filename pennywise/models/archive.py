@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+from . import db
+from .ledger import Ledger
+from .commodity import Commodity
+
+__all__ = ['ArchivedTransaction', 'ArchivedTransactionSplit']
+
+
+class ArchivedTransaction(db.Model):
+    """
+    Transaction moved out of the :class:`Transaction` table when its period
+    was closed. Columns are the same as in :class:`Transaction`.
+    """
+    __tablename__ = 'transaction_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    buid = db.Column(db.String(22), nullable=False, unique=True)
+    datetime = db.Column(db.DateTime, nullable=False, index=True)
+    num = db.Column(db.Unicode(30), nullable=False, default=u'')
+    description = db.Column(db.Unicode(250), nullable=False, default=u'')
+    commodity_id = db.Column(None, db.ForeignKey('commodity.id'), nullable=False)
+    commodity = db.relation(Commodity, primaryjoin=commodity_id == Commodity.id)
+    disabled = db.Column(db.Boolean, default=False, nullable=False)
+    fingerprint = db.Column(db.String(40), nullable=True, index=True)
+
+
+class ArchivedTransactionSplit(db.Model):
+    """
+    Transaction split moved out of the :class:`TransactionSplit` table when its
+    period was closed. Columns are the same as in :class:`TransactionSplit`.
+    """
+    __tablename__ = 'transaction_split_archive'
+    id = db.Column(db.Integer, primary_key=True, autoincrement=False)
+    ledger_id = db.Column(None, db.ForeignKey('ledger.id'), nullable=False, index=True)
+    ledger = db.relation(Ledger, primaryjoin=ledger_id == Ledger.id)
+    transaction_id = db.Column(None, db.ForeignKey('transaction_archive.id'), nullable=False, index=True)
+    transaction = db.relation(ArchivedTransaction, primaryjoin=transaction_id == ArchivedTransaction.id,
+        backref=db.backref('splits', order_by=id))
+    reconciled = db.Column(db.Boolean, default=False, nullable=False)
+    reconciled_date = db.Column(db.DateTime, nullable=True)
+    value = db.Column(db.Numeric, nullable=False)
+    quantity = db.Column(db.Numeric, nullable=False)
@@ -1,9 +1,12 @@
 # -*- coding: utf-8 -*-
 
+from sqlalchemy import event
+from sqlalchemy.orm import Session, make_transient_to_detached
+from sqlalchemy.orm.attributes import set_committed_value
 from . import db
-from .data import currency_codes
+from .data import currency_names
 
-__all__ = ['COMMODITY_TYPE', 'Commodity']
+__all__ = ['COMMODITY_TYPE', 'Commodity', 'CommodityPrice']
 
 
 class COMMODITY_TYPE:
@@ -22,21 +25,138 @@ class Commodity(db.Model):
     Commodities (currencies, funds, etc)
     """
     __tablename__ = 'commodity'
+    __table_args__ = (db.UniqueConstraint('type', 'symbol'),)
     id = db.Column(db.Integer, primary_key=True)
     #: Type of commodity
     type = db.Column(db.SmallInteger, nullable=False, default=COMMODITY_TYPE.CURRENCY)
     symbol = db.Column(db.Unicode(20), nullable=False)
     title = db.Column(db.Unicode(250), nullable=False, default=u'')
 
+    #: Process-local cache of commodity (id, title) by (bind, type, symbol).
+    #: Commodities are never renamed, so entries don't need to be invalidated.
+    #: Only committed commodities are cached. Ones created in a session's
+    #: transaction wait in ``session.info`` until it commits
+    _cache = {}
+
+    @classmethod
+    def _new(cls, type, symbol, title):
+        if type == COMMODITY_TYPE.CURRENCY:
+            title = currency_names.get(symbol, title)
+        return cls(type=type, symbol=symbol, title=title)
+
+    @classmethod
+    def _cached(cls, session, type, symbol):
+        """
+        Return a cached commodity attached to the session without a query, or None.
+        """
+        key = (session.get_bind(), type, symbol)
+        cached = cls._cache.get(key)
+        if cached is None:
+            cached = session.info.get(_PENDING, {}).get(key)
+        if cached is None:
+            return None
+        values = {'id': cached[0], 'type': type, 'symbol': symbol, 'title': cached[1]}
+        commodity = session.identity_map.get(cls.__mapper__.identity_key_from_primary_key([cached[0]]))
+        if commodity is None:
+            commodity = cls(**values)
+            make_transient_to_detached(commodity)
+            session.add(commodity)
+        else:
+            # Fill in attributes expired by a commit, so they aren't reloaded
+            for name, value in values.items():
+                if name not in commodity.__dict__:
+                    set_committed_value(commodity, name, value)
+        return commodity
+
+    @classmethod
+    def _remember(cls, session, commodity):
+        key = (session.get_bind(), commodity.type, commodity.symbol)
+        pending = session.info.get(_PENDING, {})
+        if key in pending:
+            # Created in this transaction, and gone if it rolls back
+            pending[key] = (commodity.id, commodity.title)
+        else:
+            cls._cache[key] = (commodity.id, commodity.title)
+
     @classmethod
     def get_or_create(cls, type, symbol, title=u''):
+        # The session itself, as Flask-SQLAlchemy's scoped session can't proxy get_bind
+        session = db.session()
+        commodity = cls._cached(session, type, symbol)
+        if commodity is not None:
+            return commodity
         commodity = cls.query.filter_by(type=type, symbol=symbol).first()
         if commodity is None:
-            if type == COMMODITY_TYPE.CURRENCY:
-                # Iterate through currency_codes looking for commodity
-                for ccode, cname in currency_codes:
-                    if symbol == ccode:
-                        title = cname
-                        break
-            commodity = Commodity(type=type, symbol=symbol, title=title)
+            commodity = cls._new(type, symbol, title)
+        else:
+            cls._remember(session, commodity)
         return commodity
+
+    @classmethod
+    def get_or_create_many(cls, type, symbols):
+        """
+        Return a dictionary of symbol to commodity for all the given symbols,
+        looking up existing commodities with a single query.
+        """
+        session = db.session()
+        symbols = sorted(set(symbols))
+        result = {}
+        for symbol in symbols:
+            commodity = cls._cached(session, type, symbol)
+            if commodity is not None:
+                result[symbol] = commodity
+        missing = [symbol for symbol in symbols if symbol not in result]
+        # Stay within parameter limits for IN clauses
+        for start in range(0, len(missing), 500):
+            for commodity in cls.query.filter(cls.type == type, cls.symbol.in_(missing[start:start + 500])):
+                cls._remember(session, commodity)
+                result[commodity.symbol] = commodity
+        for symbol in symbols:
+            if symbol not in result:
+                result[symbol] = cls._new(type, symbol, u'')
+        return result
+
+
+#: Key in ``session.info`` of commodities created in the session's transaction
+_PENDING = 'pennywise.commodities'
+
+
+@event.listens_for(Session, 'after_flush')
+def _after_flush(session, context):
+    created = [instance for instance in session.new if isinstance(instance, Commodity)]
+    if created:
+        bind = session.get_bind()
+        pending = session.info.setdefault(_PENDING, {})
+        for commodity in created:
+            pending[(bind, commodity.type, commodity.symbol)] = (commodity.id, commodity.title)
+
+
+@event.listens_for(Session, 'after_commit')
+def _after_commit(session):
+    Commodity._cache.update(session.info.pop(_PENDING, {}))
+
+
+@event.listens_for(Session, 'after_rollback')
+@event.listens_for(Session, 'after_soft_rollback')
+def _after_rollback(session, *args):
+    session.info.pop(_PENDING, None)
+
+
+class CommodityPrice(db.Model):
+    """
+    Price of a commodity in another commodity (usually a currency) from a
+    point in time
+    """
+    __tablename__ = 'commodity_price'
+    __table_args__ = (db.UniqueConstraint('commodity_id', 'currency_id', 'datetime'),)
+    id = db.Column(db.Integer, primary_key=True)
+    commodity_id = db.Column(None, db.ForeignKey('commodity.id'), nullable=False)
+    #: Commodity being priced
+    commodity = db.relation(Commodity, primaryjoin=commodity_id == Commodity.id)
+    currency_id = db.Column(None, db.ForeignKey('commodity.id'), nullable=False)
+    #: Commodity the price is expressed in
+    currency = db.relation(Commodity, primaryjoin=currency_id == Commodity.id)
+    #: Date and time from which this price applies, in UTC
+    datetime = db.Column(db.DateTime, nullable=False)
+    #: Units of currency per unit of commodity
+    rate = db.Column(db.Numeric(24, 10), nullable=False)
@@ -182,6 +182,9 @@ currency_codes = (
     (u"XPT", u"XPT - Platinum, Ounces"),
 )
 
+# Currency names indexed by code
+currency_names = dict([(ccode, cname) for ccode, cname in currency_codes if ccode])
+
 currency_symbols = {
     u'USD': u'$',
     u'CAD': u'$',
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from . import db
+from .ledger import Ledger
+
+__all__ = ['JOURNAL_EVENT', 'JournalEntry', 'JournalWatermark']
+
+
+class JOURNAL_EVENT:
+    CREATE = 0
+    EDIT = 1
+    DELETE = 2
+
+
+class JournalEntry(db.Model):
+    """
+    Change to a ledger's balance from posting, editing or deleting a
+    transaction. Entries are only ever appended, and are applied to balances
+    and snapshots by :func:`pennywise.journal.materialize`.
+    """
+    __tablename__ = 'posting_journal'
+    # Ids are the order entries are applied in, and must never be reused
+    __table_args__ = {'sqlite_autoincrement': True}
+    id = db.Column(db.Integer, primary_key=True)
+    #: When the entry was written, for telling abandoned ids from ones being written
+    created = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
+    #: Kind of change, from :class:`JOURNAL_EVENT`
+    event = db.Column(db.SmallInteger, nullable=False)
+    #: Transaction that was changed. Not a foreign key, as it may be deleted
+    transaction_id = db.Column(db.Integer, nullable=False)
+    ledger_id = db.Column(None, db.ForeignKey('ledger.id'), nullable=False, index=True)
+    #: Ledger whose balance changes
+    ledger = db.relation(Ledger, primaryjoin=ledger_id == Ledger.id)
+    #: Date of the transaction, for the snapshot the change falls in
+    datetime = db.Column(db.DateTime, nullable=False)
+    #: Amount added to the balance
+    value = db.Column(db.Numeric, nullable=False)
+
+
+class JournalWatermark(db.Model):
+    """
+    Position of a consumer of the journal. All entries up to and including
+    the position have been applied.
+    """
+    __tablename__ = 'journal_watermark'
+    name = db.Column(db.Unicode(80), primary_key=True)
+    #: Id of the last entry applied
+    position = db.Column(db.Integer, nullable=False, default=0)
@@ -1,5 +1,7 @@
 # -*- coding: utf-8 -*-
 
+from sqlalchemy.orm.attributes import instance_state
+from ..instrument import instrumented
 from . import db, NodeMixin, Node
 from .commodity import Commodity
 
@@ -90,14 +92,41 @@ class Ledger(NodeMixin, Node):
         kwargs['balance'] = 0
         super(Ledger, self).__init__(**kwargs)
 
+    @instrumented('addSplitValue')
     def addSplitValue(self, split):
         """
         Update ledger balance given a new split.
         """
-        self.balance += split.value
+        increment(self, 'balance', split.value)
+        LedgerSnapshot.add_value(self, split.transaction.datetime, split.value)
 
+    @instrumented('delSplitValue')
     def delSplitValue(self, split):
         """
         Update ledger balance for a split being removed.
         """
-        self.balance -= split.value
+        increment(self, 'balance', -split.value)
+        LedgerSnapshot.add_value(self, split.transaction.datetime, -split.value)
+
+
+def increment(instance, attr, value):
+    """
+    Add to a numeric column. Persistent instances are updated right away with
+    a server-side increment so that concurrent writers don't overwrite each
+    other, and the attribute is expired, so the new value is reloaded from the
+    database on next access.
+    """
+    state = instance_state(instance)
+    if state.has_identity and state.session is not None:
+        column = state.mapper.get_property(attr).columns[0]
+        table = column.table
+        state.session.execute(table.update().where(db.and_(*[pkcolumn == pkvalue
+            for pkcolumn, pkvalue in zip(table.primary_key.columns, state.identity)])).values(
+            {column.name: column + value}))
+        state.session.expire(instance, [attr])
+    else:
+        setattr(instance, attr, getattr(instance, attr) + value)
+
+
+# Circular import: snapshots refer back to ledgers
+from .snapshot import LedgerSnapshot
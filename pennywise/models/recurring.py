@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+
+from calendar import monthrange
+from datetime import timedelta
+from . import db
+from .ledger import Ledger
+from .commodity import Commodity
+
+__all__ = ['RECURRENCE', 'RecurringTransaction', 'RecurringSplit']
+
+
+class RECURRENCE:
+    DAILY = 0
+    WEEKLY = 1
+    MONTHLY = 2
+    YEARLY = 3
+
+
+def _add_months(when, months):
+    """
+    Add months to a date, keeping the day of month where possible and
+    otherwise using the last day of the month.
+    """
+    year, month = divmod(when.month - 1 + months, 12)
+    year += when.year
+    return when.replace(year=year, month=month + 1, day=min(when.day, monthrange(year, month + 1)[1]))
+
+
+def occurrence(schedule, number):
+    """
+    Return the date of an occurrence of a schedule, or None if the schedule is
+    over by then. Occurrence 0 is the start. The schedule is any object with
+    the schedule attributes of :class:`RecurringTransaction`, such as a row.
+
+    Each date is computed from the start, so monthly schedules starting on the
+    31st fall on the last day of shorter months without drifting.
+    """
+    if schedule.count is not None and number >= schedule.count:
+        return None
+    steps = schedule.interval * number
+    if schedule.frequency == RECURRENCE.DAILY:
+        when = schedule.start + timedelta(days=steps)
+    elif schedule.frequency == RECURRENCE.WEEKLY:
+        when = schedule.start + timedelta(weeks=steps)
+    elif schedule.frequency == RECURRENCE.MONTHLY:
+        when = _add_months(schedule.start, steps)
+    elif schedule.frequency == RECURRENCE.YEARLY:
+        when = _add_months(schedule.start, steps * 12)
+    else:
+        raise ValueError("Unknown frequency %r" % schedule.frequency)
+    if schedule.until is not None and when > schedule.until:
+        return None
+    return when
+
+
+class RecurringTransaction(db.Model):
+    """
+    Template for a transaction that recurs on a schedule, like rent or loan
+    payments. Occurrences are posted as regular transactions by
+    :func:`pennywise.recurring.materialize`.
+    """
+    __tablename__ = 'recurring_transaction'
+    id = db.Column(db.Integer, primary_key=True)
+    #: Unit of the schedule, from :class:`RECURRENCE`
+    frequency = db.Column(db.SmallInteger, nullable=False, default=RECURRENCE.MONTHLY)
+    #: Number of units between occurrences
+    interval = db.Column(db.Integer, nullable=False, default=1)
+    #: Date and time of the first occurrence
+    start = db.Column(db.DateTime, nullable=False)
+    #: No occurrences after this date, if set
+    until = db.Column(db.DateTime, nullable=True)
+    #: Total number of occurrences, if limited
+    count = db.Column(db.Integer, nullable=True)
+    #: Number of occurrences posted so far
+    posted = db.Column(db.Integer, nullable=False, default=0)
+    #: Date of the next occurrence to post, or None when the schedule is over
+    next_date = db.Column(db.DateTime, nullable=True, index=True)
+    #: User-facing transaction id number for every occurrence
+    num = db.Column(db.Unicode(30), nullable=False, default=u'')
+    #: Description for every occurrence
+    description = db.Column(db.Unicode(250), nullable=False, default=u'')
+    commodity_id = db.Column(None, db.ForeignKey('commodity.id'), nullable=False)
+    #: Commodity that occurrences are in
+    commodity = db.relation(Commodity, primaryjoin=commodity_id == Commodity.id)
+
+    def __init__(self, **kwargs):
+        # Schedules are usable before they are flushed, and the first occurrence is next
+        kwargs.setdefault('frequency', RECURRENCE.MONTHLY)
+        kwargs.setdefault('interval', 1)
+        kwargs.setdefault('posted', 0)
+        kwargs.setdefault('next_date', kwargs.get('start'))
+        super(RecurringTransaction, self).__init__(**kwargs)
+
+    def occurrence(self, number):
+        """
+        Return the date of an occurrence, or None if the schedule is over by then.
+        """
+        return occurrence(self, number)
+
+    def validate(self):
+        """
+        Assert that this template is well defined and safe to commit to database.
+        """
+        assert len(self.splits) > 1
+        assert sum([s.value for s in self.splits]) == 0
+        assert self.interval > 0
+
+
+class RecurringSplit(db.Model):
+    """
+    Split of a :class:`RecurringTransaction`, posted to a ledger on every occurrence.
+    """
+    __tablename__ = 'recurring_split'
+    id = db.Column(db.Integer, primary_key=True)
+    recurring_id = db.Column(None, db.ForeignKey('recurring_transaction.id'), nullable=False, index=True)
+    #: Template that this split belongs to
+    recurring = db.relation(RecurringTransaction, primaryjoin=recurring_id == RecurringTransaction.id,
+        backref=db.backref('splits', order_by=id, cascade='all, delete-orphan'))
+    ledger_id = db.Column(None, db.ForeignKey('ledger.id'), nullable=False, index=True)
+    #: Ledger that this split posts to
+    ledger = db.relation(Ledger, primaryjoin=ledger_id == Ledger.id)
+    #: Value of the split, in the commodity of the template
+    value = db.Column(db.Numeric, nullable=False)
+    #: Quantity of the split (same as value, except for cross-currency templates)
+    quantity = db.Column(db.Numeric, nullable=False)
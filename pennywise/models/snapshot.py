@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from sqlalchemy import bindparam
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import object_session
+from sqlalchemy.orm.attributes import instance_state
+from . import db
+from .ledger import Ledger
+
+try:
+    from sqlalchemy.dialects.postgresql import insert as postgresql_insert
+except ImportError:  # SQLAlchemy < 1.1
+    postgresql_insert = None
+try:
+    from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+except ImportError:  # SQLAlchemy < 1.4
+    sqlite_insert = None
+
+__all__ = ['SNAPSHOT_PERIOD', 'LedgerSnapshot']
+
+
+class SNAPSHOT_PERIOD:
+    #: One snapshot per ledger per day
+    DAY = 0
+    #: One snapshot per ledger per calendar month
+    MONTH = 1
+
+
+class LedgerSnapshot(db.Model):
+    """
+    Net change in a ledger's balance over one period, maintained as
+    transactions are posted. The balance of a ledger at the start of a period
+    is the sum of its snapshots for all earlier periods.
+    """
+    __tablename__ = 'ledger_snapshot'
+    #: Length of the period covered by each snapshot. Snapshots must be
+    #: rebuilt if this is changed
+    period = SNAPSHOT_PERIOD.MONTH
+
+    ledger_id = db.Column(None, db.ForeignKey('ledger.id'), primary_key=True)
+    #: Ledger that this snapshot belongs to
+    ledger = db.relation(Ledger, primaryjoin=ledger_id == Ledger.id,
+        backref=db.backref('snapshots', cascade='all, delete-orphan'))
+    #: Start of the period (in UTC, like transaction dates)
+    start = db.Column(db.DateTime, primary_key=True)
+    #: Net change in balance during this period
+    value = db.Column(db.Numeric(20, 3), nullable=False, default='0')
+
+    def __repr__(self):
+        return u"<LedgerSnapshot %s %s>" % (self.ledger_id, self.start)
+
+    @classmethod
+    def period_start(cls, when):
+        """
+        Return the start of the period that the given date or datetime falls in.
+        """
+        if cls.period == SNAPSHOT_PERIOD.DAY:
+            return datetime(when.year, when.month, when.day)
+        return datetime(when.year, when.month, 1)
+
+    @classmethod
+    def add_value(cls, ledger, when, value):
+        """
+        Add a value to the ledger's snapshot for the period containing the given
+        date, creating the snapshot if required.
+        """
+        if when is None:
+            # Transactions that haven't been saved yet will be dated now
+            when = datetime.utcnow()
+        start = cls.period_start(when)
+        if instance_state(ledger).has_identity:
+            session = object_session(ledger)
+            cls.add_values({(ledger.id, start): value}, session)
+            snapshot = session.identity_map.get(cls.__mapper__.identity_key_from_primary_key([ledger.id, start]))
+            if snapshot is not None:
+                session.expire(snapshot, ['value'])
+            return
+        # New ledgers have no snapshots in the database yet
+        for snapshot in ledger.snapshots:
+            if snapshot.start == start:
+                snapshot.value += value
+                return
+        db.session.add(cls(ledger=ledger, start=start, value=value))
+
+    @classmethod
+    def add_values(cls, deltas, session=None):
+        """
+        Add to snapshots in bulk, creating missing snapshots. Uses an upsert
+        where the database has one (PostgreSQL, and SQLite with SQLAlchemy
+        1.4), so that concurrent writers creating the same snapshot don't
+        conflict. Elsewhere, each snapshot is updated, or else inserted in a
+        savepoint and updated if another writer inserted it first.
+
+        :param deltas: Dictionary of (ledger id, period start) to the amount to add
+        :param session: Session to update in, defaulting to ``db.session``
+        """
+        if session is None:
+            session = db.session
+        table = cls.__table__
+        rows = [{'ledger_id': ledger_id, 'start': start, 'value': delta}
+            for (ledger_id, start), delta in sorted(deltas.items()) if delta != 0]
+        if not rows:
+            return
+        insert = _upsert(session.connection())
+        if insert is not None:
+            statement = insert(table)
+            session.execute(statement.on_conflict_do_update(index_elements=[table.c.ledger_id, table.c.start],
+                set_={'value': table.c.value + statement.excluded.value}), rows)
+            return
+        update = table.update().where(db.and_(
+            table.c.ledger_id == bindparam('snapshot_ledger_id'),
+            table.c.start == bindparam('snapshot_start'))).values(value=table.c.value + bindparam('delta'))
+        for row in rows:
+            key = {'snapshot_ledger_id': row['ledger_id'], 'snapshot_start': row['start'], 'delta': row['value']}
+            if session.execute(update, key).rowcount:
+                continue
+            savepoint = session.begin_nested()
+            try:
+                session.execute(table.insert(), row)
+                savepoint.commit()
+            except IntegrityError:
+                savepoint.rollback()
+                session.execute(update, key)
+
+
+def _upsert(connection):
+    """
+    Return the insert construct with ON CONFLICT support for the database, or None.
+    """
+    if connection.dialect.name == 'postgresql':
+        return postgresql_insert
+    if connection.dialect.name == 'sqlite' and sqlite_insert is not None and \
+            connection.dialect.dbapi.sqlite_version_info >= (3, 24):
+        return sqlite_insert
@@ -2,6 +2,7 @@
 
 from datetime import datetime
 from coaster.utils import buid as buid_func
+from ..instrument import instrumented
 from . import db
 from .ledger import Ledger
 from .commodity import Commodity
@@ -14,9 +15,15 @@ class Transaction(db.Model):
     Transaction between ledgers. Not to be confused with database transactions.
     """
     __tablename__ = 'transaction'
+    # Ids must never be reused, as closed transactions are archived by id
+    __table_args__ = (
+        # Date ranges and keyset pages by (datetime, id), without reading the table
+        db.Index('ix_transaction_datetime_id', 'datetime', 'id'),
+        {'sqlite_autoincrement': True},
+        )
     id = db.Column(db.Integer, primary_key=True)
     #: Transaction UUID as a 22-char Base64 representation
-    buid = db.Column(db.String(22), nullable=False, default=buid_func)
+    buid = db.Column(db.String(22), nullable=False, unique=True, default=buid_func)
     #: Transaction date and time in UTC timezone
     datetime = db.Column(db.DateTime, default=datetime.utcnow, nullable=False)
     #: User-facing transaction id number
@@ -29,7 +36,10 @@ class Transaction(db.Model):
     #: Transactions may be disabled while speculating on expenses.
     #: Disabled transactions don't add to the balance
     disabled = db.Column(db.Boolean, default=False, nullable=False)
+    #: Fingerprint of imported transactions, for detecting duplicate imports
+    fingerprint = db.Column(db.String(40), nullable=True, index=True)
 
+    @instrumented('validate')
     def validate(self):
         """
         Assert that this transaction is well defined and safe to commit to database.
@@ -46,13 +56,18 @@ class TransactionSplit(db.Model):
     ledger with a different commodity, :attr:`quantity` is the exchange value.
     """
     __tablename__ = 'transaction_split'
+    __table_args__ = (
+        # Ledger.splits, registers and reconciliation
+        db.Index('ix_transaction_split_ledger_id_reconciled', 'ledger_id', 'reconciled'),
+        {'sqlite_autoincrement': True},
+        )
     id = db.Column(db.Integer, primary_key=True)
     ledger_id = db.Column(None, db.ForeignKey('ledger.id'), nullable=False)
     #: Ledger that this split belongs to
     ledger = db.relation(Ledger, primaryjoin=ledger_id == Ledger.id,
         backref=db.backref('splits', order_by=id,
             cascade='all, delete-orphan'))
-    transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'), nullable=False)
+    transaction_id = db.Column(db.Integer, db.ForeignKey('transaction.id'), nullable=False, index=True)
     #: Transaction that this split belongs to
     transaction = db.relation(Transaction, primaryjoin=transaction_id == Transaction.id,
         backref=db.backref('splits', order_by=id,
@@ -65,3 +80,8 @@ class TransactionSplit(db.Model):
     value = db.Column(db.Numeric, nullable=False)
     #: Quantity of transaction (same as value, except for cross-currency transactions)
     quantity = db.Column(db.Numeric, nullable=False)
+
+
+# Balances, snapshots and reports only read enabled transactions
+db.Index('ix_transaction_enabled_datetime_id', Transaction.datetime, Transaction.id,
+    postgresql_where=Transaction.disabled == False, sqlite_where=Transaction.disabled == False)
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+
+"""
+Commodity prices and valuation.
+"""
+
+import csv
+from bisect import bisect_right
+from datetime import datetime
+from decimal import Decimal
+from pennywise.models import db, COMMODITY_TYPE, Commodity, CommodityPrice
+
+
+class PriceIndex(object):
+    """
+    In-memory index of commodity prices for fast as-of lookups. Prices for
+    each pair of commodities are kept in date order and searched by bisection,
+    so a lookup costs O(log n) regardless of how many prices are loaded.
+    """
+    def __init__(self):
+        #: (commodity id, currency id): ([datetime], [rate])
+        self._pairs = {}
+        #: Pairs that have had prices added since they were last sorted
+        self._unsorted = set()
+
+    def __len__(self):
+        return sum([len(dates) for dates, rates in self._pairs.values()])
+
+    def add(self, commodity_id, currency_id, when, rate):
+        """
+        Add a price to the index.
+        """
+        pair = (commodity_id, currency_id)
+        dates, rates = self._pairs.setdefault(pair, ([], []))
+        if dates and when < dates[-1]:
+            self._unsorted.add(pair)
+        dates.append(when)
+        rates.append(rate)
+
+    def load(self, commodity_ids=None):
+        """
+        Load prices from the database, optionally only for prices of the given
+        commodities.
+        """
+        query = db.session.query(CommodityPrice.commodity_id, CommodityPrice.currency_id,
+            CommodityPrice.datetime, CommodityPrice.rate)
+        if commodity_ids is not None:
+            query = query.filter(CommodityPrice.commodity_id.in_(list(commodity_ids)))
+        for commodity_id, currency_id, when, rate in query.order_by(
+                CommodityPrice.commodity_id, CommodityPrice.currency_id, CommodityPrice.datetime).yield_per(10000):
+            self.add(commodity_id, currency_id, when, rate)
+
+    def _lookup(self, pair, when):
+        prices = self._pairs.get(pair)
+        if prices is None:
+            return None
+        if pair in self._unsorted:
+            ordered = sorted(zip(*prices))
+            prices = self._pairs[pair] = ([date for date, rate in ordered], [rate for date, rate in ordered])
+            self._unsorted.discard(pair)
+        dates, rates = prices
+        position = bisect_right(dates, when)
+        if position == 0:
+            return None
+        return rates[position - 1]
+
+    def rate(self, commodity_id, currency_id, when):
+        """
+        Return the price of one unit of commodity in currency as of the given
+        date, using the inverse price if only that is known. Returns ``None``
+        if there is no price on or before that date.
+        """
+        if commodity_id == currency_id:
+            return Decimal(1)
+        rate = self._lookup((commodity_id, currency_id), when)
+        if rate is None:
+            inverse = self._lookup((currency_id, commodity_id), when)
+            if inverse:
+                rate = Decimal(1) / inverse
+        return rate
+
+    def valuation(self, currency_id, when):
+        """
+        Return a function that converts (commodity id, amount) into currency as
+        of the given date, for use with :func:`pennywise.ledgers.get_balances`.
+        Pass the same date to get_balances as ``when``, so that balances are
+        as of that date too.
+
+        :raises LookupError: From the returned function, if there is no price
+        """
+        def convert(commodity_id, amount):
+            rate = self.rate(commodity_id, currency_id, when)
+            if rate is None:
+                raise LookupError("No price for commodity %s in %s on %s" % (commodity_id, currency_id, when))
+            return amount * rate
+        return convert
+
+
+def _text(value):
+    # The Python 2 csv module returns bytes
+    if isinstance(value, bytes):
+        value = value.decode('utf-8')
+    return value.strip()
+
+
+def _parse_datetime(value):
+    if len(value) > 10:
+        return datetime.strptime(value, '%Y-%m-%d %H:%M:%S')
+    return datetime.strptime(value, '%Y-%m-%d')
+
+
+def load_prices(fileobj, type=COMMODITY_TYPE.CURRENCY, index=None, chunksize=10000):
+    """
+    Bulk load prices from a CSV file with ``date,commodity,currency,rate``
+    rows, such as ``2013-04-01,USD,INR,54.3875``. Dates are in UTC and may
+    include a time as ``YYYY-MM-DD HH:MM:SS``. Commodities are looked up (or
+    created) by symbol in batches and prices are inserted in chunks.
+
+    :param fileobj: Open CSV file
+    :param type: Commodity type of symbols in the file
+    :param index: Optional :class:`PriceIndex` to also add the prices to
+    :returns: Number of prices loaded
+    """
+    count = 0
+    chunk = []
+    for row in csv.reader(fileobj):
+        row = [_text(cell) for cell in row]
+        if not row or row[0].startswith(u'#'):
+            continue
+        chunk.append(row)
+        if len(chunk) >= chunksize:
+            count += _load_chunk(chunk, type, index)
+            chunk = []
+    if chunk:
+        count += _load_chunk(chunk, type, index)
+    return count
+
+
+def _load_chunk(rows, type, index):
+    symbols = set()
+    for date, commodity, currency, rate in rows:
+        symbols.add(commodity)
+        symbols.add(currency)
+    commodities = Commodity.get_or_create_many(type, symbols)
+    for commodity in commodities.values():
+        if commodity.id is None:
+            db.session.add(commodity)
+    db.session.flush()
+
+    prices = []
+    for date, commodity, currency, rate in rows:
+        price = {
+            'commodity_id': commodities[commodity].id,
+            'currency_id': commodities[currency].id,
+            'datetime': _parse_datetime(date),
+            'rate': Decimal(rate),
+            }
+        prices.append(price)
+        if index is not None:
+            index.add(price['commodity_id'], price['currency_id'], price['datetime'], price['rate'])
+    db.session.execute(CommodityPrice.__table__.insert(), prices)
+    return len(prices)
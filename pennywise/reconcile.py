@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+
+"""
+Reconcile ledgers against bank statements.
+"""
+
+from bisect import bisect_left
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pennywise.models import db, Transaction, TransactionSplit
+from pennywise.transactions import IN_CHUNK_SIZE
+
+_PRECISION = Decimal('0.001')
+
+
+def match_statement(ledger, statement, tolerance=timedelta(days=3)):
+    """
+    Match statement lines to the ledger's unreconciled splits in a single
+    pass. Unreconciled splits are loaded with one query and indexed by amount,
+    then by date, so each line only looks at splits with the same amount
+    within the tolerance window. Each line is matched to the closest split by
+    date, and each split is matched at most once. Splits of disabled
+    transactions are not matched.
+
+    :param ledger: Ledger the statement is for
+    :param statement: Iterable of {datetime, amount} dictionaries, such as
+        the lines from :func:`pennywise.importer.read_csv`. Amounts have the
+        same sign as split values
+    :param tolerance: Maximum difference between the statement date and the
+        transaction date
+    :returns: Tuple of a list of (line, split id) matches and a list of
+        unmatched lines
+    """
+    index = {}
+    for split_id, value, when in db.session.query(TransactionSplit.id, TransactionSplit.value,
+            Transaction.datetime).join(Transaction, TransactionSplit.transaction_id == Transaction.id).filter(
+            TransactionSplit.ledger_id == ledger.id, TransactionSplit.reconciled == False,
+            Transaction.disabled == False).order_by(Transaction.datetime, TransactionSplit.id):
+        dates, ids = index.setdefault(Decimal(value).quantize(_PRECISION), ([], []))
+        dates.append(when)
+        ids.append(split_id)
+
+    matches = []
+    unmatched = []
+    for line in statement:
+        candidates = index.get(Decimal(line['amount']).quantize(_PRECISION))
+        best = None
+        if candidates:
+            dates, ids = candidates
+            position = bisect_left(dates, line['datetime'] - tolerance)
+            latest = line['datetime'] + tolerance
+            while position < len(dates) and dates[position] <= latest:
+                if best is None or abs(dates[position] - line['datetime']) < abs(dates[best] - line['datetime']):
+                    best = position
+                position += 1
+        if best is None:
+            unmatched.append(line)
+        else:
+            matches.append((line, ids[best]))
+            del dates[best]
+            del ids[best]
+    return matches, unmatched
+
+
+def mark_reconciled(split_ids, when=None):
+    """
+    Mark splits as reconciled with bulk UPDATEs. Split objects already loaded
+    in the session are not refreshed.
+
+    :param split_ids: Iterable of split ids
+    :param when: Date of reconciliation, defaulting to now
+    """
+    if when is None:
+        when = datetime.utcnow()
+    split_ids = sorted(split_ids)
+    table = TransactionSplit.__table__
+    for start in range(0, len(split_ids), IN_CHUNK_SIZE):
+        db.session.execute(table.update().where(table.c.id.in_(split_ids[start:start + IN_CHUNK_SIZE])).values(
+            reconciled=True, reconciled_date=when))
+
+
+def reconcile(ledger, statement, tolerance=timedelta(days=3), when=None):
+    """
+    Match a statement to the ledger's unreconciled splits with
+    :func:`match_statement` and mark the matched splits as reconciled.
+
+    :returns: Tuple of a list of (line, split id) matches and a list of
+        unmatched lines
+    """
+    matches, unmatched = match_statement(ledger, statement, tolerance)
+    mark_reconciled([split_id for line, split_id in matches], when)
+    return matches, unmatched
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+
+"""
+Posting recurring transactions. Every due occurrence of every template is
+posted in batches with :func:`pennywise.transactions.post_transactions`,
+and each template's watermark is advanced in the same database transaction,
+so rerunning never posts an occurrence twice. Malformed templates are
+skipped and left due, and are posted on a later run once fixed.
+"""
+
+import hashlib
+import logging
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import bindparam
+from pennywise.models import db, RecurringTransaction, RecurringSplit
+from pennywise.models.recurring import occurrence
+from pennywise.transactions import IN_CHUNK_SIZE, _chunks, post_transactions
+
+#: Transactions posted per call to post_transactions
+BATCH_SIZE = 5000
+
+logger = logging.getLogger('pennywise.recurring')
+
+
+def fingerprint(recurring_id, number):
+    """
+    Return the fingerprint of an occurrence, stored on its transaction.
+    """
+    return hashlib.sha1(('recurring|%d|%d' % (recurring_id, number)).encode('utf-8')).hexdigest()
+
+
+def _due(template, until):
+    """
+    Yield (number, date) for the template's occurrences from its watermark up
+    to the given date, and finally (number, None) or the first occurrence
+    after that date as the new watermark.
+    """
+    number = template.posted
+    when = template.next_date
+    while when is not None and when <= until:
+        yield number, when
+        number += 1
+        when = occurrence(template, number)
+    yield number, when
+
+
+def _check(template, splits):
+    """
+    Assert that a template's occurrences would pass
+    :func:`~pennywise.transactions.validate_transactions`.
+
+    :raises ValueError: If the template is malformed
+    """
+    if len(splits) < 2:
+        raise ValueError("Recurring transaction %d has fewer than two splits" % template.id)
+    total = sum([Decimal(str(value)) for ledger_id, value, quantity in splits], Decimal(0))
+    if total != 0:
+        raise ValueError("Recurring transaction %d splits sum to %s, not zero" % (template.id, total))
+    if template.interval is None or template.interval < 1:
+        raise ValueError("Recurring transaction %d has interval %r" % (template.id, template.interval))
+
+
+def materialize(until=None, chunksize=1000, lock=False, commit=False, skipped=None):
+    """
+    Post all occurrences of recurring transactions due by the given date, for
+    all users. Templates are read in chunks by id with one query each for
+    templates and splits, and their occurrences are posted with bulk inserts
+    and set-based balance updates.
+
+    :param until: Post occurrences up to this date. Defaults to now
+    :param int chunksize: Number of templates per chunk
+    :param bool lock: Lock each chunk of templates (and the ledgers posted
+        to) so that concurrent runs wait for each other
+    :param bool commit: Commit after every chunk, so a long run can be
+        interrupted and rerun without holding everything in one transaction
+    :param list skipped: Optional list that (template id, error) is appended
+        to for every malformed template. Skipped templates are also logged
+    :returns: Number of transactions posted
+    """
+    if until is None:
+        until = datetime.utcnow()
+    table = RecurringTransaction.__table__
+    update = table.update().where(table.c.id == bindparam('recurring_id')).values(
+        posted=bindparam('recurring_posted'), next_date=bindparam('recurring_next_date'))
+    total = 0
+    after = 0
+    while True:
+        query = db.session.query(table.c.id, table.c.frequency, table.c.interval, table.c.start,
+            table.c.until, table.c.count, table.c.posted, table.c.next_date, table.c.num, table.c.description,
+            table.c.commodity_id).filter(table.c.next_date <= until, table.c.id > after).order_by(
+            table.c.id).limit(chunksize)
+        if lock:
+            query = query.with_for_update()
+        templates = query.all()
+        if not templates:
+            break
+        after = templates[-1].id
+
+        splits = {}
+        for chunk in _chunks([template.id for template in templates], IN_CHUNK_SIZE):
+            for split in db.session.query(RecurringSplit.recurring_id, RecurringSplit.ledger_id,
+                    RecurringSplit.value, RecurringSplit.quantity).filter(
+                    RecurringSplit.recurring_id.in_(chunk)).order_by(RecurringSplit.id):
+                splits.setdefault(split.recurring_id, []).append(
+                    (split.ledger_id, split.value, split.quantity))
+
+        batch = []
+        watermarks = []
+        for template in templates:
+            # One bad template must not stop everyone else's from posting
+            try:
+                _check(template, splits.get(template.id, []))
+                due = list(_due(template, until))
+            except ValueError as e:
+                logger.warning("Skipping recurring transaction %d: %s", template.id, e)
+                if skipped is not None:
+                    skipped.append((template.id, e))
+                continue
+            for number, when in due:
+                if when is None or when > until:
+                    break
+                batch.append({
+                    'commodity': template.commodity_id,
+                    'splits': splits.get(template.id, []),
+                    'datetime': when,
+                    'num': template.num,
+                    'description': template.description,
+                    'fingerprint': fingerprint(template.id, number),
+                    })
+            watermarks.append({'recurring_id': template.id, 'recurring_posted': number,
+                'recurring_next_date': when})
+        for chunk in _chunks(batch, BATCH_SIZE):
+            post_transactions(chunk, lock=lock)
+        if watermarks:
+            db.session.execute(update, watermarks)
+        total += len(batch)
+        if commit:
+            db.session.commit()
+    return total
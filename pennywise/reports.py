@@ -0,0 +1,189 @@
+# -*- coding: utf-8 -*-
+
+"""
+Financial reports over arbitrary period grids. Each report runs one aggregate
+query bucketed by period and ledger, and rolls totals up to placeholder
+ledgers with array operations over the ledger tree. Requires NumPy.
+"""
+
+from datetime import datetime
+from sqlalchemy import case, func, literal, select
+from pennywise.models import db, Ledger, LEDGER_TYPE, LEDGER_SUBTYPE, TRANSFER_COLUMNS, Transaction, TransactionSplit
+from pennywise.ledgers import _subtree
+from pennywise.instrument import instrumented
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+def month_boundaries(start, months):
+    """
+    Return the boundaries of a grid of calendar months, starting from the
+    month containing the given date. There is one more boundary than months.
+    """
+    year, month = start.year, start.month
+    boundaries = []
+    for count in range(months + 1):
+        boundaries.append(datetime(year + (month - 1 + count) // 12, (month - 1 + count) % 12 + 1, 1))
+    return boundaries
+
+
+class LedgerTree(object):
+    """
+    Ledger tree as arrays, with ledgers in order of level. Loaded with a single
+    query.
+
+    :param baseledger: Ledger at the root of the tree
+    """
+    def __init__(self, baseledger):
+        if numpy is None:
+            raise ImportError("NumPy is required for reports")
+        #: Ledger at the root of the tree
+        self.root = baseledger
+        tree = _subtree(baseledger)
+        rows = db.session.query(Ledger.id, Ledger.parent_id, Ledger.title, Ledger.ledger_type,
+            Ledger.ledger_subtype, tree.c.level).join(tree, Ledger.id == tree.c.id).order_by(
+            tree.c.level, Ledger.id).all()
+        #: Ledger ids
+        self.ids = numpy.array([row.id for row in rows], dtype='int64')
+        #: Position of each ledger id in the arrays
+        self.index = dict([(row.id, position) for position, row in enumerate(rows)])
+        #: Position of each ledger's parent, or -1 for the root
+        self.parents = numpy.array([self.index.get(row.parent_id, -1) if row.level else -1 for row in rows],
+            dtype='int64')
+        self.levels = numpy.array([row.level for row in rows], dtype='int64')
+        self.types = numpy.array([row.ledger_type for row in rows], dtype='int16')
+        self.titles = [row.title for row in rows]
+        #: Sign for presenting balances, from :data:`TRANSFER_COLUMNS`
+        self.signs = numpy.array([TRANSFER_COLUMNS.get((row.ledger_type, row.ledger_subtype),
+            TRANSFER_COLUMNS.get((row.ledger_type, LEDGER_SUBTYPE.NA), (None, None, 1)))[2] for row in rows],
+            dtype='float64')
+        # Flatten the tree depth-first, children in id order as in get_ledgers
+        children = {}
+        for position, row in enumerate(rows):
+            children.setdefault(int(self.parents[position]), []).append(position)
+        order = []
+        stack = list(reversed(children.get(-1, [])))
+        while stack:
+            position = stack.pop()
+            order.append(position)
+            stack.extend(reversed(children.get(position, [])))
+        #: Positions of the ledgers in depth-first tree order
+        self.order = numpy.array(order, dtype='int64')
+        # Positions of the ledgers at each level, deepest first, for rollup
+        self._levels = None
+
+    def __len__(self):
+        return len(self.ids)
+
+    def rollup(self, values):
+        """
+        Given an array with a row of values per ledger, return an array where
+        each row also includes the values of all ledgers below it. Adds up one
+        level of the tree at a time, deepest first.
+        """
+        totals = numpy.array(values, dtype='float64')
+        if self._levels is None:
+            self._levels = [numpy.nonzero(self.levels == level)[0]
+                for level in range(int(self.levels.max()) if len(self) else 0, 0, -1)]
+        for nodes in self._levels:
+            numpy.add.at(totals, self.parents[nodes], totals[nodes])
+        return totals
+
+
+class Report(object):
+    """
+    Report with one row per ledger and one column per period. Values include
+    subledgers and are signed for presentation, so income and liabilities are
+    positive.
+    """
+    def __init__(self, tree, boundaries, values, types):
+        self.tree = tree
+        #: Period boundaries. Column ``n`` is for the period ending at ``boundaries[n + 1]``
+        self.boundaries = boundaries
+        rows = tree.order[numpy.isin(tree.types[tree.order], list(types))]
+        #: Positions in the tree of the ledgers in this report, in tree order
+        self.rows = rows
+        #: Array of values, one row per ledger and one column per period
+        self.values = values[rows]
+
+    def __iter__(self):
+        """
+        Iterate over {ledger_id, title, level, values} dictionaries in tree
+        order, depth-first, as in :func:`~pennywise.ledgers.get_ledgers`.
+        """
+        for row, values in zip(self.rows, self.values):
+            yield {'ledger_id': int(self.tree.ids[row]), 'title': self.tree.titles[row],
+                'level': int(self.tree.levels[row]), 'values': values}
+
+
+def _bisect(column, boundaries, low, high):
+    """
+    Return a SQL expression for the number of boundaries at or before the
+    column's value, between low and high. The expression is a binary search of
+    nested CASEs, so each row makes a logarithmic number of comparisons
+    however many periods there are.
+    """
+    if low == high:
+        return literal(low)
+    middle = (low + high) // 2
+    return case([(column < boundaries[middle], _bisect(column, boundaries, low, middle))],
+        else_=_bisect(column, boundaries, middle + 1, high))
+
+
+def period_movements(tree, boundaries):
+    """
+    Return an array of the net movement of each ledger in the tree during each
+    period, with an additional first column for everything before the first
+    boundary. Uses a single aggregate query.
+    """
+    if numpy is None:
+        raise ImportError("NumPy is required for reports")
+    # Bucket 0 is before the first boundary, bucket n is the period ending at boundary n
+    bucket = _bisect(Transaction.datetime, boundaries, 0, len(boundaries) - 1)
+    query = db.session.query(TransactionSplit.ledger_id, bucket, func.sum(TransactionSplit.value)).join(
+        Transaction, TransactionSplit.transaction_id == Transaction.id).filter(
+        TransactionSplit.ledger_id.in_(select([_subtree(tree.root).c.id])),
+        Transaction.disabled == False, Transaction.datetime < boundaries[-1]).group_by(
+        TransactionSplit.ledger_id, bucket)
+    movements = numpy.zeros((len(tree), len(boundaries)), dtype='float64')
+    rows = query.all()
+    if rows:
+        ledger_ids, buckets, totals = zip(*rows)
+        movements[[tree.index[ledger_id] for ledger_id in ledger_ids], list(buckets)] = numpy.array(
+            totals, dtype='float64')
+    return movements
+
+
+@instrumented('balance_sheet')
+def balance_sheet(userledger, boundaries):
+    """
+    Balance sheet of asset, liability and equity ledgers at the end of each
+    period, as a :class:`Report`.
+
+    :param userledger: The user's root ledger
+    :param boundaries: Sorted list of period boundaries, such as from
+        :func:`month_boundaries`
+    """
+    tree = LedgerTree(userledger)
+    balances = numpy.cumsum(period_movements(tree, boundaries), axis=1)[:, 1:]
+    return Report(tree, boundaries, tree.rollup(balances) * tree.signs[:, None],
+        [LEDGER_TYPE.ASSET, LEDGER_TYPE.LIABILITY, LEDGER_TYPE.EQUITY])
+
+
+@instrumented('income_statement')
+def income_statement(userledger, boundaries):
+    """
+    Income statement of income and expense ledgers for each period, as a
+    :class:`Report`.
+
+    :param userledger: The user's root ledger
+    :param boundaries: Sorted list of period boundaries, such as from
+        :func:`month_boundaries`
+    """
+    tree = LedgerTree(userledger)
+    movements = period_movements(tree, boundaries)[:, 1:]
+    return Report(tree, boundaries, tree.rollup(movements) * tree.signs[:, None],
+        [LEDGER_TYPE.INCOME, LEDGER_TYPE.EXPENSE])
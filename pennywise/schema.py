@@ -0,0 +1,82 @@
+# -*- coding: utf-8 -*-
+
+"""
+Upgrading the schema of existing databases. New databases get the complete
+schema from ``db.create_all()``.
+"""
+
+from sqlalchemy import inspect, select
+from sqlalchemy.schema import CreateColumn, UniqueConstraint
+from pennywise.models import db, Node, Ledger, LEDGER_TYPE
+
+__all__ = ['upgrade']
+
+
+def upgrade(bind):
+    """
+    Bring an existing database up to date with the models. Creates missing
+    tables, adds missing nullable columns to existing tables and creates
+    missing indexes and unique constraints, and fixes data written by
+    earlier versions (see :func:`_retype_opening_balances`). Safe to run more
+    than once.
+
+    Unique constraints are created as unique indexes, as SQLite can't add
+    constraints to existing tables. Creating one fails if the table has
+    duplicate rows, such as transactions with the same ``buid`` or
+    commodities with the same type and symbol, which must be merged first.
+
+    :param bind: Engine or connection
+    :returns: List of the names of tables, columns, indexes and unique
+        constraints created, and of data fixes that changed rows
+    """
+    inspector = inspect(bind)
+    existing = set(inspector.get_table_names())
+    created = []
+    for table in db.metadata.sorted_tables:
+        if table.name not in existing:
+            table.create(bind)
+            created.append(table.name)
+            continue
+        columns = set([column['name'] for column in inspector.get_columns(table.name)])
+        for column in table.columns:
+            if column.name not in columns and column.nullable:
+                bind.execute('ALTER TABLE %s ADD COLUMN %s' % (
+                    bind.dialect.identifier_preparer.format_table(table),
+                    CreateColumn(column).compile(dialect=bind.dialect)))
+                created.append('%s.%s' % (table.name, column.name))
+        indexes = set([index['name'] for index in inspector.get_indexes(table.name)])
+        for index in table.indexes:
+            if index.name not in indexes:
+                index.create(bind)
+                created.append(index.name)
+        unique = set([frozenset(index['column_names']) for index in inspector.get_indexes(table.name)
+            if index['unique']] + [frozenset(constraint['column_names'])
+            for constraint in inspector.get_unique_constraints(table.name)])
+        for constraint in table.constraints:
+            if not isinstance(constraint, UniqueConstraint):
+                continue
+            names = [column.name for column in constraint.columns]
+            if frozenset(names) not in unique:
+                name = constraint.name or 'uq_%s_%s' % (table.name, '_'.join(names))
+                preparer = bind.dialect.identifier_preparer
+                bind.execute('CREATE UNIQUE INDEX %s ON %s (%s)' % (preparer.quote(name),
+                    preparer.format_table(table), ', '.join([preparer.quote(column) for column in names])))
+                created.append(name)
+    if 'ledger' in existing and _retype_opening_balances(bind):
+        created.append('ledger.opening_balances')
+    return created
+
+
+def _retype_opening_balances(bind):
+    """
+    Make Opening Balances ledgers under Equity equity ledgers. Before 0.2.0,
+    :func:`~pennywise.ledgers.make_default_ledgers` created them as expense
+    ledgers, so they appeared in income statements. Returns the number of
+    ledgers changed.
+    """
+    node, ledger = Node.__table__, Ledger.__table__
+    equity = ledger.alias('equity')
+    openings = select([node.c.id]).where(node.c.title == u'Opening Balances').where(
+        node.c.parent_id.in_(select([equity.c.id]).where(equity.c.ledger_type == LEDGER_TYPE.EQUITY)))
+    return bind.execute(ledger.update().where(ledger.c.ledger_type == LEDGER_TYPE.EXPENSE).where(
+        ledger.c.id.in_(openings)).values(ledger_type=LEDGER_TYPE.EQUITY)).rowcount
@@ -0,0 +1,147 @@
+# -*- coding: utf-8 -*-
+
+"""
+Sharding users across databases. Each user's ledgers and transactions live
+entirely in one shard, chosen by a tenant key such as the user's root ledger
+uuid or the application's user id. Within :meth:`ShardRouter.tenant`, every
+pennywise operation uses the tenant's shard::
+
+    router = ShardRouter({'a': 'sqlite:///a.db', 'b': 'sqlite:///b.db'})
+    with router.tenant(user_key):
+        post_transactions(batch)
+
+Ledger ids repeat across shards, so caches of ledgers must be keyed by
+shard, as with ``LedgerCache(shard=router.shard_of)``.
+
+Setups with one database don't need a router.
+"""
+
+import sys
+import threading
+import zlib
+from contextlib import contextmanager
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from pennywise.standalone import create_tables, use_session
+
+__all__ = ['ShardRouter']
+
+
+class ShardRouter(object):
+    """
+    Route tenants to shards. Shards can be separate databases, such as SQLite
+    files, or schemas in one database, using engines with a
+    ``schema_translate_map`` execution option.
+
+    Ledger, transaction and commodity ids are only unique within a shard, so
+    they must not be used as tenant keys, or shared between shards.
+
+    :param shards: Dictionary of shard name to engine or database URL
+    :param locate: Optional function that returns the shard name for a tenant
+        key, such as a lookup in a directory of tenants. The default hashes
+        the key over the shards, which moves tenants if shards are added
+    """
+    def __init__(self, shards, locate=None):
+        self.engines = dict([(name, create_engine(bind) if isinstance(bind, (str, type(u''))) else bind)
+            for name, bind in shards.items()])
+        self.names = sorted(self.engines)
+        self._sessionmakers = dict([(name, sessionmaker(bind=engine)) for name, engine in self.engines.items()])
+        self.locate = locate
+
+    def shard_for(self, key):
+        """
+        Return the name of the shard for a tenant key.
+        """
+        if self.locate is not None:
+            return self.locate(key)
+        if not isinstance(key, bytes):
+            key = type(u'')(key).encode('utf-8')
+        # crc32 is the same in every process, unlike hash()
+        return self.names[(zlib.crc32(key) & 0xffffffff) % len(self.names)]
+
+    def session(self, key=None, shard=None):
+        """
+        Return a new session for a tenant's shard, or for the named shard.
+        """
+        return self._sessionmakers[shard if shard is not None else self.shard_for(key)]()
+
+    def shard_of(self, session):
+        """
+        Return the name of the shard a session is bound to, for
+        :class:`~pennywise.cache.LedgerCache` and other per-shard state.
+
+        :raises ValueError: If the session isn't bound to one of the shards
+        """
+        bind = session.bind
+        bind = getattr(bind, 'engine', bind)
+        for name in self.names:
+            if self.engines[name] is bind:
+                return name
+        raise ValueError("Session is not bound to a shard")
+
+    @contextmanager
+    def tenant(self, key):
+        """
+        Context manager that makes a session for the tenant's shard the
+        default for all pennywise operations in this thread. Commits at the
+        end, or rolls back if there was an exception.
+        """
+        session = self.session(key)
+        try:
+            with use_session(session):
+                yield session
+            session.commit()
+        except:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+
+    def create_tables(self):
+        """
+        Create missing pennywise tables in every shard.
+        """
+        for name in self.names:
+            create_tables(self.engines[name])
+
+    def fan_out(self, func, shards=None, commit=False):
+        """
+        Call a function in every shard in parallel, one thread per shard,
+        for admin queries across tenants. The function is called with a session
+        for the shard, which is also the default session in its thread.
+
+        Shards are committed independently, so with ``commit`` some shards may
+        have committed if another fails.
+
+        :param func: Function that takes a session
+        :param shards: Names of the shards to call, defaulting to all
+        :param bool commit: Commit each shard's session, instead of rolling back
+        :returns: Dictionary of shard name to the function's result
+        :raises: The first exception raised in any shard, after all shards finish
+        """
+        names = self.names if shards is None else shards
+        results = {}
+        errors = {}
+
+        def run(name):
+            session = self.session(shard=name)
+            try:
+                with use_session(session):
+                    results[name] = func(session)
+                if commit:
+                    session.commit()
+            except Exception:
+                errors[name] = sys.exc_info()[1]
+                session.rollback()
+            finally:
+                session.close()
+
+        threads = [threading.Thread(target=run, args=(name,)) for name in names]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        for name in names:
+            if name in errors:
+                raise errors[name]
+        return results
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+
+"""
+In-memory what-if simulation of a user's ledgers. A user's splits are
+loaded once into arrays, and scenarios that enable or disable transactions
+or add hypothetical ones are evaluated without touching the database.
+Requires NumPy.
+"""
+
+from sqlalchemy import select
+from pennywise.models import db, Transaction, TransactionSplit
+from pennywise.ledgers import _subtree
+from pennywise.reports import LedgerTree, numpy
+from pennywise.transactions import _split, validate_transactions
+
+
+class Projection(object):
+    """
+    Projected balances of every ledger in a tree under a scenario.
+    """
+    __slots__ = ['tree', 'balances', '_totals']
+
+    def __init__(self, tree, balances):
+        self.tree = tree
+        #: Array of projected balances of each ledger, not including subledgers
+        self.balances = balances
+        self._totals = None
+
+    @property
+    def totals(self):
+        """
+        Array of projected balances of each ledger including its subledgers.
+        """
+        if self._totals is None:
+            self._totals = self.tree.rollup(self.balances)
+        return self._totals
+
+    def balance(self, ledger_id):
+        """
+        Return the projected balance of a ledger, not including subledgers.
+        """
+        return self.balances[self.tree.index[ledger_id]]
+
+    def total(self, ledger_id):
+        """
+        Return the projected balance of a ledger including its subledgers.
+        """
+        return self.totals[self.tree.index[ledger_id]]
+
+
+class Simulation(object):
+    """
+    A user's ledger tree and splits held in arrays, for evaluating scenarios.
+    Loaded with two queries. Balances are floats, so projections are
+    approximate in the last cents of very large amounts.
+
+    :param userledger: The user's root ledger
+    """
+    def __init__(self, userledger):
+        #: The user's :class:`~pennywise.reports.LedgerTree`
+        self.tree = LedgerTree(userledger)
+        splits = TransactionSplit.__table__
+        transactions = Transaction.__table__
+        rows = db.session.execute(select([splits.c.transaction_id, splits.c.ledger_id, splits.c.value,
+            transactions.c.disabled]).select_from(splits.join(transactions,
+            splits.c.transaction_id == transactions.c.id)).where(
+            splits.c.ledger_id.in_(select([_subtree(userledger).c.id]))).order_by(
+            splits.c.transaction_id, splits.c.id)).fetchall()
+        if rows:
+            transaction_ids, ledger_ids, values, disabled = zip(*rows)
+        else:
+            transaction_ids, ledger_ids, values, disabled = (), (), (), ()
+        transaction_ids = numpy.array(transaction_ids, dtype='int64')
+        starts = numpy.concatenate([[True], transaction_ids[1:] != transaction_ids[:-1]]) if rows else \
+            numpy.array([], dtype='bool')
+        #: Ids of the user's transactions, sorted
+        self.transaction_ids = transaction_ids[starts]
+        #: Whether each transaction is disabled
+        self.disabled = numpy.array(disabled, dtype='bool')[starts]
+        # Splits are grouped by transaction. Transaction n has splits offsets[n] to offsets[n + 1]
+        self._offsets = numpy.append(numpy.nonzero(starts)[0], len(transaction_ids)).astype('int64')
+        self._ledgers = numpy.array([self.tree.index[ledger_id] for ledger_id in ledger_ids], dtype='int64')
+        self._values = numpy.array(values, dtype='float64')
+        enabled = ~numpy.array(disabled, dtype='bool')
+        #: Balances of each ledger with the transactions as they are, not
+        #: including subledgers
+        self.balances = numpy.bincount(self._ledgers[enabled], weights=self._values[enabled],
+            minlength=len(self.tree)).astype('float64')
+
+    def _positions(self, transaction_ids):
+        """
+        Return positions of the given transactions, raising KeyError for unknown ids.
+        """
+        ids = numpy.array(sorted(set(transaction_ids)), dtype='int64')
+        positions = numpy.searchsorted(self.transaction_ids, ids)
+        # Ids are sorted, so only the last can be past the end
+        if len(ids) and (positions[-1] == len(self.transaction_ids) or
+                (self.transaction_ids[positions] != ids).any()):
+            raise KeyError("Unknown transactions")
+        return positions
+
+    def _add(self, balances, positions, sign):
+        """
+        Add the splits of the transactions at the given positions to balances.
+        """
+        starts = self._offsets[positions]
+        counts = self._offsets[positions + 1] - starts
+        total = int(counts.sum())
+        if not total:
+            return
+        # Indexes of all their splits, without a Python loop
+        splits = numpy.repeat(starts - numpy.cumsum(counts) + counts, counts) + numpy.arange(total)
+        numpy.add.at(balances, self._ledgers[splits], sign * self._values[splits])
+
+    def project(self, enable=(), disable=(), transactions=()):
+        """
+        Return a :class:`Projection` of balances with some transactions enabled
+        or disabled, and hypothetical transactions added.
+
+        :param enable: Ids of disabled transactions to count
+        :param disable: Ids of enabled transactions to leave out
+        :param transactions: Hypothetical transaction dictionaries, as accepted
+            by :func:`pennywise.transactions.post_transactions`. Splits may give
+            ledger ids instead of ledgers. Disabled ones are left out
+        :raises KeyError: If a transaction id or ledger is not in the user's tree
+        :raises ValueError: If a hypothetical transaction fails validation
+        """
+        balances = self.balances.copy()
+        if len(enable):
+            positions = self._positions(enable)
+            self._add(balances, positions[self.disabled[positions]], 1)
+        if len(disable):
+            positions = self._positions(disable)
+            self._add(balances, positions[~self.disabled[positions]], -1)
+        if transactions:
+            validate_transactions(transactions)
+            for item in transactions:
+                if item.get('disabled', False):
+                    continue
+                for ledger, value, quantity in [_split(split) for split in item['splits']]:
+                    balances[self.tree.index[getattr(ledger, 'id', ledger)]] += float(value)
+        return Projection(self.tree, balances)
@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+
+"""
+Using pennywise without a Flask app, such as in batch workers and scripts.
+Models are plain SQLAlchemy declarative classes and work with any session.
+Operations that take a ``session`` parameter can be given one directly, and
+:func:`use_session` makes a session the default for everything else::
+
+    session = create_session('postgresql://localhost/pennywise')
+    with use_session(session):
+        post_transactions(batch)
+        session.commit()
+"""
+
+from contextlib import contextmanager
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from pennywise.models import db
+
+__all__ = ['create_session', 'create_tables', 'use_session']
+
+
+def create_session(url, **kwargs):
+    """
+    Return a new plain SQLAlchemy session for a database URL.
+
+    :param kwargs: Passed to :func:`~sqlalchemy.create_engine`
+    """
+    return sessionmaker(bind=create_engine(url, **kwargs))()
+
+
+def create_tables(bind):
+    """
+    Create all pennywise tables that don't exist yet.
+
+    :param bind: Engine or connection
+    """
+    db.metadata.create_all(bind)
+
+
+@contextmanager
+def use_session(session):
+    """
+    Context manager that makes the session the default (``db.session``) for
+    pennywise operations in the current thread. Relies on the thread-scoped
+    sessions of Flask-SQLAlchemy 2. The thread's previous session, if any, is
+    restored afterwards, so calls can be nested.
+    """
+    registry = db.session.registry
+    previous = registry() if registry.has() else None
+    registry.set(session)
+    try:
+        yield session
+    finally:
+        if previous is not None:
+            registry.set(previous)
+        else:
+            registry.clear()
@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+"""
+Operations on transactions.
+"""
+
+from datetime import datetime
+from decimal import Decimal
+from sqlalchemy import bindparam
+from coaster.utils import buid as buid_func
+from pennywise.models import db, Ledger, Transaction, TransactionSplit, LedgerSnapshot, JOURNAL_EVENT
+from pennywise.instrument import instrumented
+
+#: Maximum number of parameters in a single IN clause
+IN_CHUNK_SIZE = 500
+
+#: Functions called with a list of ledger ids after their balances are
+#: updated in bulk, bypassing the ORM
+balance_listeners = []
+
+
+def _chunks(items, size):
+    """
+    Yield successive slices of a list.
+    """
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+def _split(split):
+    """
+    Normalize a (ledger, value) or (ledger, value, quantity) split tuple.
+    """
+    if len(split) == 2:
+        ledger, value = split
+        quantity = value
+    else:
+        ledger, value, quantity = split
+    if not isinstance(value, Decimal):
+        value = Decimal(str(value))
+    if not isinstance(quantity, Decimal):
+        quantity = Decimal(str(quantity))
+    return ledger, value, quantity
+
+
+@instrumented('validate_transactions')
+def validate_transactions(batch):
+    """
+    Assert that every transaction in the batch is well defined and safe to
+    commit to database, in a single pass over all splits. Each transaction must
+    have at least two splits and its split values must sum to zero.
+
+    :param batch: List of transaction dictionaries, as accepted by
+        :func:`post_transactions`
+    :raises ValueError: If a transaction fails validation
+    """
+    for index, item in enumerate(batch):
+        splits = item['splits']
+        if len(splits) < 2:
+            raise ValueError("Transaction %d has fewer than two splits" % index)
+        total = Decimal(0)
+        for split in splits:
+            total += _split(split)[1]
+        if total != 0:  # TODO: What about multi-currency?
+            raise ValueError("Transaction %d splits sum to %s, not zero" % (index, total))
+
+
+@instrumented('update_balances')
+def update_balances(deltas, session=None):
+    """
+    Add to ledger balances with one grouped UPDATE per ledger. Ledgers are
+    updated in id order.
+
+    :param deltas: Dictionary of ledger id to the amount to add to its balance
+    :param session: Session to update in, defaulting to ``db.session``
+    """
+    if session is None:
+        session = db.session
+    table = Ledger.__table__
+    rows = [{'ledger_id': ledger_id, 'delta': delta}
+        for ledger_id, delta in sorted(deltas.items()) if delta != 0]
+    if rows:
+        session.execute(table.update().where(table.c.id == bindparam('ledger_id')).values(
+            balance=table.c.balance + bindparam('delta')), rows)
+        for listener in balance_listeners:
+            listener([row['ledger_id'] for row in rows])
+
+
+@instrumented('update_snapshots')
+def update_snapshots(deltas, session=None):
+    """
+    Add to ledger snapshots, creating missing snapshots, with one bulk upsert
+    (see :meth:`LedgerSnapshot.add_values`).
+
+    :param deltas: Dictionary of (ledger id, period start) to the amount to add
+    :param session: Session to update in, defaulting to ``db.session``
+    """
+    LedgerSnapshot.add_values(deltas, session)
+
+
+def expire_balances(ledger_ids, session=None):
+    """
+    Expire the balances of ledgers loaded in the session, after they were
+    updated bypassing the ORM. They are reloaded on access.
+
+    :param ledger_ids: Iterable of ledger ids
+    :param session: Session the ledgers are loaded in, defaulting to ``db.session``
+    """
+    if session is None:
+        session = db.session
+    mapper = Ledger.__mapper__
+    for ledger_id in ledger_ids:
+        ledger = session.identity_map.get(mapper.identity_key_from_primary_key([ledger_id]))
+        if ledger is not None:
+            session.expire(ledger, ['balance'])
+
+
+def lock_ledgers(ledger_ids, session=None):
+    """
+    Take row-level locks on the given ledgers until the end of the database
+    transaction. Locks are always taken in ledger id order, so concurrent
+    posters can't deadlock each other. Databases without row-level locking
+    (such as SQLite) ignore this.
+
+    :param ledger_ids: Iterable of ledger ids
+    :param session: Session to lock in, defaulting to ``db.session``
+    """
+    if session is None:
+        session = db.session
+    ledger_ids = sorted(set(ledger_ids))
+    for chunk in _chunks(ledger_ids, IN_CHUNK_SIZE):
+        session.query(Ledger.id).filter(Ledger.id.in_(chunk)).order_by(Ledger.id).with_for_update().all()
+
+
+@instrumented('post_transactions')
+def post_transactions(batch, lock=False, session=None, deferred=False):
+    """
+    Post a batch of transactions with bulk inserts and set-based balance updates,
+    bypassing the ORM. This is much faster than creating :class:`Transaction`
+    and :class:`TransactionSplit` objects one at a time.
+
+    Each transaction in the batch is a dictionary with these keys:
+
+    * ``commodity``: :class:`Commodity` the transaction is in, or its id (required)
+    * ``splits``: list of ``(ledger, value)`` or ``(ledger, value, quantity)``
+      tuples, where ledger may be a ledger id (required)
+    * ``datetime``, ``num``, ``description``, ``disabled``, ``fingerprint``:
+      optional, as in :class:`Transaction`
+
+    Balances of ledgers loaded in the session are expired and will be
+    reloaded on access. Disabled transactions don't add to the balance.
+
+    Balances are changed with server-side increments, so any number of workers
+    may post to the same ledgers at once.
+
+    With ``deferred``, balances and snapshots are not updated. Changes are
+    appended to the posting journal instead, without touching ledger rows, and
+    applied later by :func:`pennywise.journal.materialize`.
+
+    :param batch: List of transaction dictionaries
+    :param bool lock: Lock all ledgers in the batch (in id order) before posting
+    :param session: Session to post in, defaulting to ``db.session``
+    :param bool deferred: Journal balance changes instead of applying them
+    :returns: List of new transaction ids, in the order of the batch
+    :raises ValueError: If a transaction fails validation, before anything is posted
+    """
+    if session is None:
+        session = db.session
+    validate_transactions(batch)
+    # Ledgers and commodities need ids before we can refer to them
+    session.flush()
+    if lock and not deferred:
+        # Before any inserts: on PostgreSQL, foreign key checks on the split
+        # inserts take shared locks on the ledgers, which would deadlock with
+        # another poster's exclusive locks
+        lock_ledgers([getattr(split[0], 'id', split[0]) for item in batch for split in item['splits']], session)
+
+    now = datetime.utcnow()
+    buids = []
+    transactions = []
+    for item in batch:
+        buid = buid_func()
+        buids.append(buid)
+        transactions.append({
+            'buid': buid,
+            'datetime': item.get('datetime') or now,
+            'num': item.get('num', u''),
+            'description': item.get('description', u''),
+            'commodity_id': getattr(item['commodity'], 'id', item['commodity']),
+            'disabled': item.get('disabled', False),
+            'fingerprint': item.get('fingerprint'),
+            })
+    if not transactions:
+        return []
+    session.execute(Transaction.__table__.insert(), transactions)
+
+    ids = {}
+    for chunk in _chunks(buids, IN_CHUNK_SIZE):
+        ids.update(session.query(Transaction.buid, Transaction.id).filter(Transaction.buid.in_(chunk)))
+
+    splits = []
+    entries = []
+    deltas = {}
+    snapshots = {}
+    ledger_ids = set()
+    for buid, transaction, item in zip(buids, transactions, batch):
+        start = LedgerSnapshot.period_start(transaction['datetime'])
+        for ledger, value, quantity in [_split(split) for split in item['splits']]:
+            ledger_id = getattr(ledger, 'id', ledger)
+            splits.append({
+                'transaction_id': ids[buid],
+                'ledger_id': ledger_id,
+                'value': value,
+                'quantity': quantity,
+                'reconciled': False,
+                })
+            ledger_ids.add(ledger_id)
+            if deferred:
+                if not item.get('disabled', False):
+                    entries.append({
+                        'event': JOURNAL_EVENT.CREATE,
+                        'transaction_id': ids[buid],
+                        'ledger_id': ledger_id,
+                        'datetime': transaction['datetime'],
+                        'value': value,
+                        })
+            elif not item.get('disabled', False):
+                deltas[ledger_id] = deltas.get(ledger_id, 0) + value
+                snapshots[(ledger_id, start)] = snapshots.get((ledger_id, start), 0) + value
+    session.execute(TransactionSplit.__table__.insert(), splits)
+    if deferred:
+        # Circular import: the journal applies changes with update_balances
+        from pennywise.journal import append
+        append(entries, session)
+        return [ids[buid] for buid in buids]
+    update_balances(deltas, session)
+    update_snapshots(snapshots, session)
+    expire_balances(ledger_ids, session)
+    return [ids[buid] for buid in buids]
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+
+"""
+Asyncio facade over pennywise operations, for services built on asyncio.
+Requires Python 3 and SQLAlchemy 1.4 or later, with an async database
+driver such as asyncpg or aiosqlite.
+
+Each function takes an :class:`~sqlalchemy.ext.asyncio.AsyncSession` and
+runs the synchronous operation inside it with
+:meth:`~sqlalchemy.ext.asyncio.AsyncSession.run_sync`, so validation and
+balance updates are the same as in the synchronous API. Database IO yields
+to the event loop instead of blocking a thread.
+
+Attributes of returned objects that were not loaded can't be accessed
+outside of these functions, as loading them would need IO.
+
+With a synchronous driver, :func:`run_in_executor` runs any pennywise
+operation in a thread of the event loop's executor instead.
+
+This is a separate package from :mod:`pennywise`, which still supports
+Python 2.
+"""
+
+import asyncio
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import sessionmaker
+from pennywise.models import Ledger
+from pennywise import ledgers, transactions
+
+__all__ = ['create_sessionmaker', 'run_in_executor', 'create_transaction', 'post_transactions', 'get_balance',
+    'get_balances', 'get_ledger_tree', 'get_register']
+
+
+def create_sessionmaker(url, **kwargs):
+    """
+    Return a factory of async sessions for a database URL such as
+    ``postgresql+asyncpg://...``. Objects are not expired on commit, as
+    reloading them would need IO. The engine is available as
+    ``factory.kw['bind']``, to dispose of at shutdown.
+
+    :param kwargs: Passed to :func:`~sqlalchemy.ext.asyncio.create_async_engine`
+    """
+    return sessionmaker(create_async_engine(url, **kwargs), class_=AsyncSession, expire_on_commit=False)
+
+
+def _in_session(function, *args, **kwargs):
+    """
+    Wrap a synchronous operation for :meth:`AsyncSession.run_sync`, which
+    passes the synchronous session as the first argument.
+    """
+    def run(session):
+        return function(*args, session=session, **kwargs)
+    return run
+
+
+async def run_in_executor(factory, function, *args, **kwargs):
+    """
+    Run a synchronous pennywise operation in a new session from ``factory``,
+    in the event loop's default executor, and commit it. The session is passed
+    to the operation as ``session``, so it must accept one.
+
+    :param factory: Synchronous session factory, such as a :class:`sessionmaker`
+    :returns: The operation's result
+    """
+    def run():
+        session = factory()
+        try:
+            result = function(*args, session=session, **kwargs)
+            session.commit()
+            return result
+        except:
+            session.rollback()
+            raise
+        finally:
+            session.close()
+    return await asyncio.get_event_loop().run_in_executor(None, run)
+
+
+async def post_transactions(session, batch, lock=False):
+    """
+    Post a batch of transactions. See :func:`pennywise.transactions.post_transactions`.
+
+    :returns: List of new transaction ids, in the order of the batch
+    """
+    return await session.run_sync(_in_session(transactions.post_transactions, batch, lock))
+
+
+async def create_transaction(session, commodity, splits, **kwargs):
+    """
+    Post a single transaction.
+
+    :param commodity: :class:`Commodity` the transaction is in
+    :param splits: List of ``(ledger, value)`` or ``(ledger, value, quantity)`` tuples
+    :param kwargs: ``datetime``, ``num``, ``description``, ``disabled`` or
+        ``fingerprint``, as in :class:`Transaction`
+    :returns: Id of the new transaction
+    """
+    item = dict(kwargs, commodity=commodity, splits=splits)
+    return (await post_transactions(session, [item]))[0]
+
+
+async def get_balance(session, ledger, when=None):
+    """
+    Return the current balance of a ledger, or its balance at the given date
+    and time as from :func:`pennywise.ledgers.balance_at`.
+    """
+    def balance(session):
+        if when is not None:
+            return ledgers.balance_at(ledger, when, session=session)
+        return session.query(Ledger.balance).filter(Ledger.id == ledger.id).scalar()
+    return await session.run_sync(balance)
+
+
+async def get_balances(session, baseledger, valuation=None):
+    """
+    Return rolled-up balances for a ledger tree. See :func:`pennywise.ledgers.get_balances`.
+    """
+    return await session.run_sync(_in_session(ledgers.get_balances, baseledger, valuation))
+
+
+async def get_ledger_tree(session, baseledger):
+    """
+    Return a dictionary of parent ledger id to the list of child ledgers. See
+    :func:`pennywise.ledgers.get_ledger_tree`.
+    """
+    return await session.run_sync(_in_session(ledgers.get_ledger_tree, baseledger))
+
+
+async def get_register(session, ledger, after=None, limit=100):
+    """
+    Return a page of a ledger's register. See :func:`pennywise.ledgers.get_register`.
+    """
+    return await session.run_sync(_in_session(ledgers.get_register, ledger, after, limit))
@@ -1,5 +1,6 @@
 import os
 import re
+import sys
 from setuptools import setup, find_packages
 
 here = os.path.abspath(os.path.dirname(__file__))
@@ -14,8 +15,8 @@ else:
     raise RuntimeError("Unable to find version string in pennywise/_version.py.")
 
 requires = [
-    'SQLAlchemy>=0.8',
-    'Flask-SQLAlchemy',
+    'SQLAlchemy>=0.9',
+    'Flask-SQLAlchemy<3',  # standalone.use_session needs its thread-scoped sessions
     'nodular',
     ]
 
@@ -39,11 +40,18 @@ setup(name='pennywise',
     author_email='jace@pobox.com',
     url='https://github.com/jace/pennywise',
     keywords='accounting',
-    packages=find_packages(),
+    # pennywise_aio is Python 3 only
+    packages=find_packages(exclude=['benchmarks', 'benchmarks.*'] + (
+        ['pennywise_aio'] if sys.version_info < (3,) else [])),
     include_package_data=True,
     zip_safe=False,
     test_suite='pennywise',
     install_requires=requires,
+    extras_require={
+        'numpy': ['numpy'],
+        'arrow': ['numpy', 'pyarrow'],
+        'async': ['SQLAlchemy>=1.4'],
+        },
     dependency_links=[
         "https://github.com/hasgeek/nodular/archive/master.zip#egg=nodular"
         ]
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+"""
+Tests run against the database in ``SQLALCHEMY_DATABASE_URI``, by default
+the PostgreSQL test database set up in ``.travis.yml``.
+"""
+
+import os
+import tempfile
+import unittest
+from flask import Flask
+from pennywise.models import db, Commodity, COMMODITY_TYPE, Ledger, LEDGER_TYPE
+from pennywise.ledgers import make_default_ledgers
+
+DATABASE_URI = os.environ.get('SQLALCHEMY_DATABASE_URI', 'postgresql://postgres@localhost/myapp_test')
+
+
+class DatabaseTestCase(unittest.TestCase):
+    """
+    Test case with a Flask app and a fresh pennywise database, with the app
+    context pushed for each test.
+    """
+    #: Whether threads need to share the database. An in-memory SQLite
+    #: database is replaced with a temporary file
+    shared = False
+
+    def setUp(self):
+        self.path = None
+        database = DATABASE_URI
+        if self.shared and database in ('sqlite://', 'sqlite:///:memory:'):
+            handle, self.path = tempfile.mkstemp(suffix='.db')
+            os.close(handle)
+            database = 'sqlite:///' + self.path
+        self.app = Flask('pennywise.tests')
+        self.app.config['SQLALCHEMY_DATABASE_URI'] = database
+        self.app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+        db.init_app(self.app)
+        self.context = self.app.app_context()
+        self.context.push()
+        db.drop_all()
+        db.create_all()
+
+    def tearDown(self):
+        db.session.remove()
+        db.drop_all()
+        db.get_engine(self.app).dispose()
+        self.context.pop()
+        if self.path is not None:
+            os.remove(self.path)
+
+    def make_user(self, title=u'User'):
+        """
+        Return a new user root ledger with the default ledger tree, committed.
+        """
+        commodity = Commodity.get_or_create(COMMODITY_TYPE.CURRENCY, u'INR')
+        db.session.add(commodity)
+        userledger = Ledger(title=title, ledger_type=LEDGER_TYPE.USER, commodity=commodity)
+        db.session.add(userledger)
+        make_default_ledgers(userledger)
+        db.session.commit()
+        return userledger
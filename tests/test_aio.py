@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+
+import os
+import tempfile
+import unittest
+from decimal import Decimal
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from pennywise.models import Commodity, Ledger, LEDGER_TYPE
+from pennywise.ledgers import make_default_ledgers
+from pennywise.standalone import create_tables, use_session
+from pennywise import transactions
+
+try:
+    import asyncio
+    import pennywise_aio
+except (ImportError, SyntaxError):  # Python 2
+    pennywise_aio = None
+
+try:
+    import aiosqlite
+except ImportError:
+    aiosqlite = None
+
+
+class AsyncioTestCase(unittest.TestCase):
+    def setUp(self):
+        handle, self.path = tempfile.mkstemp(suffix='.db')
+        os.close(handle)
+        self.engine = create_engine('sqlite:///' + self.path)
+        create_tables(self.engine)
+        self.factory = sessionmaker(bind=self.engine)
+        session = self.factory()
+        with use_session(session):
+            commodity = Commodity.get_or_create(0, u'INR')
+            userledger = Ledger(title=u'User', ledger_type=LEDGER_TYPE.USER, commodity=commodity)
+            session.add(userledger)
+            make_default_ledgers(userledger)
+            session.commit()
+            self.commodity_id = commodity.id
+            self.bank_id = session.query(Ledger.id).filter_by(title=u'Bank').scalar()
+            self.food_id = session.query(Ledger.id).filter_by(title=u'Food').scalar()
+        session.close()
+        self.loop = asyncio.new_event_loop()
+        self.batch = [{'commodity': self.commodity_id, 'splits': [(self.bank_id, -10), (self.food_id, 10)]}]
+
+    def tearDown(self):
+        self.loop.close()
+        self.engine.dispose()
+        os.remove(self.path)
+
+    def balance(self, ledger_id):
+        session = self.factory()
+        try:
+            return session.query(Ledger.balance).filter_by(id=ledger_id).scalar()
+        finally:
+            session.close()
+
+
+# Python 2.6 has no unittest.skipIf
+if pennywise_aio is not None:
+    class TestExecutor(AsyncioTestCase):
+        def test_run_in_executor(self):
+            ids = self.loop.run_until_complete(pennywise_aio.run_in_executor(self.factory,
+                transactions.post_transactions, self.batch))
+            self.assertEqual(len(ids), 1)
+            self.assertEqual(self.balance(self.bank_id), Decimal(-10))
+
+
+if pennywise_aio is not None and aiosqlite is not None:
+    class TestAsyncSession(AsyncioTestCase):
+        def test_run_sync(self):
+            factory = pennywise_aio.create_sessionmaker('sqlite+aiosqlite:///' + self.path)
+            session = factory()
+            run = self.loop.run_until_complete
+            try:
+                ids = run(pennywise_aio.post_transactions(session, self.batch))
+                run(session.commit())
+                balance = run(pennywise_aio.get_balance(session, run(session.get(Ledger, self.bank_id))))
+            finally:
+                run(session.close())
+                run(factory.kw['bind'].dispose())
+            self.assertEqual(len(ids), 1)
+            self.assertEqual(balance, Decimal(-10))
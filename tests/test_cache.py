@@ -0,0 +1,79 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from decimal import Decimal
+from sqlalchemy import event
+from pennywise.models import db, Ledger
+from pennywise.cache import LedgerCache, LRUCache, DictBackend
+from pennywise.transactions import post_transactions, balance_listeners
+from . import DatabaseTestCase
+
+
+class TestSharedInvalidation(DatabaseTestCase):
+    def setUp(self):
+        super(TestSharedInvalidation, self).setUp()
+        self.userledger = self.make_user()
+        self.bank = Ledger.query.filter_by(title=u'Bank').one()
+        self.food = Ledger.query.filter_by(title=u'Food').one()
+        shared = DictBackend()
+        # A process that only reads, and one that only writes
+        self.reader = LedgerCache(shared=shared)
+        self.writer = LedgerCache(shared=shared)
+        self.writer.listen(db.session)
+
+    def tearDown(self):
+        event.remove(db.session, 'after_flush', self.writer._after_flush)
+        event.remove(db.session, 'after_commit', self.writer._after_commit)
+        event.remove(db.session, 'after_soft_rollback', self.writer._after_commit)
+        balance_listeners.remove(self.writer._bulk_update)
+        super(TestSharedInvalidation, self).tearDown()
+
+    def test_bulk_post(self):
+        self.assertEqual(self.reader.get_balances(self.userledger)[self.bank.id], Decimal(0))
+        post_transactions([{'commodity': self.userledger.commodity_id,
+            'splits': [(self.bank.id, -10), (self.food.id, 10)]}])
+        db.session.commit()
+        self.assertEqual(self.reader.get_balances(self.userledger)[self.bank.id], Decimal(-10))
+
+    def test_ledger_change(self):
+        self.app.add_url_rule('/ledger/<uuid>', 'ledger')
+        with self.app.test_request_context():
+            titles = [row['title'] for row in self.reader.get_ledgers(self.userledger)]
+            self.assertTrue(u'Food' in titles)
+            self.food.title = u'Groceries'
+            db.session.commit()
+            titles = [row['title'] for row in self.reader.get_ledgers(self.userledger)]
+            self.assertTrue(u'Groceries' in titles)
+
+    def test_url(self):
+        # Filled outside a request, as by a worker, and read in one
+        self.reader.get_ledgers(self.userledger)
+        self.app.add_url_rule('/ledger/<uuid>', 'ledger')
+        with self.app.test_request_context():
+            rows = self.reader.get_ledgers(self.userledger)
+        self.assertEqual(rows[0]['url'], '/ledger/' + self.userledger.uuid)
+        self.assertEqual(self.reader.get_ledgers(self.userledger)[0]['url'], None)
+        self.assertEqual(self.reader.stats()['misses'], 1)
+
+    def test_roots_bound(self):
+        cache = LedgerCache(maxroots=5)
+        self.assertTrue(len(cache.get_ledgers(self.userledger)) > 5)
+        self.assertEqual(len(cache._roots._entries), 5)
+        # Roots of forgotten ledgers are looked up again
+        cache.get_balances(self.userledger)
+        cache.invalidate_ledgers([self.bank.id])
+        self.assertEqual(cache.stats()['invalidations'], 1)
+
+
+class TestLRUCache(unittest.TestCase):
+    def test_order(self):
+        cache = LRUCache(maxsize=2)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.set('c', 3)
+        self.assertEqual([cache.get(key) for key in 'abc'], [1, None, 3])
+        cache.set('a', 4)
+        cache.delete('c')
+        cache.set('d', 5)
+        self.assertEqual([cache.get(key) for key in 'abcd'], [4, None, None, 5])
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from decimal import Decimal
+from pennywise.models import db, Ledger, Transaction, ArchivedTransaction, ArchivedTransactionSplit
+from pennywise.ledgers import get_balances
+from pennywise.transactions import post_transactions
+from pennywise.integrity import verify
+from pennywise.closing import close_period
+from . import DatabaseTestCase
+
+CUTOFF = datetime(2013, 3, 1)
+
+
+class TestClosePeriod(DatabaseTestCase):
+    def setUp(self):
+        super(TestClosePeriod, self).setUp()
+        self.userledger = self.make_user()
+        self.otherledger = self.make_user(u'Other')
+        for userledger in (self.userledger, self.otherledger):
+            ledgers = dict([(ledger.title, ledger) for ledger in self.leaves(userledger)])
+            post_transactions([{'commodity': userledger.commodity_id, 'datetime': when,
+                'splits': [(ledgers[debit], -value), (ledgers[credit], value)]}
+                for when, debit, credit, value in [
+                    (datetime(2013, 1, 5), u'Bank', u'Food', Decimal(10)),
+                    (datetime(2013, 1, 20), u'Salary', u'Bank', Decimal(500)),
+                    (datetime(2013, 2, 5), u'Bank', u'Rent', Decimal(200)),
+                    (datetime(2013, 3, 10), u'Cash', u'Food', Decimal(15)),
+                    (datetime(2013, 4, 2), u'Bank', u'Cash', Decimal(50)),
+                    ]])
+        db.session.commit()
+
+    def leaves(self, userledger):
+        return Ledger.query.filter(Ledger.parent_id.in_(
+            db.session.query(Ledger.id).filter(Ledger.parent_id == userledger.id))).all()
+
+    def state(self, userledger):
+        db.session.expire_all()
+        return (dict([(ledger.id, ledger.balance) for ledger in self.leaves(userledger)]),
+            get_balances(userledger), get_balances(userledger, when=datetime(2013, 3, 15)))
+
+    def test_close(self):
+        before = self.state(self.userledger)
+        other = self.state(self.otherledger)
+        self.assertEqual(close_period(self.userledger, CUTOFF), 3)
+        db.session.commit()
+        self.assertEqual(self.state(self.userledger), before)
+        self.assertEqual(verify()[:2], ([], []))
+        self.assertEqual(ArchivedTransaction.query.count(), 3)
+        self.assertEqual(ArchivedTransactionSplit.query.count(), 6)
+        # Opening balances for Bank, Food, Salary and Rent replace the archived transactions
+        self.assertEqual(Transaction.query.filter_by(datetime=CUTOFF, description=u'Opening balance').count(), 4)
+
+        # The other user's transactions are still live
+        self.assertEqual(self.state(self.otherledger), other)
+        self.assertEqual(Transaction.query.filter(Transaction.datetime < CUTOFF).count(), 3)
+        self.assertEqual(Transaction.query.count(), 4 + 2 + 5)
+
+        # Closing again changes nothing
+        self.assertEqual(close_period(self.userledger, CUTOFF), 0)
+        db.session.commit()
+        self.assertEqual(self.state(self.userledger), before)
+        self.assertEqual(Transaction.query.count(), 4 + 2 + 5)
+        self.assertEqual(verify()[:2], ([], []))
+
+    def test_cutoff(self):
+        self.assertRaises(ValueError, close_period, self.userledger, datetime(2013, 3, 2))
@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+
+from pennywise import instrument
+from pennywise.models import db, Commodity, COMMODITY_TYPE
+from . import DatabaseTestCase
+
+
+class TestCommodityCache(DatabaseTestCase):
+    def _statements(self, func):
+        instrument.reset()
+        instrument.enable()
+        try:
+            with instrument.span('test'):
+                result = func()
+        finally:
+            instrument.disable()
+        return result, instrument.get_stats().get('test', {}).get('statements', 0)
+
+    def test_get_or_create(self):
+        db.session.add(Commodity.get_or_create(COMMODITY_TYPE.CURRENCY, u'USD'))
+        db.session.commit()
+        usd = Commodity.get_or_create(COMMODITY_TYPE.CURRENCY, u'USD')
+        usd_id = usd.id
+        db.session.remove()
+
+        # A new session gets the commodity without a query
+        lookup = lambda: Commodity.get_or_create(COMMODITY_TYPE.CURRENCY, u'USD')
+        commodity, statements = self._statements(lambda: (lambda c: (c, c.id, c.title))(lookup()))
+        self.assertEqual(statements, 0)
+        self.assertEqual(commodity[1], usd_id)
+        self.assertEqual(commodity[2], u'USD - United States of America, Dollars')
+
+        # Nor after a commit expires it
+        db.session.commit()
+        commodity, statements = self._statements(lambda: (lambda c: (c, c.id, c.title))(lookup()))
+        self.assertEqual(statements, 0)
+        self.assertTrue(commodity[0] is Commodity.query.get(usd_id))
+
+    def test_get_or_create_many(self):
+        commodities = Commodity.get_or_create_many(COMMODITY_TYPE.CURRENCY, [u'USD', u'EUR'])
+        db.session.add_all(commodities.values())
+        db.session.commit()
+        Commodity.get_or_create_many(COMMODITY_TYPE.CURRENCY, [u'USD', u'EUR'])
+        db.session.remove()
+        commodities, statements = self._statements(lambda: Commodity.get_or_create_many(
+            COMMODITY_TYPE.CURRENCY, [u'USD', u'EUR', u'GBP']))
+        self.assertEqual(statements, 1)
+        self.assertEqual(sorted(commodities.keys()), [u'EUR', u'GBP', u'USD'])
+        self.assertTrue(commodities[u'GBP'].id is None)
+
+    def test_rollback(self):
+        commodity = Commodity.get_or_create(COMMODITY_TYPE.CURRENCY, u'USD')
+        db.session.add(commodity)
+        db.session.flush()
+        self.assertTrue(Commodity.get_or_create(COMMODITY_TYPE.CURRENCY, u'USD') is commodity)
+        db.session.rollback()
+        # The rolled back commodity is forgotten, and created again
+        commodity = Commodity.get_or_create(COMMODITY_TYPE.CURRENCY, u'USD')
+        self.assertTrue(commodity.id is None)
+        db.session.add(commodity)
+        db.session.commit()
+        self.assertEqual(Commodity.query.count(), 1)
+        db.session.remove()
+        commodity, statements = self._statements(
+            lambda: Commodity.get_or_create(COMMODITY_TYPE.CURRENCY, u'USD').id)
+        self.assertEqual((commodity, statements), (Commodity.query.one().id, 0))
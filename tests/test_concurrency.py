@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+
+import random
+import threading
+from decimal import Decimal
+from sqlalchemy import func
+from sqlalchemy.exc import OperationalError
+from pennywise.models import db, Ledger, Transaction, TransactionSplit, LedgerSnapshot
+from pennywise.transactions import post_transactions
+from pennywise.integrity import drifted_balances
+from . import DatabaseTestCase
+
+TITLES = [u'Cash', u'Bank', u'Credit Card', u'Food']
+THREADS = 8
+ROUNDS = 10
+BATCH = 5
+
+
+class TestConcurrentPosting(DatabaseTestCase):
+    """
+    Threads posting to the same ledgers at once, with the ORM and in bulk,
+    must not lose balance updates.
+    """
+    shared = True
+
+    def setUp(self):
+        super(TestConcurrentPosting, self).setUp()
+        userledger = self.make_user()
+        self.commodity_id = userledger.commodity_id
+        self.ledger_ids = sorted([ledger.id for ledger in Ledger.query.filter(Ledger.title.in_(TITLES))])
+        self.expected = dict([(ledger_id, Decimal(0)) for ledger_id in self.ledger_ids])
+        self.lock = threading.Lock()
+        self.errors = []
+
+    def _batch(self, rnd):
+        batch = []
+        for number in range(BATCH):
+            debit, credit = rnd.sample(self.ledger_ids, 2)
+            value = Decimal(rnd.randint(1, 100000)) / 100
+            batch.append({'commodity': self.commodity_id, 'splits': [(debit, -value), (credit, value)]})
+        return batch
+
+    def _post_orm(self, batch):
+        for item in batch:
+            transaction = Transaction(commodity_id=item['commodity'])
+            # Ledgers are updated right away, in id order so that PostgreSQL
+            # doesn't see a deadlock between two posters
+            for ledger_id, value in sorted(item['splits']):
+                ledger = Ledger.query.get(ledger_id)
+                split = TransactionSplit(transaction=transaction, ledger=ledger, value=value, quantity=value)
+                ledger.addSplitValue(split)
+            transaction.validate()
+            db.session.add(transaction)
+
+    def _worker(self, number):
+        rnd = random.Random(number)
+        with self.app.app_context():
+            try:
+                for round in range(ROUNDS):
+                    batch = self._batch(rnd)
+                    while True:
+                        try:
+                            if number % 2:
+                                self._post_orm(batch)
+                            else:
+                                post_transactions(batch, lock=True)
+                            db.session.commit()
+                            break
+                        except OperationalError:
+                            # SQLite has one writer at a time, and gives up
+                            # waiting for it. Other databases must not fail
+                            db.session.rollback()
+                            if db.engine.name != 'sqlite':
+                                raise
+                    with self.lock:
+                        for item in batch:
+                            for ledger_id, value in item['splits']:
+                                self.expected[ledger_id] += value
+            except Exception as e:
+                self.errors.append(e)
+            finally:
+                db.session.remove()
+
+    def test_final_balances(self):
+        threads = [threading.Thread(target=self._worker, args=(number,)) for number in range(THREADS)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.errors, [])
+        db.session.expire_all()
+        balances = dict(db.session.query(Ledger.id, Ledger.balance).filter(Ledger.id.in_(self.ledger_ids)))
+        self.assertEqual(balances, self.expected)
+        self.assertEqual(list(drifted_balances()), [])
+        # Every poster raced to create the same snapshots
+        snapshots = dict(db.session.query(LedgerSnapshot.ledger_id, func.sum(LedgerSnapshot.value)).filter(
+            LedgerSnapshot.ledger_id.in_(self.ledger_ids)).group_by(LedgerSnapshot.ledger_id))
+        self.assertEqual(snapshots, self.expected)
+        self.assertEqual(Transaction.query.count(), THREADS * ROUNDS * BATCH)
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from decimal import Decimal
+from pennywise.models import db, Ledger, TransactionSplit
+from pennywise.transactions import post_transactions
+from pennywise.export import numpy, pyarrow, COLUMNS, iter_split_columns, export_splits
+from . import DatabaseTestCase
+
+
+if numpy is not None:
+    class TestExport(DatabaseTestCase):
+        def setUp(self):
+            super(TestExport, self).setUp()
+            self.userledger = self.make_user()
+            self.otherledger = self.make_user(u'Other')
+            self.post(self.userledger, [
+                (datetime(2013, 1, 5), u'Bank', u'Food', Decimal('10.5'), False),
+                (datetime(2013, 1, 20), u'Salary', u'Bank', Decimal(500), False),
+                (datetime(2013, 2, 5), u'Bank', u'Rent', Decimal(200), True),
+                (datetime(2013, 3, 10), u'Cash', u'Food', Decimal(15), False),
+                ])
+            self.post(self.otherledger, [(datetime(2013, 1, 7), u'Bank', u'Food', Decimal(99), False)])
+            db.session.commit()
+
+        def ledgers(self, userledger):
+            return dict([(ledger.title, ledger) for ledger in Ledger.query.filter(Ledger.parent_id.in_(
+                db.session.query(Ledger.id).filter(Ledger.parent_id == userledger.id)))])
+
+        def post(self, userledger, rows):
+            ledgers = self.ledgers(userledger)
+            post_transactions([{'commodity': userledger.commodity_id, 'datetime': when, 'disabled': disabled,
+                'splits': [(ledgers[debit], -value), (ledgers[credit], value)]}
+                for when, debit, credit, value, disabled in rows])
+
+        def test_columns(self):
+            columns = export_splits(self.userledger)
+            self.assertEqual(sorted(columns.keys()), sorted([name for name, dtype in COLUMNS]))
+            splits = TransactionSplit.query.filter(TransactionSplit.ledger_id.in_(
+                [ledger.id for ledger in self.ledgers(self.userledger).values()])).all()
+            splits.sort(key=lambda split: (split.transaction.datetime, split.id))
+            self.assertEqual(list(columns['split_id']), [split.id for split in splits])
+            self.assertEqual(list(columns['value']), [float(split.value) for split in splits])
+            self.assertEqual(list(columns['disabled']), [split.transaction.disabled for split in splits])
+            self.assertEqual(list(columns['ledger_type']), [split.ledger.ledger_type for split in splits])
+            self.assertEqual(list(columns['datetime'].astype(datetime)),
+                [split.transaction.datetime for split in splits])
+            # Batches add up to the whole, and dates limit the rows
+            batches = list(iter_split_columns(self.userledger, batchsize=3))
+            self.assertEqual([len(batch['split_id']) for batch in batches], [3, 3, 2])
+            self.assertEqual(len(export_splits(self.userledger, start=datetime(2013, 2, 1),
+                end=datetime(2013, 3, 1))['split_id']), 2)
+            self.assertEqual(len(export_splits(self.userledger, start=datetime(2014, 1, 1))['split_id']), 0)
+
+        def test_round_trip(self):
+            # Post the exported splits to a new user and export them again
+            columns = export_splits(self.userledger)
+            ids = dict([(ledger.id, title) for title, ledger in self.ledgers(self.userledger).items()])
+            copyledger = self.make_user(u'Copy')
+            ledgers = self.ledgers(copyledger)
+            transactions = {}
+            for position in range(len(columns['split_id'])):
+                item = transactions.setdefault(int(columns['transaction_id'][position]), {
+                    'commodity': int(columns['commodity_id'][position]),
+                    'datetime': columns['datetime'][position].astype(datetime),
+                    'disabled': bool(columns['disabled'][position]),
+                    'splits': []})
+                item['splits'].append((ledgers[ids[int(columns['ledger_id'][position])]],
+                    Decimal(str(columns['value'][position]))))
+            post_transactions([transactions[key] for key in sorted(transactions)])
+            db.session.commit()
+            copy = export_splits(copyledger)
+            for name in ('datetime', 'ledger_type', 'ledger_subtype', 'commodity_id', 'value', 'disabled'):
+                self.assertEqual(list(copy[name]), list(columns[name]))
+            self.assertEqual([ids[ledger_id] for ledger_id in columns['ledger_id']],
+                [dict([(ledger.id, title) for title, ledger in ledgers.items()])[ledger_id]
+                    for ledger_id in copy['ledger_id']])
+
+        if pyarrow is not None:
+            def test_arrow(self):
+                table = export_splits(self.userledger, arrow=True)
+                self.assertEqual(table.num_rows, 8)
+                self.assertEqual(table.column_names, [name for name, dtype in COLUMNS])
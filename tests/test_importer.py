@@ -0,0 +1,62 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+from pennywise.models import db, Ledger
+from pennywise.importer import statement_transactions, import_statement, Deduplicator
+from . import DatabaseTestCase
+
+
+def line(when, amount, description, num=u''):
+    return {'datetime': when, 'amount': Decimal(amount), 'description': description, 'num': num}
+
+
+class TestImporter(DatabaseTestCase):
+    def setUp(self):
+        super(TestImporter, self).setUp()
+        self.make_user()
+        self.bank = Ledger.query.filter_by(title=u'Bank').one()
+        self.food = Ledger.query.filter_by(title=u'Food').one()
+
+    def test_similar_lines(self):
+        # Lines that only differ in case and spacing have the same identity
+        when = datetime(2013, 1, 5)
+        lines = [line(when, '-10', u'Coffee  shop'), line(when, '-10', u'coffee shop'),
+            line(when, '-10', u'Other', u'A1'), line(when, '-10', u'Renamed', u'A1')]
+        fingerprints = [item['fingerprint'] for item in statement_transactions(lines, self.bank, self.food)]
+        self.assertEqual(len(set(fingerprints)), 4)
+
+    def test_reimport(self):
+        start = datetime(2013, 1, 1)
+        lines = [line(start + timedelta(days=number // 3), '-5', u'Coffee') for number in range(300)]
+        self.assertEqual(import_statement(lines, self.bank, self.food), 300)
+        db.session.commit()
+        self.assertEqual(import_statement(lines, self.bank, self.food), 0)
+        db.session.expire_all()
+        self.assertEqual(self.bank.balance, Decimal(-1500))
+
+    def test_unsorted(self):
+        # Identical lines far apart in an unsorted statement are all kept
+        start = datetime(2013, 1, 1)
+        lines = [line(start + timedelta(days=day), '-5', u'Coffee') for day in range(60)] * 3
+        self.assertEqual(import_statement(lines, self.bank, self.food, chunksize=25), 180)
+        db.session.commit()
+        self.assertEqual(import_statement(lines, self.bank, self.food, chunksize=25), 0)
+        db.session.expire_all()
+        self.assertEqual(self.bank.balance, Decimal(-900))
+
+    def test_date_range(self):
+        # Only fingerprints for the dates being imported are loaded
+        import_statement([line(datetime(2013, 1, day), '-5', u'Coffee') for day in range(1, 11)],
+            self.bank, self.food)
+        db.session.commit()
+        deduplicator = Deduplicator(self.bank)
+        loaded = []
+        add = deduplicator.bloom.add
+        deduplicator.bloom.add = lambda key: (loaded.append(key), add(key))
+        lines = [line(datetime(2013, 1, 8, 10), '-5', u'Coffee'), line(datetime(2013, 1, 12), '-5', u'Coffee'),
+            line(datetime(2013, 1, 9, 23), '-5', u'Coffee')]
+        transactions = deduplicator.filter(list(statement_transactions(lines, self.bank, self.food)))
+        self.assertEqual([item['datetime'] for item in transactions], [datetime(2013, 1, 12)])
+        # Three existing fingerprints for the 8th to the 12th, and the new one
+        self.assertEqual(len(loaded), 4)
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from sqlalchemy import create_engine
+from sqlalchemy.exc import IntegrityError
+from pennywise import instrument
+from pennywise.models import Commodity
+from pennywise.standalone import create_session, create_tables
+
+
+class TestSpans(unittest.TestCase):
+    def setUp(self):
+        self.engine = create_engine('sqlite://')
+        instrument.reset()
+        instrument.enable()
+
+    def tearDown(self):
+        instrument.disable()
+        instrument.reset()
+        self.engine.dispose()
+
+    def test_interleaved(self):
+        # Two coroutines on one thread, suspended inside their spans,
+        # finishing in the order they started
+        first = instrument.span('first')
+        second = instrument.span('second')
+        first.__enter__()
+        second.__enter__()
+        first.__exit__(None, None, None)
+        self.engine.execute('select 1')
+        second.__exit__(None, None, None)
+        self.engine.execute('select 1')
+        self.assertEqual(instrument._stack(), ())
+        stats = instrument.get_stats()
+        self.assertEqual(stats['first']['calls'], 1)
+        self.assertEqual(stats['first']['statements'], 0)
+        self.assertEqual(stats['second']['statements'], 1)
+
+    def test_failed_flush(self):
+        session = create_session('sqlite://')
+        create_tables(session.bind)
+        try:
+            session.add_all([Commodity(symbol=u'INR'), Commodity(symbol=u'INR')])
+            self.assertRaises(IntegrityError, session.flush)
+            session.rollback()
+            self.assertEqual(instrument._stack(), ())
+            instrument.reset()
+            session.query(Commodity).all()
+            self.assertEqual(instrument.get_stats().get('flush'), None)
+        finally:
+            session.close()
+            session.bind.dispose()
@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from decimal import Decimal
+from pennywise.models import db, Ledger, Transaction
+from pennywise.integrity import verify
+from pennywise.transactions import post_transactions
+from . import DatabaseTestCase
+
+
+class TestVerify(DatabaseTestCase):
+    def setUp(self):
+        super(TestVerify, self).setUp()
+        self.userledger = self.make_user()
+        self.bank = Ledger.query.filter_by(title=u'Bank').one()
+        self.food = Ledger.query.filter_by(title=u'Food').one()
+        self.cash = Ledger.query.filter_by(title=u'Cash').one()
+        post_transactions([{'commodity': self.userledger.commodity_id,
+            'splits': [(self.bank, -10), (self.food, 10)]}])
+        db.session.commit()
+
+    def test_clean(self):
+        unbalanced, drifted, watermark = verify()
+        self.assertEqual((unbalanced, drifted), ([], []))
+        self.assertTrue(watermark > 0)
+
+    def test_transaction_without_splits(self):
+        transaction = Transaction(commodity_id=self.userledger.commodity_id)
+        db.session.add(transaction)
+        db.session.commit()
+        unbalanced, drifted, watermark = verify()
+        self.assertEqual(unbalanced, [(transaction.id, Decimal(0), 0)])
+
+    def test_incremental(self):
+        watermark = verify()[2]
+        # Drift in a ledger that hasn't been touched since is left to full checks
+        db.session.execute(Ledger.__table__.update().where(Ledger.__table__.c.id == self.food.id).values(
+            balance=Ledger.__table__.c.balance + 1))
+        post_transactions([{'commodity': self.userledger.commodity_id,
+            'splits': [(self.bank, -5), (self.cash, 5)], 'datetime': datetime(2013, 1, 1)}])
+        db.session.execute(Ledger.__table__.update().where(Ledger.__table__.c.id == self.cash.id).values(
+            balance=Ledger.__table__.c.balance + 2))
+        db.session.commit()
+        unbalanced, drifted, watermark = verify(since=watermark)
+        self.assertEqual(drifted, [(self.cash.id, Decimal(7), Decimal(5))])
+        unbalanced, drifted, watermark = verify(repair=True)
+        self.assertEqual(sorted([ledger_id for ledger_id, balance, actual in drifted]),
+            sorted([self.cash.id, self.food.id]))
+        self.assertEqual(verify()[:2], ([], []))
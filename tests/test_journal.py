@@ -0,0 +1,128 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime, timedelta
+from decimal import Decimal
+from sqlalchemy import func
+from pennywise.models import db, Ledger, LedgerSnapshot, Transaction, TransactionSplit, JOURNAL_EVENT
+from pennywise.transactions import post_transactions, balance_listeners
+from pennywise.integrity import drifted_balances, verify
+from pennywise import journal
+from . import DatabaseTestCase
+
+
+class JournalTestCase(DatabaseTestCase):
+    def setUp(self):
+        super(JournalTestCase, self).setUp()
+        self.userledger = self.make_user()
+        self.commodity_id = self.userledger.commodity_id
+        self.bank = Ledger.query.filter_by(title=u'Bank').one()
+        self.food = Ledger.query.filter_by(title=u'Food').one()
+        self.rent = Ledger.query.filter_by(title=u'Rent').one()
+
+    def post(self, debit, credit, value, **kwargs):
+        return post_transactions([{'commodity': self.commodity_id, 'splits': [(debit, -value), (credit, value)],
+            'datetime': datetime(2013, 1, 5)}], **kwargs)
+
+    def balances(self):
+        db.session.expire_all()
+        return dict(db.session.query(Ledger.id, Ledger.balance).filter(Ledger.balance != 0))
+
+    def totals(self):
+        return dict(db.session.query(TransactionSplit.ledger_id, func.sum(TransactionSplit.value)).group_by(
+            TransactionSplit.ledger_id))
+
+
+class TestRebuild(JournalTestCase):
+    shared = True
+
+    def setUp(self):
+        super(TestRebuild, self).setUp()
+        # Postings through every path: in bulk, with the ORM, and deferred
+        self.post(self.bank, self.food, Decimal(10))
+        transaction = Transaction(commodity_id=self.commodity_id, datetime=datetime(2013, 2, 5))
+        for ledger, value in ((self.bank, Decimal(-20)), (self.rent, Decimal(20))):
+            split = TransactionSplit(transaction=transaction, ledger=ledger, value=value, quantity=value)
+            ledger.addSplitValue(split)
+        db.session.add(transaction)
+        self.post(self.bank, self.rent, Decimal(40), deferred=True)
+        db.session.commit()
+        self.expected = {self.bank.id: Decimal(-70), self.food.id: Decimal(10), self.rent.id: Decimal(60)}
+        self.changed = []
+        balance_listeners.append(self.changed.extend)
+
+    def tearDown(self):
+        balance_listeners.remove(self.changed.extend)
+        super(TestRebuild, self).tearDown()
+
+    def check(self, workers):
+        table = Ledger.__table__
+        db.session.execute(table.update().where(table.c.id == self.food.id).values(balance=table.c.balance + 7))
+        db.session.execute(LedgerSnapshot.__table__.delete().where(LedgerSnapshot.ledger_id == self.rent.id))
+        db.session.commit()
+        self.assertEqual(journal.rebuild(workers=workers), 2)
+        db.session.commit()
+        # Only corrected ledgers are written
+        self.assertEqual(sorted(self.changed), [self.food.id])
+        self.assertEqual(list(drifted_balances()), [])
+        journal.materialize()
+        db.session.commit()
+        self.assertEqual(self.balances(), self.expected)
+        self.assertEqual(self.totals(), self.expected)
+        snapshots = dict(db.session.query(LedgerSnapshot.ledger_id, func.sum(LedgerSnapshot.value)).filter(
+            LedgerSnapshot.value != 0).group_by(LedgerSnapshot.ledger_id))
+        self.assertEqual(snapshots, self.expected)
+
+    def test_session(self):
+        self.check(1)
+
+    def test_threads(self):
+        self.check(4)
+
+
+class TestGaps(JournalTestCase):
+    def entry(self, entry_id, value, created=None):
+        journal.append([{'id': entry_id, 'event': JOURNAL_EVENT.CREATE, 'transaction_id': 0,
+            'ledger_id': self.bank.id, 'datetime': datetime(2013, 1, 5), 'value': value,
+            'created': created or datetime.utcnow()}])
+
+    def test_gap(self):
+        self.entry(1, Decimal(1))
+        self.entry(3, Decimal(2))
+        self.assertEqual(journal.materialize(), 1)
+        # However old, a missing id is only skipped when asked to
+        self.assertEqual(journal.materialize(), 1)
+        first, last, created = journal.gap()
+        self.assertEqual((first, last), (2, 2))
+        self.assertRaises(ValueError, journal.skip_gap, 3)
+        self.assertEqual(journal.skip_gap(last), 2)
+        self.assertEqual(journal.gap(), None)
+        self.assertEqual(journal.materialize(), 3)
+        db.session.expire_all()
+        self.assertEqual(self.bank.balance, Decimal(3))
+
+    def test_max_posting_age(self):
+        now = datetime.utcnow()
+        self.entry(1, Decimal(1), now - timedelta(seconds=600))
+        self.entry(3, Decimal(2), now - timedelta(seconds=300))
+        self.entry(5, Decimal(4), now)
+        # The entry after the first gap is older than any posting, the next isn't yet
+        self.assertEqual(journal.materialize(max_posting_age=60), 3)
+        self.assertEqual(journal.gap()[:2], (4, 4))
+        self.assertEqual(journal.materialize(max_posting_age=600), 3)
+        self.assertEqual(journal.materialize(max_posting_age=0), 5)
+        db.session.expire_all()
+        self.assertEqual(self.bank.balance, Decimal(7))
+
+
+class TestPendingDrift(JournalTestCase):
+    def test_pending(self):
+        self.post(self.bank, self.food, Decimal(10))
+        self.post(self.bank, self.food, Decimal(5), deferred=True)
+        db.session.commit()
+        # Not yet materialized, which isn't drift and mustn't be repaired
+        self.assertEqual(list(drifted_balances()), [])
+        self.assertEqual(verify(repair=True)[1], [])
+        journal.materialize()
+        db.session.commit()
+        self.assertEqual(self.balances(), {self.bank.id: Decimal(-15), self.food.id: Decimal(15)})
+        self.assertEqual(verify()[1], [])
@@ -0,0 +1,157 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from decimal import Decimal
+from pennywise.models import db, Ledger, LEDGER_TYPE, Commodity, COMMODITY_TYPE
+from pennywise.ledgers import get_ledgers, get_balances, balance_at, get_register, iter_register, rebuild_snapshots
+from pennywise.prices import PriceIndex
+from pennywise.transactions import post_transactions
+from . import DatabaseTestCase
+
+
+class TestBalancesAsOf(DatabaseTestCase):
+    def setUp(self):
+        super(TestBalancesAsOf, self).setUp()
+        self.userledger = self.make_user()
+        self.bank = Ledger.query.filter_by(title=u'Bank').one()
+        self.food = Ledger.query.filter_by(title=u'Food').one()
+        self.rent = Ledger.query.filter_by(title=u'Rent').one()
+        commodity = self.userledger.commodity_id
+        post_transactions([
+            {'commodity': commodity, 'splits': [(self.bank, -10), (self.food, 10)], 'datetime': datetime(2013, 1, 5)},
+            {'commodity': commodity, 'splits': [(self.bank, -20), (self.rent, 20)], 'datetime': datetime(2013, 2, 5)},
+            {'commodity': commodity, 'splits': [(self.bank, -40), (self.food, 40)], 'datetime': datetime(2013, 2, 20)},
+            {'commodity': commodity, 'splits': [(self.bank, -80), (self.rent, 80)], 'datetime': datetime(2013, 4, 1)},
+            ])
+        db.session.commit()
+
+    def test_when(self):
+        when = datetime(2013, 2, 10)
+        balances = get_balances(self.userledger, when=when)
+        for ledger in (self.bank, self.food, self.rent):
+            self.assertEqual(balances[ledger.id], balance_at(ledger, when))
+        self.assertEqual(balances[self.bank.id], Decimal(-30))
+        self.assertEqual(balances[self.food.parent_id], Decimal(30))
+        self.assertEqual(balances[self.userledger.id], Decimal(0))
+        self.assertEqual(get_balances(self.userledger)[self.bank.id], Decimal(-150))
+
+    def test_valuation(self):
+        usd = Commodity.get_or_create(COMMODITY_TYPE.CURRENCY, u'USD')
+        db.session.add(usd)
+        db.session.flush()
+        index = PriceIndex()
+        index.add(self.userledger.commodity_id, usd.id, datetime(2013, 1, 1), Decimal('0.5'))
+        index.add(self.userledger.commodity_id, usd.id, datetime(2013, 3, 1), Decimal('0.25'))
+        when = datetime(2013, 2, 10)
+        balances = get_balances(self.userledger, index.valuation(usd.id, when), when=when)
+        self.assertEqual(balances[self.bank.id], Decimal(-15))
+
+
+def walk(base, level=0):
+    """
+    The recursive walk get_ledgers used to make, for comparison. Returns
+    (rows, hidden) with rows of (ledger id, level, hidden)
+    """
+    hidden = base.hidden
+    result = [[base.id, level, hidden]]
+    allsubhidden = True
+    for ledger in sorted(base.subledgers, key=lambda ledger: ledger.id):
+        subledgers, subhidden = walk(ledger, level + 1)
+        result.extend(subledgers)
+        # If current ledger is hidden, hide all subledgers (unless they are already hidden)
+        if hidden and not subhidden:
+            for row in result[1:]:
+                row[2] = True
+            subhidden = True
+        if not subhidden:
+            allsubhidden = False
+    # If this is a placeholder and everything below is hidden, hide this too
+    if base.placeholder and allsubhidden:
+        hidden = True
+        result[0][2] = True
+    return result, hidden
+
+
+class TestGetLedgers(DatabaseTestCase):
+    def test_hidden(self):
+        userledger = self.make_user()
+        # Every combination of hidden and placeholder, three levels deep below each default ledger
+        for parent in Ledger.query.filter(Ledger.parent_id != None).all():
+            for hidden, placeholder in [(False, False), (True, False), (False, True), (True, True)]:
+                child = Ledger(parent=parent, title=u'Child', hidden=hidden, placeholder=placeholder,
+                    ledger_type=parent.ledger_type, commodity=userledger.commodity)
+                grandchild = Ledger(parent=child, title=u'Grandchild', hidden=placeholder,
+                    placeholder=hidden, ledger_type=parent.ledger_type, commodity=userledger.commodity)
+                Ledger(parent=grandchild, title=u'Leaf', hidden=hidden and placeholder,
+                    ledger_type=parent.ledger_type, commodity=userledger.commodity)
+        db.session.commit()
+        db.session.expire_all()
+        rows = [[row['ledger'].id, row['level'], row['hidden']] for row in get_ledgers(userledger)]
+        self.assertEqual(len(rows), 1 + 16 + 16 * 4 * 3)
+        self.assertEqual(rows, walk(userledger)[0])
+        self.assertEqual(set([row[2] for row in rows]), set([True, False]))
+
+
+class TestRegister(DatabaseTestCase):
+    def setUp(self):
+        super(TestRegister, self).setUp()
+        self.userledger = self.make_user()
+        self.bank = Ledger.query.filter_by(title=u'Bank').one()
+        self.food = Ledger.query.filter_by(title=u'Food').one()
+        # Runs of identical datetimes across several snapshot periods, out of order,
+        # with some disabled transactions
+        times = [datetime(2013, month, 15) for month in (3, 1, 2)] * 4 + [datetime(2013, 2, 1)] * 3
+        post_transactions([{'commodity': self.userledger.commodity_id, 'datetime': when,
+            'disabled': number % 5 == 4, 'splits': [(self.bank, -number), (self.food, number)]}
+            for number, when in enumerate(times, 1)])
+        db.session.commit()
+
+    def rows(self, register):
+        return [(row['key'], row['balance']) for row in register]
+
+    def test_order(self):
+        register = get_register(self.bank, limit=100)
+        self.assertEqual(len(register), 15)
+        keys = [row['key'] for row in register]
+        self.assertEqual(keys, sorted(keys))
+        balance = Decimal(0)
+        for row in register:
+            if not row['transaction'].disabled:
+                balance += row['split'].value
+            self.assertEqual(row['balance'], balance)
+        db.session.expire_all()
+        self.assertEqual(balance, self.bank.balance)
+
+    def test_pages(self):
+        # Every page size, so that page boundaries fall inside each run of identical datetimes
+        full = self.rows(get_register(self.bank, limit=100))
+        for pagesize in range(1, 16):
+            pages = []
+            after = None
+            while True:
+                page = get_register(self.bank, after, pagesize)
+                pages.extend(self.rows(page))
+                if len(page) < pagesize:
+                    break
+                after = page[-1]['key']
+            self.assertEqual(pages, full)
+            self.assertEqual(self.rows(iter_register(self.bank, pagesize=pagesize)), full)
+
+    def test_session(self):
+        full = self.rows(get_register(self.bank, limit=100))
+        session = db.create_scoped_session()
+        try:
+            rebuild_snapshots(session=session)
+            session.commit()
+            bank = session.query(Ledger).get(self.bank.id)
+            self.assertEqual(self.rows(iter_register(bank, pagesize=4, session=session)), full)
+        finally:
+            session.remove()
+
+
+class TestDefaultLedgers(DatabaseTestCase):
+    def test_types(self):
+        userledger = self.make_user()
+        for group in Ledger.query.filter_by(parent=userledger):
+            for ledger in Ledger.query.filter_by(parent=group):
+                self.assertEqual((ledger.title, ledger.ledger_type), (ledger.title, group.ledger_type))
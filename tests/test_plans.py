@@ -0,0 +1,11 @@
+# -*- coding: utf-8 -*-
+
+from benchmarks.generators import make_dataset
+from benchmarks.plans import check_plans
+from . import DatabaseTestCase
+
+
+class TestPlans(DatabaseTestCase):
+    def test_no_full_scans(self):
+        dataset = make_dataset(users=2, ledgers=10, transactions=200, deep=10)
+        self.assertEqual([(name, statement) for name, statement, plan in check_plans(dataset)], [])
@@ -0,0 +1,60 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from decimal import Decimal
+from pennywise.models import db, Ledger, TransactionSplit
+from pennywise.transactions import post_transactions
+from pennywise.reconcile import match_statement, reconcile
+from . import DatabaseTestCase
+
+
+def line(when, amount):
+    return {'datetime': when, 'amount': Decimal(amount)}
+
+
+class TestReconcile(DatabaseTestCase):
+    def setUp(self):
+        super(TestReconcile, self).setUp()
+        self.userledger = self.make_user()
+        self.bank = Ledger.query.filter_by(title=u'Bank').one()
+        self.food = Ledger.query.filter_by(title=u'Food').one()
+        post_transactions([{'commodity': self.userledger.commodity_id, 'datetime': when, 'disabled': disabled,
+            'splits': [(self.bank, -value), (self.food, value)]} for when, value, disabled in [
+                (datetime(2013, 1, 5), Decimal(10), False),
+                (datetime(2013, 1, 9), Decimal(10), False),
+                (datetime(2013, 1, 20), Decimal(25), False),
+                (datetime(2013, 2, 1), Decimal(40), True),
+                ]])
+        db.session.commit()
+        self.splits = dict([((split.transaction.datetime, split.value), split.id)
+            for split in TransactionSplit.query.filter_by(ledger=self.bank)])
+
+    def test_match(self):
+        statement = [
+            line(datetime(2013, 1, 8), '-10'),   # Closest of the two -10 splits
+            line(datetime(2013, 1, 6), '-10'),   # The other one
+            line(datetime(2013, 1, 7), '-10'),   # None left
+            line(datetime(2013, 1, 25), '-25'),  # Too far apart
+            line(datetime(2013, 2, 1), '-40'),   # Disabled
+            line(datetime(2013, 1, 20), '-26'),  # Different amount
+            ]
+        matches, unmatched = match_statement(self.bank, statement)
+        self.assertEqual([(item['datetime'], split_id) for item, split_id in matches], [
+            (datetime(2013, 1, 8), self.splits[(datetime(2013, 1, 9), Decimal(-10))]),
+            (datetime(2013, 1, 6), self.splits[(datetime(2013, 1, 5), Decimal(-10))]),
+            ])
+        self.assertEqual(unmatched, statement[2:])
+
+    def test_reconcile(self):
+        when = datetime(2013, 3, 1)
+        statement = [line(datetime(2013, 1, 21), '-25'), line(datetime(2013, 1, 5), '-11')]
+        matches, unmatched = reconcile(self.bank, statement, when=when)
+        self.assertEqual(len(matches), 1)
+        self.assertEqual(unmatched, statement[1:])
+        db.session.commit()
+        db.session.expire_all()
+        reconciled = TransactionSplit.query.filter_by(reconciled=True).all()
+        self.assertEqual([(split.id, split.reconciled_date) for split in reconciled],
+            [(self.splits[(datetime(2013, 1, 20), Decimal(-25))], when)])
+        # Reconciled splits aren't matched again
+        self.assertEqual(reconcile(self.bank, statement), ([], statement))
@@ -0,0 +1,46 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from decimal import Decimal
+from pennywise.models import db, Ledger, RecurringTransaction, RecurringSplit, RECURRENCE
+from pennywise.recurring import materialize
+from . import DatabaseTestCase
+
+
+class TestMalformedTemplates(DatabaseTestCase):
+    def setUp(self):
+        super(TestMalformedTemplates, self).setUp()
+        self.userledger = self.make_user()
+        self.bank = Ledger.query.filter_by(title=u'Bank').one()
+        self.rent = Ledger.query.filter_by(title=u'Rent').one()
+
+    def template(self, values, **kwargs):
+        template = RecurringTransaction(start=datetime(2020, 1, 1), commodity_id=self.userledger.commodity_id,
+            **kwargs)
+        for ledger, value in zip([self.rent, self.bank], values):
+            template.splits.append(RecurringSplit(ledger=ledger, value=value, quantity=value))
+        db.session.add(template)
+        return template
+
+    def test_skipped(self):
+        good = self.template([Decimal(100), Decimal(-100)])
+        unbalanced = self.template([Decimal(100), Decimal(-90)])
+        onesided = self.template([Decimal(100)])
+        unknown = self.template([Decimal(1), Decimal(-1)], frequency=99)
+        db.session.commit()
+        skipped = []
+        self.assertEqual(materialize(until=datetime(2020, 3, 15), skipped=skipped), 3)
+        db.session.commit()
+        self.assertEqual(sorted([template_id for template_id, error in skipped]),
+            sorted([unbalanced.id, onesided.id, unknown.id]))
+        self.assertEqual((good.posted, good.next_date), (3, datetime(2020, 4, 1)))
+        self.assertEqual([template.posted for template in (unbalanced, onesided, unknown)], [0, 0, 0])
+        self.assertEqual(self.rent.balance, Decimal(300))
+
+        # Fixed templates catch up on the next run
+        unbalanced.splits[1].value = unbalanced.splits[1].quantity = Decimal(-100)
+        unknown.frequency = RECURRENCE.MONTHLY
+        db.session.commit()
+        skipped = []
+        self.assertEqual(materialize(until=datetime(2020, 3, 15), skipped=skipped), 6)
+        self.assertEqual([template_id for template_id, error in skipped], [onesided.id])
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from decimal import Decimal
+from pennywise.models import db, Ledger, LEDGER_TYPE
+from pennywise.ledgers import get_ledgers
+from pennywise.transactions import post_transactions
+from pennywise.reports import numpy, month_boundaries, balance_sheet, income_statement
+from . import DatabaseTestCase
+
+
+if numpy is not None:
+    class TestReports(DatabaseTestCase):
+        def setUp(self):
+            super(TestReports, self).setUp()
+            self.userledger = self.make_user()
+            ledgers = dict([(ledger.title, ledger) for ledger in Ledger.query.all()])
+            # A third level, created last so that level order and tree order differ
+            groceries = Ledger(parent=ledgers[u'Food'], title=u'Groceries', ledger_type=LEDGER_TYPE.EXPENSE,
+                commodity=self.userledger.commodity)
+            db.session.add(groceries)
+            db.session.flush()
+            ledgers[u'Groceries'] = groceries
+            post_transactions([{'commodity': self.userledger.commodity_id, 'datetime': when,
+                'splits': [(ledgers[debit], -value), (ledgers[credit], value)]}
+                for when, debit, credit, value in [
+                    (datetime(2013, 1, 5), u'Bank', u'Food', Decimal(10)),
+                    (datetime(2013, 1, 20), u'Salary', u'Bank', Decimal(500)),
+                    (datetime(2013, 2, 5), u'Bank', u'Rent', Decimal(200)),
+                    (datetime(2013, 2, 10), u'Cash', u'Groceries', Decimal(15)),
+                    ]])
+            db.session.commit()
+            self.boundaries = month_boundaries(datetime(2013, 1, 1), 2)
+
+        def tree_order(self, types):
+            return [row['ledger'].id for row in get_ledgers(self.userledger)
+                if row['ledger'].ledger_type in types]
+
+        def test_order(self):
+            report = income_statement(self.userledger, self.boundaries)
+            self.assertEqual([row['ledger_id'] for row in report],
+                self.tree_order([LEDGER_TYPE.INCOME, LEDGER_TYPE.EXPENSE]))
+            report = balance_sheet(self.userledger, self.boundaries)
+            self.assertEqual([row['ledger_id'] for row in report],
+                self.tree_order([LEDGER_TYPE.ASSET, LEDGER_TYPE.LIABILITY, LEDGER_TYPE.EQUITY]))
+            levels = [row['level'] for row in income_statement(self.userledger, self.boundaries)]
+            self.assertEqual(max(levels), 3)
+
+        def test_totals(self):
+            rows = dict([(row['title'], list(row['values']))
+                for row in income_statement(self.userledger, self.boundaries)])
+            self.assertEqual(rows[u'Groceries'], [0, 15])
+            self.assertEqual(rows[u'Food'], [10, 15])
+            self.assertEqual(rows[u'Expenses'], [10, 215])
+            self.assertEqual(rows[u'Salary'], [500, 0])
+            self.assertEqual(rows[u'Income'], [500, 0])
+            rows = dict([(row['title'], list(row['values']))
+                for row in balance_sheet(self.userledger, self.boundaries)])
+            self.assertEqual(rows[u'Bank'], [490, 290])
+            self.assertEqual(rows[u'Cash'], [0, -15])
+            self.assertEqual(rows[u'Assets'], [490, 275])
@@ -0,0 +1,45 @@
+# -*- coding: utf-8 -*-
+
+from sqlalchemy import MetaData
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.schema import UniqueConstraint
+from pennywise.models import db, Ledger, LEDGER_TYPE
+from pennywise.schema import upgrade
+from . import DatabaseTestCase
+
+
+class TestUpgrade(DatabaseTestCase):
+    def setUp(self):
+        super(TestUpgrade, self).setUp()
+        # The schema before transaction buids and commodity symbols were unique
+        db.drop_all()
+        metadata = MetaData()
+        for table in db.metadata.sorted_tables:
+            table.tometadata(metadata)
+        for name in ('transaction', 'commodity'):
+            table = metadata.tables[name]
+            table.constraints = set([constraint for constraint in table.constraints
+                if not isinstance(constraint, UniqueConstraint)])
+        metadata.create_all(db.engine)
+
+    def test_unique(self):
+        created = upgrade(db.engine)
+        self.assertTrue('uq_transaction_buid' in created)
+        self.assertTrue('uq_commodity_type_symbol' in created)
+        self.assertEqual(upgrade(db.engine), [])
+        commodity = db.metadata.tables['commodity']
+        db.engine.execute(commodity.insert().values(type=0, symbol=u'INR', title=u'Rupee'))
+        self.assertRaises(IntegrityError, db.engine.execute,
+            commodity.insert().values(type=0, symbol=u'INR', title=u'Rupee'))
+
+    def test_opening_balances(self):
+        # make_default_ledgers used to create Opening Balances as an expense ledger
+        upgrade(db.engine)
+        self.make_user()
+        opening = Ledger.query.filter_by(title=u'Opening Balances').one()
+        opening.ledger_type = LEDGER_TYPE.EXPENSE
+        db.session.commit()
+        self.assertEqual(upgrade(db.engine), ['ledger.opening_balances'])
+        db.session.expire_all()
+        self.assertEqual(opening.ledger_type, LEDGER_TYPE.EQUITY)
+        self.assertEqual(upgrade(db.engine), [])
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from decimal import Decimal
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+from pennywise.models import Commodity, Ledger, LEDGER_TYPE
+from pennywise.ledgers import make_default_ledgers
+from pennywise.cache import LedgerCache, DictBackend
+from pennywise.shards import ShardRouter
+from pennywise.transactions import post_transactions, balance_listeners
+
+
+class TestShardedCache(unittest.TestCase):
+    def setUp(self):
+        # Tenants are named after their shard
+        self.router = ShardRouter({'a': 'sqlite://', 'b': 'sqlite://'}, locate=lambda key: key)
+        self.router.create_tables()
+        self.cache = LedgerCache(shared=DictBackend(), shard=self.router.shard_of)
+        self.cache.listen(Session)
+        # The same user tree in each shard, with the same ledger ids
+        for name in self.router.names:
+            with self.router.tenant(name) as session:
+                commodity = Commodity.get_or_create(0, u'INR')
+                userledger = Ledger(title=name, ledger_type=LEDGER_TYPE.USER, commodity=commodity)
+                session.add(userledger)
+                make_default_ledgers(userledger)
+
+    def tearDown(self):
+        event.remove(Session, 'after_flush', self.cache._after_flush)
+        event.remove(Session, 'after_commit', self.cache._after_commit)
+        event.remove(Session, 'after_soft_rollback', self.cache._after_commit)
+        balance_listeners.remove(self.cache._bulk_update)
+        for engine in self.router.engines.values():
+            engine.dispose()
+
+    def balances(self, name):
+        with self.router.tenant(name) as session:
+            userledger = session.query(Ledger).filter_by(parent=None).one()
+            bank = session.query(Ledger).filter_by(title=u'Bank').one()
+            return userledger.id, self.cache.get_balances(userledger)[bank.id]
+
+    def test_keys(self):
+        self.assertEqual(self.router.shard_of(self.router.session(shard='b')), 'b')
+        self.assertEqual(self.balances('a'), self.balances('b'))
+        with self.router.tenant('a') as session:
+            bank = session.query(Ledger).filter_by(title=u'Bank').one()
+            food = session.query(Ledger).filter_by(title=u'Food').one()
+            post_transactions([{'commodity': bank.commodity_id, 'splits': [(bank.id, -10), (food.id, 10)]}])
+        self.assertEqual(self.balances('a')[1], Decimal(-10))
+        self.assertEqual(self.balances('b')[1], Decimal(0))
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from decimal import Decimal
+from pennywise.models import db, Ledger, Transaction
+from pennywise.ledgers import get_balances
+from pennywise.transactions import post_transactions
+from pennywise.simulate import numpy, Simulation
+from . import DatabaseTestCase
+
+
+if numpy is not None:
+    class TestSimulation(DatabaseTestCase):
+        def setUp(self):
+            super(TestSimulation, self).setUp()
+            self.userledger = self.make_user()
+            self.ledgers = dict([(ledger.title, ledger) for ledger in Ledger.query.all()])
+            self.post([
+                (datetime(2013, 1, 5), u'Bank', u'Food', Decimal(10), False),
+                (datetime(2013, 1, 20), u'Salary', u'Bank', Decimal(500), False),
+                (datetime(2013, 2, 5), u'Bank', u'Rent', Decimal(200), True),
+                ])
+            db.session.commit()
+            self.rent = Transaction.query.filter_by(disabled=True).one()
+            self.food = Transaction.query.filter_by(datetime=datetime(2013, 1, 5)).one()
+
+        def transactions(self, rows):
+            return [{'commodity': self.userledger.commodity_id, 'datetime': when, 'disabled': disabled,
+                'splits': [(self.ledgers[debit], -value), (self.ledgers[credit], value)]}
+                for when, debit, credit, value, disabled in rows]
+
+        def post(self, rows):
+            post_transactions(self.transactions(rows))
+
+        def test_current(self):
+            simulation = Simulation(self.userledger)
+            projection = simulation.project()
+            balances = get_balances(self.userledger)
+            for ledger in self.ledgers.values():
+                self.assertEqual(projection.total(ledger.id), float(balances[ledger.id]))
+
+        def test_scheduled(self):
+            # A year of scheduled rent and salary, projected without posting
+            scheduled = [(datetime(2013, month, 1), u'Bank', u'Rent', Decimal(200), False)
+                for month in range(3, 13)] + [(datetime(2013, month, 28), u'Salary', u'Bank', Decimal('450.5'), False)
+                for month in range(2, 13)] + [(datetime(2013, 12, 31), u'Bank', u'Food', Decimal(99), True)]
+            before = get_balances(self.userledger)
+            simulation = Simulation(self.userledger)
+            projection = simulation.project(enable=[self.rent.id], disable=[self.food.id],
+                transactions=self.transactions(scheduled))
+            expected = dict([(ledger.id, before[ledger.id]) for ledger in self.ledgers.values()])
+            for when, debit, credit, value, disabled in scheduled + [
+                    (None, u'Bank', u'Rent', Decimal(200), False), (None, u'Food', u'Bank', Decimal(10), False)]:
+                if not disabled:
+                    expected[self.ledgers[debit].id] -= value
+                    expected[self.ledgers[credit].id] += value
+            for title in (u'Bank', u'Rent', u'Salary', u'Food', u'Cash'):
+                ledger = self.ledgers[title]
+                self.assertEqual(projection.balance(ledger.id), float(expected[ledger.id]))
+            self.assertEqual(projection.total(self.ledgers[u'Expenses'].id),
+                float(expected[self.ledgers[u'Rent'].id] + expected[self.ledgers[u'Food'].id]))
+            self.assertEqual(projection.total(self.userledger.id), 0)
+            # Posting the same transactions gives the same balances
+            self.assertEqual(get_balances(self.userledger), before)
+            self.post(scheduled)
+            db.session.query(Transaction).filter(Transaction.id == self.rent.id).update({'disabled': False})
+            db.session.query(Transaction).filter(Transaction.id == self.food.id).update({'disabled': True})
+            db.session.commit()
+            self.assertEqual(list(Simulation(self.userledger).balances), list(projection.balances))
+
+        def test_unknown(self):
+            simulation = Simulation(self.userledger)
+            self.assertRaises(KeyError, simulation.project, disable=[self.rent.id + 100])
@@ -0,0 +1,42 @@
+# -*- coding: utf-8 -*-
+
+from datetime import datetime
+from decimal import Decimal
+from pennywise.models import db, Ledger, LedgerSnapshot
+from pennywise.models import snapshot
+from . import DatabaseTestCase
+
+
+class TestSnapshots(DatabaseTestCase):
+    def setUp(self):
+        super(TestSnapshots, self).setUp()
+        self.make_user()
+        self.bank = Ledger.query.filter_by(title=u'Bank').one()
+        self.start = datetime(2013, 1, 1)
+
+    def _values(self):
+        db.session.expire_all()
+        return dict([((row.ledger_id, row.start), row.value) for row in LedgerSnapshot.query])
+
+    def _add_twice(self):
+        LedgerSnapshot.add_values({(self.bank.id, self.start): Decimal('2.5')})
+        LedgerSnapshot.add_values({(self.bank.id, self.start): Decimal('1'),
+            (self.bank.id, datetime(2013, 2, 1)): Decimal('-1')})
+        self.assertEqual(self._values(), {(self.bank.id, self.start): Decimal('3.5'),
+            (self.bank.id, datetime(2013, 2, 1)): Decimal('-1')})
+
+    def test_add_values(self):
+        self._add_twice()
+
+    def test_add_values_without_upsert(self):
+        upsert = snapshot._upsert
+        snapshot._upsert = lambda connection: None
+        try:
+            self._add_twice()
+        finally:
+            snapshot._upsert = upsert
+
+    def test_add_value(self):
+        LedgerSnapshot.add_value(self.bank, datetime(2013, 1, 15), Decimal('4'))
+        LedgerSnapshot.add_value(self.bank, datetime(2013, 1, 20), Decimal('-1'))
+        self.assertEqual(self._values(), {(self.bank.id, self.start): Decimal('3')})
@@ -0,0 +1,53 @@
+# -*- coding: utf-8 -*-
+
+import unittest
+from pennywise.models import db, Commodity, Ledger, LEDGER_TYPE
+from pennywise.ledgers import get_ledgers, make_default_ledgers
+from pennywise.standalone import create_session, create_tables, use_session
+from . import DatabaseTestCase
+
+
+class TestUseSession(unittest.TestCase):
+    def setUp(self):
+        self.outer = create_session('sqlite://')
+        self.inner = create_session('sqlite://')
+
+    def tearDown(self):
+        db.session.registry.clear()
+        for session in (self.outer, self.inner):
+            session.close()
+            session.bind.dispose()
+
+    def test_nested(self):
+        with use_session(self.outer):
+            with use_session(self.inner):
+                self.assertTrue(db.session() is self.inner)
+            self.assertTrue(db.session() is self.outer)
+        self.assertFalse(db.session.registry.has())
+
+    def test_ledgers(self):
+        create_tables(self.outer.bind)
+        with use_session(self.outer):
+            commodity = Commodity.get_or_create(0, u'INR')
+            userledger = Ledger(title=u'User', ledger_type=LEDGER_TYPE.USER, commodity=commodity)
+            self.outer.add(userledger)
+            make_default_ledgers(userledger)
+            self.outer.flush()
+            self.assertEqual(get_ledgers(userledger)[0]['url'], None)
+
+
+class TestFlaskURLs(DatabaseTestCase):
+    def test_no_request(self):
+        # Scripts run in an app context but outside any request
+        self.assertEqual(get_ledgers(self.make_user())[0]['url'], None)
+
+    def test_no_view(self):
+        userledger = self.make_user()
+        with self.app.test_request_context():
+            self.assertEqual(get_ledgers(userledger)[0]['url'], None)
+
+    def test_view(self):
+        userledger = self.make_user()
+        self.app.add_url_rule('/ledger/<uuid>', 'ledger')
+        with self.app.test_request_context():
+            self.assertEqual(get_ledgers(userledger)[0]['url'], '/ledger/' + userledger.uuid)